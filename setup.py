@@ -58,6 +58,9 @@ setup(
         'dev': [
             'Sphinx==1.4.3',
             'ghp-import==0.4.1',
+            'moto',
+            'pyftpdlib',
+            'pytest',
             'sphinx_rtd_theme==0.1.9',
             'zest.releaser[recommended]==6.6.4',
         ]
@@ -6,6 +6,7 @@ import click
 from . import config
 from . import github
 from . import log
+from . import metrics
 from . import notifications
 from . import util
 
@@ -36,6 +37,7 @@ def root_command(ctx, log_level, base_path):
                                 '{}.log'.format(__package__))
     command_context.logfile_path = logfile_path
     log.setup_logging(logfile_path, log_level=log_level)
+    metrics.set_path(os.path.join(base_path, 'logs', 'metrics.jsonl'))
 
 
 @root_command.command()
@@ -1,15 +1,14 @@
-import click
-
-from . import install
-from . import notifications
+# Imported to register their commands with the root command.
+from . import install  # noqa
+from . import notifications  # noqa
 from . import root_command
-from . import runcommand
+from . import runcommand  # noqa
+
 
+def cli():
+    return root_command(obj={})
 
-cli = click.CommandCollection(sources=[
-    install,
-    notifications,
-    runcommand
-])
 
-cli = root_command(obj={})
+# Process pools start a fork server, which imports the main module.
+if __name__ == '__main__':
+    cli()
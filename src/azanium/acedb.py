@@ -0,0 +1,250 @@
+import collections
+import concurrent.futures
+import glob
+import gzip
+import os
+import re
+import time
+
+import psutil
+
+from . import compress
+from . import log
+from . import metrics
+from . import util
+
+
+logger = log.get_logger(namespace=__name__)
+
+AceClass = collections.namedtuple('AceClass', ('name', 'count'))
+
+# Options of the tace ``Dump`` command dumping the whole database.
+DUMP_OPTIONS = '-s -T -C'
+
+# Options of the tace ``Show`` command dumping each class of a sharded dump.
+SHOW_OPTIONS = '-a -T'
+
+# Classes holding data which are built into ACeDB rather than modelled.
+BUILTIN_DATA_CLASSES = ('DNA', 'LongText', 'Peptide')
+
+# ``Classes`` lists one or more "<class> <count>" columns per line.
+_classes_line = re.compile(r'^(?:\s*[A-Za-z]\w*\s+\d+)+\s*$')
+
+_class_count = re.compile(r'(?P<name>[A-Za-z]\w*)\s+(?P<count>\d+)')
+
+_model_class = re.compile(r'^\?(?P<name>\w+)', re.MULTILINE)
+
+
+class AceDumpError(Exception):
+    """Raised when a sharded dump does not contain every ACeDB object."""
+
+
+def tace(db_directory, commands):
+    """Run `commands` through a ``tace`` process against `db_directory`.
+
+    :param db_directory: Path to the ACeDB database.
+    :type db_directory: str
+    :param commands: The tace commands to execute, in order.
+    :type commands: sequence of str
+    :returns: The output of tace.
+    """
+    script = os.linesep.join(list(commands) + ['Quit', ''])
+    return util.local('tace ' + db_directory, input=script)
+
+
+def parse_classes(output):
+    """Parse the output of the tace ``Classes`` command.
+
+    :returns: Mapping of class name to number of objects.
+    :rtype: collections.OrderedDict
+    """
+    counts = collections.OrderedDict()
+    for line in output.splitlines():
+        line = re.sub(r'^(?:acedb>\s*)+', '', line)
+        if _classes_line.match(line):
+            for match in _class_count.finditer(line):
+                counts[match.group('name')] = int(match.group('count'))
+    return counts
+
+
+def model_classes(db_directory):
+    """Returns the names of the classes holding the data of the database:
+    the classes of its models, and the data classes built into ACeDB.
+    """
+    models_path = os.path.join(db_directory, 'wspec', 'models.wrm')
+    try:
+        with open(models_path, errors='replace') as fp:
+            models = fp.read()
+    except OSError as err:
+        raise AceDumpError('Cannot read the ACeDB models: {}'.format(err))
+    names = set(match.group('name')
+                for match in _model_class.finditer(models))
+    return names.union(BUILTIN_DATA_CLASSES)
+
+
+def list_classes(db_directory):
+    """List the ACeDB classes holding objects, with their object counts.
+
+    System classes (e.g sessions and models) are excluded, as they are
+    by the ``Dump`` command.
+
+    :returns: list of ``AceClass``, largest first.
+    """
+    counts = parse_classes(tace(db_directory, ['Classes']))
+    data_classes = model_classes(db_directory)
+    skipped = sorted(name for name in counts if name not in data_classes)
+    if skipped:
+        logger.info('Not dumping system classes: {}', ', '.join(skipped))
+    classes = [AceClass(name=name, count=count)
+               for (name, count) in counts.items()
+               if count and name in data_classes]
+    return sorted(classes, key=lambda ace_class: ace_class.count,
+                  reverse=True)
+
+
+def dump_classes(db_directory, classes, dump_dir, show_options=SHOW_OPTIONS):
+    """Dump each of `classes` into its own ``<class>.ace`` in `dump_dir`."""
+    commands = []
+    for ace_class in classes:
+        out_path = os.path.join(dump_dir, ace_class.name + '.ace')
+        commands.append('Find ' + ace_class.name)
+        commands.append(' '.join(['Show', show_options, '-f', out_path]))
+    tace(db_directory, commands)
+
+
+def count_objects(dump_dir, class_names):
+    """Count the objects of each of `class_names` in the .ace (or .ace.gz)
+    files of `dump_dir`.
+
+    :returns: Mapping of class name to number of objects.
+    :rtype: collections.Counter
+    """
+    names = set(class_names)
+    object_line = re.compile(r'^(?P<name>\S+) : ')
+    counts = collections.Counter()
+    paths = glob.glob(os.path.join(dump_dir, '*.ace'))
+    paths.extend(glob.glob(os.path.join(dump_dir, '*.ace.gz')))
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, mode='rt', errors='replace') as fp:
+            for line in fp:
+                match = object_line.match(line)
+                if match and match.group('name') in names:
+                    counts[match.group('name')] += 1
+    return counts
+
+
+def verify_dump(dump_dir, classes):
+    """Check that `dump_dir` holds the objects reported by tace for each of
+    `classes`, as a single-process dump would.
+
+    Only the number of objects of each class is compared (by the object
+    header lines), not their names nor their content.
+
+    :raises: AceDumpError listing the classes whose object counts differ.
+    """
+    counts = count_objects(dump_dir, (c.name for c in classes))
+    mismatch_fmt = '{} (expected {:d}, dumped {:d})'.format
+    mismatched = [mismatch_fmt(c.name, c.count, counts[c.name])
+                  for c in classes if counts[c.name] != c.count]
+    if mismatched:
+        raise AceDumpError('Incomplete ACeDB dump in {}: {}'.format(
+            dump_dir, ', '.join(mismatched)))
+    logger.info('Verified {:d} objects in {:d} classes in {}',
+                sum(counts.values()),
+                len(classes),
+                dump_dir)
+
+
+def sharded_dump(db_directory, dump_dir, n_procs, verify=True):
+    """Dump the ACeDB database with `n_procs` concurrent tace processes.
+
+    Classes are partitioned by object count, such that each tace process
+    dumps a similar number of objects into `dump_dir`.
+    Each class is dumped with ``Show`` (see `SHOW_OPTIONS`) into its own
+    file, as ``Dump -s`` would; the files hold the same objects, though
+    not necessarily byte for byte the output of ``Dump``.
+    Unless `verify` is false, the result is verified against the object
+    counts reported by tace.
+
+    :returns: The list of dumped ``AceClass``.
+    """
+    classes = list_classes(db_directory)
+    shards = util.partition_by_size(classes, n_procs,
+                                    lambda ace_class: ace_class.count)
+    logger.info('Dumping {:d} ACeDB classes to {} with {:d} tace processes',
+                len(classes),
+                dump_dir,
+                len(shards))
+    with concurrent.futures.ThreadPoolExecutor(len(shards)) as executor:
+        futures = [executor.submit(metrics.bind(dump_classes),
+                                   db_directory,
+                                   shard,
+                                   dump_dir)
+                   for shard in shards]
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+    if verify:
+        verify_dump(dump_dir, classes)
+    return classes
+
+
+def _child_open_paths():
+    """Returns the paths of all files open by child processes (e.g tace)."""
+    paths = set()
+    for proc in psutil.Process().children(recursive=True):
+        try:
+            paths.update(f.path for f in proc.open_files())
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    return paths
+
+
+def dump_and_compress(dump, dump_dir, n_procs=None, poll_interval=2.0):
+    """Run `dump` while compressing each .ace file as soon as it is complete.
+
+    `dump_dir` is polled for .ace files; a file is handed to the
+    compressor once no child process has it open anymore, so that
+    compression overlaps with the dump and the uncompressed files do not
+    all accumulate on disk.
+    Should the dump fail, the files left are not compressed, since they
+    may be incomplete.
+
+    :param dump: Callable that dumps the ACeDB database into `dump_dir`.
+    :type dump: callable
+    :param n_procs: Number of compression processes.
+    :type n_procs: int
+    :returns: The result of `dump`.
+    """
+    submitted = set()
+    results = []
+    ace_glob = os.path.join(os.path.realpath(dump_dir), '*.ace')
+    with concurrent.futures.ThreadPoolExecutor(1) as dumper, \
+            compress.ParallelGzip(n_procs=n_procs) as pgz:
+        dumping = dumper.submit(metrics.bind(dump))
+        while True:
+            dump_finished = dumping.done()
+            if dump_finished and dumping.exception() is not None:
+                logger.error('Dump into {} failed, leaving {:d} files '
+                             'uncompressed',
+                             dump_dir,
+                             len(set(glob.glob(ace_glob)) - submitted))
+                break
+            # List the directory before checking for open files, since a
+            # file is created by tace opening it.
+            ace_paths = set(glob.glob(ace_glob))
+            if not dump_finished:
+                ace_paths -= _child_open_paths()
+            for path in sorted(ace_paths - submitted):
+                submitted.add(path)
+                results.append(pgz.submit(path))
+            if dump_finished:
+                break
+            time.sleep(poll_interval)
+        dump_result = dumping.result()
+        for future in concurrent.futures.as_completed(results):
+            future.result()
+    logger.info('Dumped and compressed {:d} files in {}',
+                len(results),
+                dump_dir)
+    return dump_result
@@ -0,0 +1,388 @@
+import collections
+import functools
+import hashlib
+import lzma
+import os
+import shutil
+import subprocess
+import tarfile
+import threading
+import time
+
+import psutil
+
+from . import config
+from . import log
+from . import util
+
+
+logger = log.get_logger(namespace=__name__)
+
+# xz: xz streams compressed in parallel in-process (concatenated streams
+#     are read by xz, tar -J and Python's lzma as a single .xz file).
+# xz-cli: the ``xz -T`` command.
+# zstd: the ``zstd -T`` command.
+ENGINES = collections.OrderedDict([
+    ('xz', '.tar.xz'),
+    ('xz-cli', '.tar.xz'),
+    ('zstd', '.tar.zst')])
+
+DEFAULT_ENGINE = 'xz'
+
+DEFAULT_LEVELS = {'xz': 6, 'xz-cli': 6, 'zstd': 10}
+
+CHUNK_SIZE = 32 * 2 ** 20
+
+COPY_BUFSIZE = 2 ** 20
+
+
+class ArchiveError(Exception):
+    """Raised when an archive could not be written."""
+
+
+class ArchiveResult(collections.namedtuple('ArchiveResult',
+                                           ('path',
+                                            'engine',
+                                            'level',
+                                            'threads',
+                                            'in_bytes',
+                                            'out_bytes',
+                                            'seconds',
+                                            'sha256'))):
+    __slots__ = ()
+
+    @property
+    def ratio(self):
+        return self.out_bytes / self.in_bytes if self.in_bytes else 1.0
+
+    @property
+    def throughput(self):
+        """Input (tar) bytes archived per second."""
+        return self.in_bytes / max(self.seconds, 1e-6)
+
+
+def settings(engine=None, level=None, threads=None):
+    """Complete the archive settings given from the configuration.
+
+    Settings not given are read from the ``[azanium.archive]`` section
+    (``engine``, ``level`` and ``threads``), or default to the
+    in-process xz engine, its default level and all CPUs.
+
+    :returns: engine, level and threads.
+    :rtype: tuple
+    """
+    conf = config.parse().get(__name__, {})
+    engine = engine or conf.get('engine', DEFAULT_ENGINE)
+    if engine not in ENGINES:
+        raise ArchiveError('Unknown archive engine: {}'.format(engine))
+    if level is None:
+        level = int(conf.get('level', DEFAULT_LEVELS[engine]))
+    if threads is None:
+        threads = int(conf.get('threads', psutil.cpu_count()))
+    return (engine, level, threads)
+
+
+def archive_filename(name, engine=DEFAULT_ENGINE):
+    return name + ENGINES[engine]
+
+
+class _CountingWriter:
+    """Counts and hashes the bytes written through it to `fp`."""
+
+    def __init__(self, fp, hash_bytes=False):
+        self.fp = fp
+        self.n_bytes = 0
+        self.digest = hashlib.sha256() if hash_bytes else None
+
+    def write(self, data):
+        self.n_bytes += len(data)
+        if self.digest is not None:
+            self.digest.update(data)
+        return self.fp.write(data)
+
+
+def _xz_chunk(data, preset):
+    return lzma.compress(data, format=lzma.FORMAT_XZ, preset=preset)
+
+
+class _ParallelXzWriter:
+    """Compresses the data written into xz streams using a pool of processes.
+
+    The data is split into chunks of `chunk_size` bytes, each compressed
+    as a separate xz stream, and written to `fp` in order.
+    """
+
+    def __init__(self, fp, procs, n_procs, preset, chunk_size=CHUNK_SIZE):
+        self.fp = fp
+        self.procs = procs
+        self.max_in_flight = n_procs * 2
+        self.chunk_size = chunk_size
+        self._compress = functools.partial(_xz_chunk, preset=preset)
+        self._buffer = bytearray()
+        self._in_flight = collections.deque()
+        self._n_chunks = 0
+
+    def _submit(self, chunk):
+        self._in_flight.append(self.procs.submit(self._compress, chunk))
+        self._n_chunks += 1
+        while len(self._in_flight) > self.max_in_flight:
+            self.fp.write(self._in_flight.popleft().result())
+
+    def write(self, data):
+        self._buffer.extend(data)
+        while len(self._buffer) >= self.chunk_size:
+            self._submit(bytes(self._buffer[:self.chunk_size]))
+            del self._buffer[:self.chunk_size]
+        return len(data)
+
+    def close(self):
+        if self._buffer or not self._n_chunks:
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+        while self._in_flight:
+            self.fp.write(self._in_flight.popleft().result())
+
+
+def _write_tar(src_dir, arcname, fp):
+    with tarfile.open(fileobj=fp, mode='w|') as tf:
+        tf.add(src_dir, arcname=arcname)
+
+
+def _close_stdin(proc):
+    try:
+        proc.stdin.close()
+    except BrokenPipeError:
+        # the process exited (or was killed) before reading all of it
+        pass
+
+
+def _cli_command(engine, level, threads):
+    if engine == 'xz-cli':
+        return ['xz', '-T{:d}'.format(threads), '-{:d}'.format(level), '-c']
+    cmd = ['zstd', '-T{:d}'.format(threads), '-{:d}'.format(level), '-c']
+    if level > 19:
+        cmd.insert(1, '--ultra')
+    return cmd
+
+
+def _write_with_cli(src_dir, arcname, out_fp, engine, level, threads):
+    cmd = _cli_command(engine, level, threads)
+    if shutil.which(cmd[0]) is None:
+        raise ArchiveError('{} not found, required by the {} archive '
+                           'engine'.format(cmd[0], engine))
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    errors = []
+
+    def feed():
+        try:
+            _write_tar(src_dir, arcname, tar_writer)
+        except Exception as err:
+            errors.append(err)
+        finally:
+            _close_stdin(proc)
+
+    tar_writer = _CountingWriter(proc.stdin)
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    try:
+        for data in iter(functools.partial(proc.stdout.read, COPY_BUFSIZE),
+                         b''):
+            out_fp.write(data)
+    except BaseException:
+        # Otherwise the process blocks writing its output, and the feeder
+        # writing its input.
+        proc.kill()
+        raise
+    finally:
+        proc.stdout.close()
+        feeder.join()
+        returncode = proc.wait()
+    if errors:
+        raise errors[0]
+    if returncode != 0:
+        raise ArchiveError('{} exited with status {:d}'.format(' '.join(cmd),
+                                                               returncode))
+    return tar_writer.n_bytes
+
+
+def write_archive(src_dir, arcname, out_fp, engine=None, level=None,
+                  threads=None, chunk_size=CHUNK_SIZE):
+    """Write a compressed tar archive of `src_dir` to the file object `out_fp`.
+
+    :param arcname: The name of `src_dir` in the archive.
+    :param engine: The archive engine, one of ``ENGINES``.
+    :param level: The compression level.
+    :param threads: The number of threads (or processes) compressing.
+    :returns: The number of (uncompressed) tar bytes archived.
+    :rtype: int
+    """
+    (engine, level, threads) = settings(engine, level, threads)
+    if engine != 'xz':
+        return _write_with_cli(src_dir, arcname, out_fp,
+                               engine, level, threads)
+    with util.process_pool(threads) as procs:
+        xz_writer = _ParallelXzWriter(out_fp,
+                                      procs,
+                                      threads,
+                                      preset=level,
+                                      chunk_size=chunk_size)
+        tar_writer = _CountingWriter(xz_writer)
+        _write_tar(src_dir, arcname, tar_writer)
+        xz_writer.close()
+    return tar_writer.n_bytes
+
+
+def archive_to(src_dir, arcname, fp, name, engine=None, level=None,
+               threads=None):
+    """Write a compressed tar archive of `src_dir` to the file object `fp`,
+    measuring its size, SHA-256 and the time taken.
+
+    :param name: The name of the archive (e.g a path or URL) in the result.
+    :rtype: ArchiveResult
+    """
+    (engine, level, threads) = settings(engine, level, threads)
+    started = time.time()
+    out = _CountingWriter(fp, hash_bytes=True)
+    in_bytes = write_archive(src_dir, arcname, out,
+                             engine=engine, level=level, threads=threads)
+    result = ArchiveResult(path=name,
+                           engine=engine,
+                           level=level,
+                           threads=threads,
+                           in_bytes=in_bytes,
+                           out_bytes=out.n_bytes,
+                           seconds=time.time() - started,
+                           sha256=out.digest.hexdigest())
+    logger.info('Archived {} to {} with {} (level {:d}, {:d} threads): '
+                '{:.1f} MB in {:.1f}s ({:.1f} MB/s, ratio {:.3f})',
+                src_dir,
+                name,
+                engine,
+                level,
+                threads,
+                in_bytes / 2 ** 20,
+                result.seconds,
+                result.throughput / 2 ** 20,
+                result.ratio)
+    return result
+
+
+def create_archive(src_dir, arcname, out_path, engine=None, level=None,
+                   threads=None):
+    """Create the compressed tar archive `out_path` of `src_dir`.
+
+    The archive is written to a ``.part`` file, renamed when complete,
+    and removed should archiving fail.
+
+    :rtype: ArchiveResult
+    """
+    partial_path = out_path + '.part'
+    try:
+        with open(partial_path, 'wb') as fp:
+            result = archive_to(src_dir, arcname, fp, out_path,
+                                engine=engine, level=level, threads=threads)
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    os.rename(partial_path, out_path)
+    return result
+
+
+def engine_for(filename):
+    """Returns the archive engine reading `filename`, by its extension."""
+    for (engine, extension) in ENGINES.items():
+        if filename.endswith(extension):
+            return engine
+    raise ArchiveError('Not an archive: {}'.format(filename))
+
+
+def _decompress_command(engine, threads):
+    if engine == 'xz-cli':
+        return ['xz', '-d', '-T{:d}'.format(threads), '-c']
+    return ['zstd', '-d', '-c']
+
+
+def _extract_with_cli(fp, dest_dir, engine, threads):
+    cmd = _decompress_command(engine, threads)
+    if shutil.which(cmd[0]) is None:
+        raise ArchiveError('{} not found, required by the {} archive '
+                           'engine'.format(cmd[0], engine))
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    errors = []
+
+    def feed():
+        try:
+            for data in iter(functools.partial(fp.read, COPY_BUFSIZE), b''):
+                proc.stdin.write(data)
+        except Exception as err:
+            errors.append(err)
+        finally:
+            _close_stdin(proc)
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    try:
+        util.extract_tar_stream(proc.stdout, dest_dir, mode='r|')
+        # drain the padding after the end of the archive
+        for data in iter(functools.partial(proc.stdout.read, COPY_BUFSIZE),
+                         b''):
+            pass
+    except BaseException:
+        # as in _write_with_cli
+        proc.kill()
+        raise
+    finally:
+        proc.stdout.close()
+        feeder.join()
+        returncode = proc.wait()
+    if errors:
+        raise errors[0]
+    if returncode != 0:
+        raise ArchiveError('{} exited with status {:d}'.format(' '.join(cmd),
+                                                               returncode))
+
+
+def extract_archive(fp, dest_dir, engine=DEFAULT_ENGINE, threads=None):
+    """Extract the compressed tar archive read from the file object `fp`
+    into `dest_dir`, decompressing it as it is read.
+
+    The ``xz`` engine decompresses in-process (reading all the
+    concatenated streams written by ``write_archive``), the others
+    with their command.
+    """
+    (engine, _, threads) = settings(engine, threads=threads)
+    if engine != 'xz':
+        _extract_with_cli(fp, dest_dir, engine, threads)
+        return
+    with lzma.open(fp) as xz_fp:
+        util.extract_tar_stream(xz_fp, dest_dir, mode='r|')
+        # drain the padding after the end of the archive
+        for data in iter(functools.partial(xz_fp.read, COPY_BUFSIZE), b''):
+            pass
+
+
+def benchmark(src_dir, out_dir, configurations):
+    """Archive `src_dir` with each of the (engine, level, threads)
+    `configurations`, removing each archive once measured.
+
+    :returns: The ``ArchiveResult`` of each configuration.
+    :rtype: list
+    """
+    results = []
+    arcname = os.path.basename(os.path.normpath(src_dir))
+    for (engine, level, threads) in configurations:
+        out_path = os.path.join(out_dir,
+                                'benchmark-{}-{}-{}{}'.format(engine,
+                                                              level,
+                                                              threads,
+                                                              ENGINES[engine]))
+        try:
+            results.append(create_archive(src_dir, arcname, out_path,
+                                          engine=engine,
+                                          level=level,
+                                          threads=threads))
+        finally:
+            if os.path.exists(out_path):
+                os.remove(out_path)
+    return results
@@ -1,10 +1,16 @@
 import collections
 import functools
+import hashlib
+import json
 import os
+import shutil
 import tempfile
+import threading
+import time
 
 import click
 
+from . import config
 from . import util
 
 Info = collections.namedtuple('Info', ('download_dir',
@@ -12,12 +18,24 @@ Info = collections.namedtuple('Info', ('download_dir',
                                        'version'))
 DOWNLOAD_DIR = '/tmp/downloads'
 
+CACHE_DIR = os.path.expanduser('~/.cache/azanium')
+
+CACHE_MAX_GB = 100
+
+
+def release_download_dir():
+    """Returns the download directory for the configured data release.
+
+    The directory is stable across runs, such that interrupted downloads
+    can be resumed.
+    """
+    release = util.get_data_release_version() or 'unreleased'
+    return os.path.join(DOWNLOAD_DIR, release)
+
+
 def prepare(cmd_ctx, func):
     f_name = func.__name__
-    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
-    tmpdir = tempfile.mkdtemp(suffix='-db-migration-downloads',
-                              dir=DOWNLOAD_DIR)
-    download_dir = os.path.join(tmpdir, f_name)
+    download_dir = os.path.join(release_download_dir(), f_name)
     install_dir = cmd_ctx.path(f_name)
     version = util.get_deploy_versions()[f_name]
     for path in (download_dir, install_dir):
@@ -42,3 +60,175 @@ def prepared(func):
     # def command_proxy(*args, **kw):
     #     return functools.partial(cmd_proxy, *args, **kw)
     return functools.update_wrapper(cmd_proxy, func)
+
+
+def _link_or_copy(src, dst):
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class Cache:
+    """Persistent content-addressed store of downloaded artefacts.
+
+    Artefacts are looked up by source URL and version.
+    Each entry refers to a blob named by the SHA-256 checksum of its
+    content, such that identical content is only stored once.
+    The least recently used entries are evicted once the blobs exceed
+    `max_bytes`.
+    """
+
+    def __init__(self, path=CACHE_DIR, max_bytes=CACHE_MAX_GB * 2 ** 30,
+                 logger=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.logger = logger
+        self._lock = threading.RLock()
+        for dirname in ('blobs', 'index'):
+            os.makedirs(os.path.join(path, dirname), exist_ok=True)
+
+    def _log(self, msg, *args):
+        if self.logger is not None:
+            self.logger.info(msg, *args)
+
+    def _index_path(self, url, version):
+        key = hashlib.sha256('{}\0{}'.format(url, version).encode('utf-8'))
+        return os.path.join(self.path, 'index', key.hexdigest() + '.json')
+
+    def _blob_path(self, checksum):
+        return os.path.join(self.path, 'blobs', checksum)
+
+    def _read_entries(self):
+        index_dir = os.path.join(self.path, 'index')
+        for filename in os.listdir(index_dir):
+            index_path = os.path.join(index_dir, filename)
+            try:
+                with open(index_path) as fp:
+                    yield (index_path, json.load(fp))
+            except (OSError, ValueError):
+                continue
+
+    def _write_entry(self, index_path, entry):
+        with tempfile.NamedTemporaryFile(mode='w',
+                                         dir=os.path.dirname(index_path),
+                                         delete=False) as fp:
+            json.dump(entry, fp)
+        os.rename(fp.name, index_path)
+
+    def lookup(self, url, version):
+        """Returns the path to the cached blob for `url` at `version`.
+
+        The blob's content is checked against its checksum when its
+        size or modification time differ from those recorded in the
+        index; a blob that does not match (e.g written to through a
+        hard link) is removed.
+
+        :returns: The blob path, or None if not cached.
+        """
+        index_path = self._index_path(url, version)
+        with self._lock:
+            try:
+                with open(index_path) as fp:
+                    entry = json.load(fp)
+            except (OSError, ValueError):
+                return None
+            blob_path = self._blob_path(entry['sha256'])
+            try:
+                stat = os.stat(blob_path)
+            except OSError:
+                stat = None
+            if stat is None or stat.st_size != entry['size']:
+                os.remove(index_path)
+                return None
+            if stat.st_mtime_ns != entry.get('mtime_ns'):
+                if util.sha256sum(blob_path) != entry['sha256']:
+                    if self.logger is not None:
+                        self.logger.warning('Cached {} (version: {}) is '
+                                            'corrupt, removing it',
+                                            url, version)
+                    os.remove(blob_path)
+                    os.remove(index_path)
+                    return None
+                entry['mtime_ns'] = stat.st_mtime_ns
+            entry['last_used'] = time.time()
+            self._write_entry(index_path, entry)
+        return blob_path
+
+    def store(self, url, version, path):
+        """Adds the file at `path` to the cache as `url` at `version`.
+
+        :returns: The blob path.
+        """
+        checksum = util.sha256sum(path)
+        blob_path = self._blob_path(checksum)
+        with self._lock:
+            if not os.path.isfile(blob_path):
+                _link_or_copy(path, blob_path)
+            stat = os.stat(blob_path)
+            entry = dict(url=url,
+                         version=version,
+                         sha256=checksum,
+                         size=stat.st_size,
+                         mtime_ns=stat.st_mtime_ns,
+                         last_used=time.time())
+            self._write_entry(self._index_path(url, version), entry)
+            self._log('Cached {} (version: {}) as {}', url, version, checksum)
+            self.evict(keep=checksum)
+        return blob_path
+
+    def fetch(self, url, version, local_path, download):
+        """Provide the artefact for `url` at `version` at `local_path`.
+
+        On a cache miss, ``download(local_path)`` is called to obtain
+        the artefact, which is then added to the cache.
+        A file at `local_path` linked to a blob is removed beforehand,
+        so that `download` cannot write to the blob.
+
+        :returns: `local_path`
+        """
+        blob_path = self.lookup(url, version)
+        if blob_path is None:
+            if (os.path.isfile(local_path) and
+                    os.stat(local_path).st_nlink > 1):
+                os.remove(local_path)
+            download(local_path)
+            self.store(url, version, local_path)
+        else:
+            self._log('Using cached {} (version: {})', url, version)
+            _link_or_copy(blob_path, local_path)
+        return local_path
+
+    def evict(self, keep=None):
+        """Removes least recently used entries until within `max_bytes`."""
+        with self._lock:
+            entries = sorted(self._read_entries(),
+                             key=lambda item: item[1]['last_used'])
+            blob_sizes = {entry['sha256']: entry['size']
+                          for (_, entry) in entries}
+            refcounts = collections.Counter(entry['sha256']
+                                            for (_, entry) in entries)
+            total = sum(blob_sizes.values())
+            for (index_path, entry) in entries:
+                if total <= self.max_bytes:
+                    break
+                checksum = entry['sha256']
+                if checksum == keep:
+                    continue
+                os.remove(index_path)
+                self._log('Evicted {} from cache', entry['url'])
+                refcounts[checksum] -= 1
+                if refcounts[checksum] == 0:
+                    total -= blob_sizes[checksum]
+                    os.remove(self._blob_path(checksum))
+
+
+def get_cache(logger=None):
+    """Returns the artefact cache, as configured for this package."""
+    conf = config.parse().get(__name__, {})
+    max_gb = float(conf.get('cache_max_gb', CACHE_MAX_GB))
+    return Cache(path=conf.get('cache_dir', CACHE_DIR),
+                 max_bytes=int(max_gb * 2 ** 30),
+                 logger=logger)
@@ -0,0 +1,162 @@
+import collections
+import concurrent.futures
+import functools
+import gzip
+import hashlib
+import os
+import time
+
+import psutil
+
+from . import log
+from . import util
+
+
+logger = log.get_logger(namespace=__name__)
+
+CHUNK_SIZE = 32 * 2 ** 20
+
+COMPRESS_LEVEL = 6
+
+
+class CompressResult(collections.namedtuple('CompressResult',
+                                            ('path',
+                                             'out_path',
+                                             'in_bytes',
+                                             'out_bytes',
+                                             'seconds',
+                                             'sha256'))):
+    __slots__ = ()
+
+    @property
+    def ratio(self):
+        return self.out_bytes / self.in_bytes if self.in_bytes else 1.0
+
+    @property
+    def throughput(self):
+        """Input bytes compressed per second."""
+        return self.in_bytes / max(self.seconds, 1e-6)
+
+
+def _gzip_chunk(data, level):
+    return gzip.compress(data, compresslevel=level)
+
+
+class ParallelGzip:
+    """Compresses files with gzip using a pool of processes.
+
+    Each file is read in chunks of `chunk_size` bytes which are compressed
+    in parallel as separate gzip members, then written out in order.
+    Up to twice as many chunks as processes are in flight per file, so
+    that a single large file keeps all of the processes busy.
+    The concatenated members form a valid gzip file, which ``gunzip`` and
+    Java's ``GZIPInputStream`` read back as a single stream.
+
+    Like ``gzip``, each input file is replaced by a ``.gz`` file.
+    """
+
+    def __init__(self, n_procs=None, chunk_size=CHUNK_SIZE,
+                 level=COMPRESS_LEVEL):
+        self.n_procs = n_procs or psutil.cpu_count()
+        self.chunk_size = chunk_size
+        self.level = level
+        self.max_in_flight = self.n_procs * 2
+        self._procs = util.process_pool(self.n_procs)
+        self._files = concurrent.futures.ThreadPoolExecutor(self.n_procs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.shutdown()
+
+    def shutdown(self):
+        self._files.shutdown()
+        self._procs.shutdown()
+
+    def submit(self, path):
+        """Schedule `path` for compression.
+
+        :returns: A future for the ``CompressResult``.
+        :rtype: concurrent.futures.Future
+        """
+        return self._files.submit(self.compress, path)
+
+    def compress(self, path):
+        """Compress `path` into `path`.gz, removing `path` when done.
+
+        :rtype: CompressResult
+        """
+        started = time.time()
+        out_path = path + '.gz'
+        partial_path = out_path + '.part'
+        compress_chunk = functools.partial(_gzip_chunk, level=self.level)
+        in_flight = collections.deque()
+        in_bytes = 0
+        digest = hashlib.sha256()
+        with open(path, 'rb') as src, open(partial_path, 'wb') as dst:
+
+            def write(data):
+                digest.update(data)
+                dst.write(data)
+
+            read_chunk = functools.partial(src.read, self.chunk_size)
+            for chunk in iter(read_chunk, b''):
+                in_bytes += len(chunk)
+                in_flight.append(self._procs.submit(compress_chunk, chunk))
+                if len(in_flight) > self.max_in_flight:
+                    write(in_flight.popleft().result())
+            while in_flight:
+                write(in_flight.popleft().result())
+            if not in_bytes:
+                write(compress_chunk(b''))
+        os.rename(partial_path, out_path)
+        os.remove(path)
+        result = CompressResult(path=path,
+                                out_path=out_path,
+                                in_bytes=in_bytes,
+                                out_bytes=os.path.getsize(out_path),
+                                seconds=time.time() - started,
+                                sha256=digest.hexdigest())
+        logger.info('Compressed {} ({:.1f} MB) in {:.1f}s '
+                    '({:.1f} MB/s, ratio {:.3f})',
+                    path,
+                    result.in_bytes / 2 ** 20,
+                    result.seconds,
+                    result.throughput / 2 ** 20,
+                    result.ratio)
+        return result
+
+
+def compress_files(paths, n_procs=None, chunk_size=CHUNK_SIZE,
+                   level=COMPRESS_LEVEL, on_complete=None):
+    """Compress `paths` in parallel, largest files first.
+
+    :param on_complete: Optional callable, called in the calling thread
+                        with each ``CompressResult`` as it completes.
+    :type on_complete: callable
+    :returns: The ``CompressResult`` for each file, in completion order.
+    :rtype: list
+    """
+    paths = sorted(paths, key=os.path.getsize, reverse=True)
+    started = time.time()
+    results = []
+    with ParallelGzip(n_procs=n_procs,
+                      chunk_size=chunk_size,
+                      level=level) as pgz:
+        futures = [pgz.submit(path) for path in paths]
+        for future in concurrent.futures.as_completed(futures):
+            results.append(future.result())
+            if on_complete is not None:
+                on_complete(results[-1])
+    elapsed = max(time.time() - started, 1e-6)
+    in_bytes = sum(r.in_bytes for r in results)
+    out_bytes = sum(r.out_bytes for r in results)
+    logger.info('Compressed {:d} files ({:.1f} MB to {:.1f} MB) '
+                'in {:.1f}s ({:.1f} MB/s)',
+                len(results),
+                in_bytes / 2 ** 20,
+                out_bytes / 2 ** 20,
+                elapsed,
+                in_bytes / 2 ** 20 / elapsed)
+    return results
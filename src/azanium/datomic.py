@@ -1,28 +1,308 @@
+import collections
+import os
+import re
+import shutil
+import socket
 import time
 
+from circus.client import CallError
+from circus.client import CircusClient
 from configobj import ConfigObj
 
 from . import log
+from . import metrics
 from . import util
 
 
 logger = log.get_logger(namespace=__name__)
 
+TRANSACTOR_WATCHER = 'datomic-transactor'
+
+TRANSACTOR_PORT = 4334
+
+CIRCUS_ENDPOINT = 'tcp://127.0.0.1:5555'
+
+# Seconds to wait for the transactor to become ready.
+READY_TIMEOUT = 300
+
+# The directory of a backup holding the (immutable) segments.
+BACKUP_SEGMENTS_DIR = 'values'
+
+# Matches the error of ``backup-db`` to a backup of another database
+# (e.g one since re-created under the same name).
+LINEAGE_ERROR = re.compile(br'different (database|db)|:backup/\S*db-?id',
+                           re.IGNORECASE)
+
+BackupReport = collections.namedtuple('BackupReport', ('path',
+                                                       'seed',
+                                                       'reused',
+                                                       'written',
+                                                       'seconds'))
+
+
+class TransactorNotReady(Exception):
+    """Raised when the transactor is not ready within the deadline."""
+
+
+def _circus_call(command, timeout=5.0, **properties):
+    client = CircusClient(endpoint=CIRCUS_ENDPOINT, timeout=timeout)
+    try:
+        return client.call(dict(command=command, properties=properties))
+    finally:
+        client.stop()
+
+
+def _transactor_pids():
+    """Returns the pids of the transactor processes managed by circus.
+
+    The pids are empty if circus is not (yet) answering.
+    """
+    try:
+        response = _circus_call('list', timeout=1.0, name=TRANSACTOR_WATCHER)
+    except CallError:
+        return ()
+    return tuple(response.get('pids', ()))
+
+
+def _transactor_active():
+    try:
+        response = _circus_call('status',
+                                timeout=1.0,
+                                name=TRANSACTOR_WATCHER)
+    except CallError:
+        return False
+    return response.get('status') == 'active'
+
+
+def _port_open(host, port):
+    try:
+        with socket.create_connection((host, port), timeout=1.0):
+            return True
+    except OSError:
+        return False
+
+
+def transactor_running(host='localhost', port=TRANSACTOR_PORT):
+    """Returns whether a transactor started by circus accepts connections."""
+    return _transactor_active() and _port_open(host, port)
+
+
+def wait_for_transactor(host='localhost',
+                        port=TRANSACTOR_PORT,
+                        timeout=READY_TIMEOUT,
+                        previous_pids=(),
+                        initial_delay=0.25,
+                        max_delay=10.0):
+    """Waits for the transactor to be ready to accept connections.
+
+    The transactor is ready once its circus watcher is active and
+    it is listening on `port`.  Both are polled with an exponential
+    backoff until `timeout` seconds have passed.
+    When waiting for a restart, `previous_pids` are the pids of the
+    transactor before the restart, which are not considered ready.
+
+    :returns: The number of seconds taken for the transactor to be ready.
+    :raises TransactorNotReady: if not ready within `timeout` seconds.
+    """
+    started = time.time()
+    deadline = started + timeout
+    delays = util.backoff_delays(int(timeout / initial_delay) + 1,
+                                 initial_delay=initial_delay,
+                                 max_delay=max_delay)
+    for delay in delays:
+        pids = _transactor_pids()
+        if (pids and
+                not set(pids).intersection(previous_pids) and
+                _transactor_active() and
+                _port_open(host, port)):
+            ready_seconds = time.time() - started
+            logger.info('Transactor ready after {:.1f}s', ready_seconds)
+            metrics.record(metrics.Usage(command='datomic transactor ready',
+                                         started=started,
+                                         wall_seconds=ready_seconds,
+                                         cpu_seconds=0.0,
+                                         peak_rss=0,
+                                         read_bytes=0,
+                                         write_bytes=0))
+            return ready_seconds
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        time.sleep(min(delay, remaining))
+    raise TransactorNotReady(
+        'Transactor not ready on {}:{} after {}s'.format(host, port, timeout))
+
+
+def restart_transactor(timeout=READY_TIMEOUT):
+    """Restarts the transactor and waits for it to be ready.
+
+    :returns: The number of seconds taken for the transactor to be ready.
+    """
+    previous_pids = _transactor_pids()
+    logger.info('Restarting datomic transactor')
+    try:
+        _circus_call('restart', name=TRANSACTOR_WATCHER)
+    except CallError as err:
+        # circus may not answer while the watcher restarts,
+        # readiness is determined below.
+        logger.warning('circus restart of the transactor: {}', err)
+    return wait_for_transactor(timeout=timeout, previous_pids=previous_pids)
+
 
 def backup_db(context, local_backup_path, db_name):
     from_uri = context.datomic_url(db_name)
     to_uri = 'file://' + local_backup_path
-    cmd = ['bin/datomic',
-           util.jvm_mem_opts(0.20),
-           'backup-db',
-           from_uri,
-           to_uri]
     cwd = context.path('datomic_free')
-    logger.info('Backing up database {} to {}', from_uri, to_uri)
-    util.local(cmd, cwd=cwd)
+    with context.jvm_planner.acquire('backup') as jvm_opts:
+        cmd = ['bin/datomic',
+               jvm_opts,
+               'backup-db',
+               from_uri,
+               to_uri]
+        logger.info('Backing up database {} to {}', from_uri, to_uri)
+        util.local(cmd, cwd=cwd, logger=logger, label='datomic backup-db')
     logger.info('Database backup complete')
 
 
+def restore_db(context, local_backup_path, db_name):
+    from_uri = 'file://' + local_backup_path
+    to_uri = context.datomic_url(db_name)
+    cwd = context.path('datomic_free')
+    with context.jvm_planner.acquire('restore') as jvm_opts:
+        cmd = ['bin/datomic',
+               jvm_opts,
+               'restore-db',
+               from_uri,
+               to_uri]
+        logger.info('Restoring database {} from {}', to_uri, from_uri)
+        util.local(cmd, cwd=cwd, logger=logger, label='datomic restore-db')
+    logger.info('Database restore complete')
+
+
+def _backup_segments(backup_path):
+    """Returns the paths of the segments of a backup, relative to it."""
+    segments_path = os.path.join(backup_path, BACKUP_SEGMENTS_DIR)
+    segments = set()
+    for (dirpath, dirnames, filenames) in os.walk(segments_path):
+        for filename in filenames:
+            segments.add(os.path.relpath(os.path.join(dirpath, filename),
+                                         backup_path))
+    return segments
+
+
+def previous_backup(backups_path, db_name, exclude=None):
+    """Returns the most recent backup of `db_name` under `backups_path`.
+
+    Backups are kept in a directory per date (``<date>/<db_name>``);
+    backups of the same database name are of the same lineage.
+
+    :param exclude: A backup path not to consider (e.g the target).
+    :returns: The path of the backup, or None if there is none.
+    """
+    if not os.path.isdir(backups_path):
+        return None
+    for date_stamp in sorted(os.listdir(backups_path), reverse=True):
+        path = os.path.join(backups_path, date_stamp, db_name)
+        if (os.path.isdir(os.path.join(path, BACKUP_SEGMENTS_DIR)) and
+                (exclude is None or
+                 os.path.abspath(path) != os.path.abspath(exclude))):
+            return path
+    return None
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        # e.g across file systems
+        shutil.copy2(src, dst)
+
+
+def seed_backup(seed_path, target_path):
+    """Seed a backup directory from the backup at `seed_path`.
+
+    Segments are immutable, so are hard-linked rather than copied;
+    the rest of the backup (the roots) is copied, since Datomic
+    updates it.  The seed is made in a ``.seeding`` directory,
+    renamed when complete.
+    """
+    partial_path = target_path + '.seeding'
+    if os.path.isdir(partial_path):
+        shutil.rmtree(partial_path)
+    segments_path = os.path.join(seed_path, BACKUP_SEGMENTS_DIR) + os.sep
+
+    def copy(src, dst):
+        if src.startswith(segments_path):
+            _link_or_copy(src, dst)
+        else:
+            shutil.copy2(src, dst)
+
+    os.makedirs(os.path.dirname(partial_path), exist_ok=True)
+    shutil.copytree(seed_path, partial_path, copy_function=copy)
+    os.rename(partial_path, target_path)
+
+
+def _lineage_error(err):
+    message = err.args[0] if err.args else b''
+    if isinstance(message, str):
+        message = message.encode('utf-8')
+    return LINEAGE_ERROR.search(message) is not None
+
+
+def incremental_backup_db(context, local_backup_path, db_name):
+    """Back up a database incrementally.
+
+    Datomic only writes the segments missing from the backup target,
+    so an existing backup at `local_backup_path` is updated in place,
+    otherwise the target is seeded from the most recent backup of the
+    same database.  Should the backup to a seeded target fail since the
+    seed is of another database (e.g since re-created), the seed is
+    removed and a full backup made instead; any other error is raised,
+    leaving the backup as it is.
+
+    :rtype: BackupReport
+    """
+    started = time.time()
+    seed_path = None
+    if not os.path.isdir(local_backup_path):
+        backups_path = os.path.dirname(os.path.dirname(local_backup_path))
+        seed_path = previous_backup(backups_path,
+                                    db_name,
+                                    exclude=local_backup_path)
+        if seed_path is not None:
+            logger.info('Seeding backup {} from {}',
+                        local_backup_path, seed_path)
+            seed_backup(seed_path, local_backup_path)
+    existing = _backup_segments(local_backup_path)
+    try:
+        backup_db(context, local_backup_path, db_name)
+    except util.LocalCommandError as err:
+        if seed_path is None or not _lineage_error(err):
+            raise
+        logger.warning('Backup {} is not of the same database as {}, '
+                       'making a full backup: {}',
+                       seed_path,
+                       db_name,
+                       err)
+        shutil.rmtree(local_backup_path)
+        seed_path = None
+        existing = set()
+        backup_db(context, local_backup_path, db_name)
+    segments = _backup_segments(local_backup_path)
+    report = BackupReport(path=local_backup_path,
+                          seed=seed_path,
+                          reused=len(segments & existing),
+                          written=len(segments - existing),
+                          seconds=time.time() - started)
+    logger.info('Backup {} took {:.0f}s: {:d} segments reused, '
+                '{:d} written',
+                local_backup_path,
+                report.seconds,
+                report.reused,
+                report.written)
+    return report
+
+
 def configure_transactor(context, datomic_path):
     circus_ini_template_path = util.pkgpath(
         'cloud-config/circus-datomic-free-transactor.ini.template')
@@ -33,7 +313,7 @@ def configure_transactor(context, datomic_path):
     with open(circus_ini_template_path) as infile:
         conf = ConfigObj(infile=infile)
     transactor_cmd = ['{dist}/bin/transactor'.format(dist=datomic_path)]
-    transactor_cmd.append(util.jvm_mem_opts(0.20))
+    transactor_cmd.append(context.jvm_planner.hold('transactor'))
     transactor_cmd.append(transactor_properties_path)
     conf['env:datomic-transactor'] = dict(JAVA_CMD=context.java_cmd)
     conf['watcher:datomic-transactor'] = dict(cmd=' '.join(transactor_cmd))
@@ -44,5 +324,6 @@ def configure_transactor(context, datomic_path):
     logger.info('Starting datomic transactor via circusd')
     util.local('circusd --daemon ' + circus_ini_path)
     logger.info('Waiting for transactor to become available')
-    time.sleep(5)
+    ready_seconds = wait_for_transactor()
     logger.info('Started datomic transactor')
+    return ready_seconds
@@ -0,0 +1,277 @@
+import collections
+import concurrent.futures
+import csv
+import functools
+import gzip
+import hashlib
+import heapq
+import os
+import tempfile
+import time
+
+import psutil
+
+from . import log
+from . import util
+
+
+logger = log.get_logger(namespace=__name__)
+
+MEMORY_BUDGET = 2 * 2 ** 30
+
+# Approximate per-line overhead of holding a line in memory
+LINE_OVERHEAD = 64
+
+SortResult = collections.namedtuple('SortResult', ('path',
+                                                   'n_lines',
+                                                   'n_bytes',
+                                                   'n_runs',
+                                                   'min_timestamp',
+                                                   'max_timestamp',
+                                                   'seconds',
+                                                   'sha256'))
+
+
+# ``n_lines`` counts lines (transactions) of a log, not the datoms in them.
+IndexEntry = collections.namedtuple('IndexEntry', ('path',
+                                                   'min_timestamp',
+                                                   'max_timestamp',
+                                                   'n_lines',
+                                                   'n_bytes'))
+
+
+def timestamp_key(line):
+    """Returns the timestamp a line of an EDN log starts with.
+
+    Lines are ordered by this first whitespace delimited field, compared
+    byte-wise, keeping the original order of lines with equal timestamps
+    (as ``sort -s -k1,1`` does in the C locale).
+    """
+    fields = line.split(None, 1)
+    return fields[0] if fields else b''
+
+
+class _HashingWriter:
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.digest = hashlib.sha256()
+
+    def write(self, data):
+        self.digest.update(data)
+        return self.fp.write(data)
+
+    def flush(self):
+        self.fp.flush()
+
+
+def _spill(lines, tmp_dir):
+    lines.sort(key=timestamp_key)
+    with tempfile.NamedTemporaryFile(dir=tmp_dir,
+                                     prefix='edn-sort-',
+                                     suffix='.run.gz',
+                                     delete=False) as fp:
+        with gzip.GzipFile(fileobj=fp, mode='wb', compresslevel=1) as gz:
+            gz.writelines(lines)
+    return fp.name
+
+
+def _read_run(path):
+    with gzip.open(path, 'rb') as fp:
+        yield from fp
+
+
+def sort_log(path, tmp_dir=None, memory_budget=MEMORY_BUDGET,
+             compresslevel=6):
+    """Sort the gzipped EDN log at `path` in place.
+
+    Lines are read into memory until `memory_budget` bytes are used,
+    then sorted and spilled to a temporary run in `tmp_dir`.
+    The runs are merged into a new gzip file that replaces `path`.
+
+    :returns: Details of the sorted file.
+    :rtype: SortResult
+    """
+    started = time.time()
+    runs = []
+    lines = []
+    used = 0
+    try:
+        with gzip.open(path, 'rb') as fp:
+            for line in fp:
+                if not line.endswith(b'\n'):
+                    line += b'\n'
+                lines.append(line)
+                used += len(line) + LINE_OVERHEAD
+                if used >= memory_budget:
+                    runs.append(_spill(lines, tmp_dir))
+                    lines = []
+                    used = 0
+        lines.sort(key=timestamp_key)
+        sources = [_read_run(run) for run in runs] + [iter(lines)]
+        counts = collections.Counter()
+        bounds = []
+
+        def tracked(merged):
+            for line in merged:
+                counts['lines'] += 1
+                counts['bytes'] += len(line)
+                if not bounds:
+                    bounds.append(timestamp_key(line))
+                yield line
+            if counts['lines']:
+                bounds.append(timestamp_key(line))
+
+        partial_path = path + '.sorted.part'
+        with open(partial_path, 'wb') as raw:
+            out = _HashingWriter(raw)
+            with gzip.GzipFile(filename=os.path.basename(path)[:-3],
+                               fileobj=out,
+                               mode='wb',
+                               compresslevel=compresslevel) as gz:
+                gz.writelines(tracked(heapq.merge(*sources,
+                                                  key=timestamp_key)))
+        os.rename(partial_path, path)
+    finally:
+        for run in runs:
+            os.remove(run)
+    decode = functools.partial(bytes.decode, encoding='utf-8')
+    (min_ts, max_ts) = map(decode, bounds) if bounds else ('', '')
+    return SortResult(path=path,
+                      n_lines=counts['lines'],
+                      n_bytes=os.path.getsize(path),
+                      n_runs=len(runs) + 1,
+                      min_timestamp=min_ts,
+                      max_timestamp=max_ts,
+                      seconds=time.time() - started,
+                      sha256=out.digest.hexdigest())
+
+
+def sort_logs(paths, n_procs=None, tmp_dir=None,
+              memory_budget=MEMORY_BUDGET, on_complete=None):
+    """Sort the EDN logs at `paths` in a pool of processes.
+
+    The largest files are scheduled first, and each process is given an
+    equal share of `memory_budget`.
+
+    :param on_complete: Optional callable, called in the calling thread
+                        with each ``SortResult`` as it completes.
+    :type on_complete: callable
+    :returns: The ``SortResult`` for each file, in completion order.
+    :rtype: list
+    """
+    n_procs = n_procs or psutil.cpu_count()
+    paths = sorted(paths, key=os.path.getsize, reverse=True)
+    sort = functools.partial(sort_log,
+                             tmp_dir=tmp_dir,
+                             memory_budget=memory_budget // n_procs)
+    started = time.time()
+    results = []
+    with util.process_pool(n_procs) as executor:
+        futures = [executor.submit(sort, path) for path in paths]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            logger.info('Sorted {} ({:d} lines, {:d} runs) in {:.1f}s',
+                        result.path,
+                        result.n_lines,
+                        result.n_runs,
+                        result.seconds)
+            results.append(result)
+            if on_complete is not None:
+                on_complete(result)
+    logger.info('Sorted {:d} EDN logs in {:.1f}s',
+                len(results),
+                time.time() - started)
+    return results
+
+
+def index_path(edn_logs_dir):
+    """Returns the path of the timestamp index for `edn_logs_dir`.
+
+    The index is kept next to (not in) the directory, which is read in its
+    entirety by pseudoace.
+    """
+    return os.path.normpath(edn_logs_dir) + '.index.csv'
+
+
+def index_entry(result):
+    """Returns the ``IndexEntry`` for a ``SortResult``."""
+    return IndexEntry(path=result.path,
+                      min_timestamp=result.min_timestamp,
+                      max_timestamp=result.max_timestamp,
+                      n_lines=result.n_lines,
+                      n_bytes=result.n_bytes)
+
+
+def scan_log(path):
+    """Returns the ``IndexEntry`` for an already sorted EDN log."""
+    n_lines = 0
+    first = last = b''
+    with gzip.open(path, 'rb') as fp:
+        for line in fp:
+            if not n_lines:
+                first = line
+            last = line
+            n_lines += 1
+    return IndexEntry(path=path,
+                      min_timestamp=timestamp_key(first).decode('utf-8'),
+                      max_timestamp=timestamp_key(last).decode('utf-8'),
+                      n_lines=n_lines,
+                      n_bytes=os.path.getsize(path))
+
+
+def read_index(edn_logs_dir):
+    """Read the timestamp index of `edn_logs_dir`.
+
+    :returns: Mapping of path to ``IndexEntry`` (empty if not indexed).
+    :rtype: dict
+    """
+    try:
+        with open(index_path(edn_logs_dir), newline='') as fp:
+            rows = list(csv.reader(fp))
+    except FileNotFoundError:
+        return {}
+    entries = (IndexEntry(path, min_ts, max_ts, int(n_lines), int(n_bytes))
+               for (path, min_ts, max_ts, n_lines, n_bytes) in rows[1:])
+    return {entry.path: entry for entry in entries}
+
+
+def write_index(edn_logs_dir, entries):
+    """Write `entries` as the timestamp index of `edn_logs_dir`."""
+    out_path = index_path(edn_logs_dir)
+    with open(out_path + '.part', 'w', newline='') as fp:
+        writer = csv.writer(fp)
+        writer.writerow(IndexEntry._fields)
+        writer.writerows(sorted(entries,
+                                key=lambda e: (e.min_timestamp, e.path)))
+    os.rename(out_path + '.part', out_path)
+    return out_path
+
+
+def plan_batches(entries, max_bytes):
+    """Split indexed EDN logs into time-ordered batches for import.
+
+    Logs with overlapping timestamp ranges are kept in the same batch,
+    so every log in a batch is older than those in the next batch.
+    Otherwise, logs are added to a batch until it holds `max_bytes`.
+
+    :returns: Lists of ``IndexEntry``, in import order.
+    :rtype: list
+    """
+    groups = []
+    for entry in sorted(entries, key=lambda e: (e.min_timestamp, e.path)):
+        if groups and entry.min_timestamp <= groups[-1][1]:
+            groups[-1][0].append(entry)
+            groups[-1][1] = max(groups[-1][1], entry.max_timestamp)
+        else:
+            groups.append([[entry], entry.max_timestamp])
+    batches = []
+    batch_bytes = 0
+    for (group, _) in groups:
+        group_bytes = sum(e.n_bytes for e in group)
+        if not batches or batch_bytes + group_bytes > max_bytes:
+            batches.append([])
+            batch_bytes = 0
+        batches[-1].extend(group)
+        batch_bytes += group_bytes
+    return batches
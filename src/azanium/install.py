@@ -1,7 +1,10 @@
+import collections
+import concurrent.futures
 import os
 import shutil
 import tarfile
 import tempfile
+import time
 import urllib.parse
 import zipfile
 import boto3 as aws
@@ -79,7 +82,9 @@ def tace(context, afct, url_template=None):
                                    os.path.basename(pr.path),
                                    afct.download_dir,
                                    logger,
-                                   initial_cwd=os.path.dirname(pr.path))
+                                   initial_cwd=os.path.dirname(pr.path),
+                                   cache=artefact.get_cache(logger),
+                                   cache_version=version)
     local_path = downloaded[0]
     with tarfile.open(local_path) as tf:
         tf.extract('./tace', path=afct.install_dir)
@@ -105,7 +110,11 @@ def datomic_free(context, afct, obj_path_template=None):
     logger.info('Downloading and extracting {} to {}', fullname, install_dir)
     tmpdir = tempfile.mkdtemp()
     s3 = aws.client('s3')
-    s3.download_file('wormbase', obj_path, download_path)
+    artefact.get_cache(logger).fetch(
+        's3://wormbase/' + obj_path,
+        version,
+        download_path,
+        lambda path: s3.download_file('wormbase', obj_path, path))
     with zipfile.ZipFile(download_path) as zf:
         zf.extractall(tmpdir)
     shutil.rmtree(install_dir)
@@ -117,10 +126,10 @@ def datomic_free(context, afct, obj_path_template=None):
     for filename in os.listdir(bin_dir):
         bin_path = os.path.join(bin_dir, filename)
         util.make_executable(bin_path, logger, symlink_dir=None)
-    os.chdir(install_dir)
     mvn_install = os.path.join('bin', 'maven-install')
-    logger.info('Installing datomic via {}', os.path.abspath(mvn_install))
-    mvn_install_out = util.local(mvn_install)
+    logger.info('Installing datomic via {}',
+                os.path.join(install_dir, mvn_install))
+    mvn_install_out = util.local(mvn_install, cwd=install_dir)
     logger.info('Installed datomic_free')
     logger.debug(mvn_install_out)
     return install_dir
@@ -134,10 +143,15 @@ def pseudoace(context, afct, **kw):
     install_dir = afct.install_dir
     tag = afct.version
     logger.info('Downloading pseudoace release {} from github', tag)
-    dl_path = github.download_release_binary(
-        'WormBase/pseudoace',
+    repo_path = 'WormBase/pseudoace'
+    dl_path = artefact.get_cache(logger).fetch(
+        'https://github.com/{}/releases/tag/{}'.format(repo_path, tag),
         tag,
-        to_directory=download_dir)
+        os.path.join(download_dir, 'pseudoace-{}.tar.xz'.format(tag)),
+        lambda path: github.download_release_binary(
+            repo_path,
+            tag,
+            to_directory=os.path.dirname(path)))
     tempdir = tempfile.mkdtemp()
     with tarfile.open(dl_path) as tf:
         tf.extractall(path=tempdir)
@@ -153,22 +167,52 @@ def pseudoace(context, afct, **kw):
     return install_dir
 
 
+def run_installers(ctx, names, jobs=1):
+    """Run the installer commands named by `names`.
+
+    Up to `jobs` installers are run concurrently, each in its own thread.
+
+    :param ctx: The click context to invoke the installers from.
+    :type ctx: click.Context
+    :param names: The installer command names.
+    :type names: sequence of str
+    :param jobs: Maximum number of installers to run at once.
+    :type jobs: int
+    :returns: Mapping of installer name to the seconds it took, in the
+              order of `names`.
+    :rtype: collections.OrderedDict
+    """
+    def timed_install(name):
+        started = time.time()
+        ctx.invoke(installers.commands[name])
+        return time.time() - started
+
+    timings = collections.OrderedDict()
+    with concurrent.futures.ThreadPoolExecutor(max(1, jobs)) as executor:
+        futures = collections.OrderedDict(
+            (name, executor.submit(timed_install, name)) for name in names)
+        for (name, future) in futures.items():
+            timings[name] = future.result()
+            logger.info('Installed {} in {:.1f}s', name, timings[name])
+    return timings
+
+
 @root_command.command('install', short_help='Installs everything')
+@util.option('-j', '--jobs',
+             default=1,
+             type=int,
+             help='Number of installers to run concurrently')
 @util.pass_command_context
-def install(context):
+def install(context, jobs=1):
     """Installs all software and data."""
-    # Invoke all commands via the install group command chain.
-    # This has the same effect as if run on command line, e.g:
+    # Has the same effect as running the installers command chain, e.g:
     # azanium installers datomic_free pseudoace tace
     preliminary_checks()
     ctx = click.get_current_context()
     install_cmd_names = sorted(installers.commands)
-    orig_protected_args = ctx.protected_args[:]
-    ctx.protected_args.extend(install_cmd_names)
-    try:
-        installers.invoke(ctx)
-    finally:
-        ctx.protected_args[:] = orig_protected_args
+    started = time.time()
+    timings = run_installers(ctx, install_cmd_names, jobs=jobs)
+    elapsed = time.time() - started
     attachments = []
     versions = util.get_deploy_versions()
     for name in install_cmd_names:
@@ -176,5 +220,15 @@ def install(context):
         title = 'Installed {} (version: {})'.format(name, version)
         ts = os.path.getmtime(context.path(name))
         attachment = notifications.Attachment(title, ts=ts)
+        attachment.add_content('Took {:.1f}s'.format(timings[name]))
         attachments.append(attachment)
+    summary = notifications.Attachment(
+        'Installed {:d} packages in {:.1f}s'.format(len(timings), elapsed))
+    summary.add_content('\n'.join(
+        '{}: {:.1f}s'.format(name, seconds)
+        for (name, seconds) in timings.items()))
+    summary.add_content(
+        'Sum of installer times {:.1f}s, {:d} concurrent jobs'.format(
+            sum(timings.values()), jobs))
+    attachments.append(summary)
     return attachments
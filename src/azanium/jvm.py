@@ -0,0 +1,188 @@
+import threading
+import time
+
+import configobj
+import psutil
+from pkg_resources import resource_filename
+
+from . import config
+from . import log
+
+
+logger = log.get_logger(namespace=__name__)
+
+MB = 2 ** 20
+
+GB = 2 ** 30
+
+# Seconds between the warnings logged while waiting for memory.
+WAIT_WARNING_INTERVAL = 600
+
+
+class MemoryNotAvailable(Exception):
+    """Raised when the memory for a JVM is not released in time."""
+
+
+def load_profiles(path=None):
+    """Load the JVM memory profiles of each role.
+
+    The packaged profiles are overridden by the ``[azanium.jvm]`` section
+    of the configuration.  Each role's profile is completed from the
+    ``default`` section.
+
+    :rtype: dict
+    :returns: A mapping of role to profile, including ``default``.
+    """
+    if path is None:
+        path = resource_filename(__package__, 'cloud-config/jvm-profiles.ini')
+    with open(path) as fp:
+        conf = configobj.ConfigObj(infile=fp)
+    overrides = config.parse().get(__name__, {})
+    conf.merge(overrides)
+    default = {key: value for (key, value) in conf['default'].items()}
+    default.update({key: value for (key, value) in conf.items()
+                    if not isinstance(value, dict)})
+    profiles = dict(default=default)
+    for (role, section) in conf.items():
+        if isinstance(section, dict) and role != 'default':
+            profiles[role] = dict(default, **section)
+    return profiles
+
+
+class Reservation:
+    """Heap memory reserved for a JVM in a `role`.
+
+    :ivar options: The JVM memory and GC options for the reserved heap.
+    :ivar held: Whether held by a long running JVM, rather than released
+                once a command completes.
+    """
+
+    def __init__(self, planner, role, heap_bytes, options, held=False):
+        self.planner = planner
+        self.role = role
+        self.heap_bytes = heap_bytes
+        self.options = options
+        self.held = held
+
+    def release(self):
+        self.planner.release(self)
+
+    def __enter__(self):
+        return self.options
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.release()
+
+
+class Planner:
+    """Plans the heap sizes of JVMs running concurrently.
+
+    The memory budget is the memory available when the planner is created,
+    less the memory reserved by the profile.  Each JVM reserves the share of
+    the budget given by its role's profile, or what's left of the budget
+    if less.  When less than the profile's minimum is left, the reservation
+    waits for JVMs running commands to release theirs, for at most
+    ``wait_timeout_hours``.  Memory held by long running JVMs (see `hold`)
+    is not waited for; the JVM is given its minimum instead.
+    """
+
+    def __init__(self, profiles=None, available_bytes=None):
+        if profiles is None:
+            profiles = load_profiles()
+        if available_bytes is None:
+            available_bytes = psutil.virtual_memory().available
+        self.profiles = profiles
+        reserved = float(profiles['default']['reserved_gb']) * GB
+        self.budget = max(int(available_bytes - reserved), 0)
+        self.wait_timeout = float(
+            profiles['default']['wait_timeout_hours']) * 3600
+        self._reservations = []
+        self._held = {}
+        self._cond = threading.Condition()
+        logger.info('JVM memory budget: {:.1f} GB', self.budget / GB)
+
+    def profile(self, role):
+        return self.profiles.get(role, self.profiles['default'])
+
+    @property
+    def reserved_bytes(self):
+        return sum(r.heap_bytes for r in self._reservations)
+
+    def options(self, role, heap_bytes):
+        """Returns the JVM options for a JVM of `role` with `heap_bytes`."""
+        profile = self.profile(role)
+        max_mb = max(heap_bytes // MB, 1)
+        initial_mb = max(int(max_mb * float(profile['initial_ratio'])), 1)
+        opts = ['-Xmx{:d}m'.format(max_mb), '-Xms{:d}m'.format(initial_mb)]
+        opts.extend(profile['gc_flags'].split())
+        return ' '.join(opts)
+
+    def acquire(self, role, share=None, held=False):
+        """Reserve heap memory for a JVM of `role`.
+
+        :param share: The share of the budget to reserve,
+                      instead of the role's profile share.
+        :param held: Whether the memory is held by a long running JVM.
+        :rtype: Reservation
+        :raises MemoryNotAvailable: if the memory is not released in time.
+        """
+        profile = self.profile(role)
+        if share is None:
+            share = float(profile['share'])
+        minimum = int(float(profile['min_gb']) * GB)
+        wanted = max(int(self.budget * share), minimum)
+        deadline = time.time() + self.wait_timeout
+        with self._cond:
+            while True:
+                heap_bytes = min(wanted, self.budget - self.reserved_bytes)
+                if heap_bytes >= minimum:
+                    break
+                releasing = [r.role for r in self._reservations
+                             if not r.held]
+                if not releasing:
+                    logger.warning('Only {:.1f} GB available for the JVM '
+                                   'heap of {}, using its minimum of '
+                                   '{:.1f} GB',
+                                   heap_bytes / GB, role, minimum / GB)
+                    heap_bytes = minimum
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise MemoryNotAvailable(
+                        '{:.1f} GB of memory to run {} not released by {} '
+                        'within {:.1f} hours'.format(
+                            minimum / GB,
+                            role,
+                            ', '.join(releasing),
+                            self.wait_timeout / 3600))
+                logger.warning('Waiting for {:.1f} GB of memory to run {}, '
+                               'reserved by {}',
+                               minimum / GB, role, ', '.join(releasing))
+                self._cond.wait(min(remaining, WAIT_WARNING_INTERVAL))
+            reservation = Reservation(self,
+                                      role,
+                                      heap_bytes,
+                                      self.options(role, heap_bytes),
+                                      held=held)
+            self._reservations.append(reservation)
+        logger.info('Reserved {:.1f} GB for {} ({})',
+                    heap_bytes / GB, role, reservation.options)
+        return reservation
+
+    def release(self, reservation):
+        with self._cond:
+            self._reservations = [r for r in self._reservations
+                                  if r is not reservation]
+            self._cond.notify_all()
+
+    def hold(self, role):
+        """Reserve memory for a long running JVM of `role`, such as the
+        transactor, replacing any previously held for the role.
+
+        :returns: The JVM options.
+        """
+        previous = self._held.pop(role, None)
+        if previous is not None:
+            previous.release()
+        self._held[role] = self.acquire(role, held=True)
+        return self._held[role].options
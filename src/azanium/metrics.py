@@ -0,0 +1,169 @@
+import collections
+import contextlib
+import functools
+import json
+import threading
+import time
+
+import psutil
+
+from . import config
+
+
+SAMPLE_INTERVAL = 1.0
+
+Usage = collections.namedtuple('Usage', ('command',
+                                         'started',
+                                         'wall_seconds',
+                                         'cpu_seconds',
+                                         'peak_rss',
+                                         'read_bytes',
+                                         'write_bytes'))
+
+_lock = threading.Lock()
+
+_state = dict(path=None, collectors=[])
+
+
+def set_path(path):
+    """Set the file that resource usage records are appended to."""
+    _state['path'] = path
+
+
+def sample_interval():
+    conf = config.parse().get(__name__, {})
+    return float(conf.get('sample_interval', SAMPLE_INTERVAL))
+
+
+class ProcessTreeSampler:
+    """Samples the resource usage of a process and all of its descendants.
+
+    CPU time and I/O counters are accumulated per process, such that
+    processes exiting between samples still count towards the total
+    (as of their last sample).
+    Memory is the peak of the summed RSS of all processes in the tree.
+    """
+
+    def __init__(self, pid, command, interval=SAMPLE_INTERVAL):
+        self.pid = pid
+        self.command = command
+        self.interval = interval
+        self.peak_rss = 0
+        self._cpu = {}
+        self._io = {}
+        self._started = time.time()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        self.sample()
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        try:
+            root = psutil.Process(self.pid)
+            procs = [root] + root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return
+        rss = 0
+        for proc in procs:
+            try:
+                with proc.oneshot():
+                    cpu = proc.cpu_times()
+                    self._cpu[proc.pid] = cpu.user + cpu.system
+                    rss += proc.memory_info().rss
+                    io = proc.io_counters()
+                    self._io[proc.pid] = (io.read_bytes, io.write_bytes)
+            except (psutil.NoSuchProcess, psutil.AccessDenied,
+                    AttributeError):
+                continue
+        self.peak_rss = max(self.peak_rss, rss)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop sampling, returning the ``Usage`` of the process tree."""
+        self._stopped.set()
+        self._thread.join()
+        return Usage(command=self.command,
+                     started=self._started,
+                     wall_seconds=time.time() - self._started,
+                     cpu_seconds=sum(self._cpu.values()),
+                     peak_rss=self.peak_rss,
+                     read_bytes=sum(r for (r, _) in self._io.values()),
+                     write_bytes=sum(w for (_, w) in self._io.values()))
+
+
+def record(usage):
+    """Append `usage` to the metrics file and the active collectors.
+
+    Usage is only given to the collectors of the thread recording it,
+    so that steps running concurrently are measured apart; work handed
+    to a pool of threads is wrapped with ``bind`` to be collected.
+    """
+    with _lock:
+        thread_id = threading.get_ident()
+        for (t_id, collector) in _state['collectors']:
+            if t_id == thread_id:
+                collector.append(usage)
+        if _state['path'] is not None:
+            with open(_state['path'], 'a') as fp:
+                fp.write(json.dumps(usage._asdict()) + '\n')
+
+
+@contextlib.contextmanager
+def _collecting(collectors):
+    entries = [(threading.get_ident(), c) for c in collectors]
+    with _lock:
+        _state['collectors'].extend(entries)
+    try:
+        yield
+    finally:
+        with _lock:
+            _state['collectors'] = [e for e in _state['collectors']
+                                    if not any(e is x for x in entries)]
+
+
+@contextlib.contextmanager
+def collect():
+    """Collect the ``Usage`` recorded while the context is active.
+
+    Yields the list the usages are appended to.
+    """
+    usages = []
+    with _collecting([usages]):
+        yield usages
+
+
+def bind(func):
+    """Returns `func` recording usage to the collectors of the calling thread.
+
+    For work submitted to a pool of threads, e.g
+    ``executor.submit(metrics.bind(func), *args)``.
+    """
+    with _lock:
+        thread_id = threading.get_ident()
+        collectors = [c for (t_id, c) in _state['collectors']
+                      if t_id == thread_id]
+
+    @functools.wraps(func)
+    def bound(*args, **kw):
+        with _collecting(collectors):
+            return func(*args, **kw)
+
+    return bound
+
+
+def format_usage(usage):
+    gb = 2 ** 30
+    return ('{u.command}: wall {u.wall_seconds:.1f}s, '
+            'cpu {u.cpu_seconds:.1f}s, '
+            'peak RSS {rss:.2f} GB, '
+            'read {read:.2f} GB, write {write:.2f} GB').format(
+                u=usage,
+                rss=usage.peak_rss / gb,
+                read=usage.read_bytes / gb,
+                write=usage.write_bytes / gb)
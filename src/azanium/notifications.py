@@ -7,6 +7,7 @@ import time
 import requests
 
 from . import config
+from . import metrics
 from . import params
 
 DEFAULTS = dict(icon_emoji=':wormbase-db-dev:')
@@ -72,14 +73,39 @@ def notify(headline, **kw):
     return delegate(cnf, headline, **kw)
 
 
+def _as_attachments(result):
+    if result is None:
+        return []
+    if isinstance(result, Attachment):
+        return [result]
+    if isinstance(result, str):
+        return [Attachment(title=result)]
+    return list(result)
+
+
+def usage_attachment(usages):
+    """Summarise the resource usage of the commands run by a step."""
+    attachment = Attachment('Resource usage')
+    for usage in usages:
+        attachment.add_content(metrics.format_usage(usage))
+    return attachment
+
+
 def around(func, headline, message, pre_kw=None, post_kw=None):
     pre_kw = pre_kw if pre_kw else {}
     post_kw = post_kw if post_kw else {}
     post_kw.setdefault('color', 'good')
     attachments_pre = [Attachment(title=message)]
     notify(headline, attachments=attachments_pre, **pre_kw)
-    result = func()
-    notify(headline + ' - *complete*', attachments=result, **post_kw)
+    with metrics.collect() as usages:
+        result = func()
+    attachments = _as_attachments(result)
+    if usages:
+        attachments.append(usage_attachment(usages))
+    notify(headline + ' - *complete*',
+           attachments=attachments or None,
+           **post_kw)
+    return result
 
 
 class Attachment(collections.Mapping):
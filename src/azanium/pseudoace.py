@@ -1,11 +1,26 @@
+import collections
+import concurrent.futures
+import contextlib
 import csv
+import glob
+import gzip
+import json
 import os
 import psutil
+import re
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
 
 import markdown
 
+from . import ednsort
 from . import github
 from . import log
+from . import metrics
 from . import util
 
 
@@ -16,19 +31,261 @@ gh_repo_path = 'WormBase/wormbase-pipeline'
 annot_models_gh_file_path = 'wspec/models.wrm.annot'
 
 
+# Forms sent to the pseudoace worker's socket REPL.
+# Exits are trapped, since ``pseudoace.cli/-main`` exits the JVM when done.
+# Java 18 and later refuse to set a SecurityManager, unless run with
+# ``-Djava.security.manager=allow`` (up to Java 23), so the form reports
+# whether exits are trapped.
+WORKER_BOOTSTRAP_FORM = """\
+(do (require 'pseudoace.cli)
+    (println "azanium-ready"
+             (try
+               (System/setSecurityManager
+                 (proxy [SecurityManager] []
+                   (checkPermission ([perm]) ([perm ctx]))
+                   (checkExit [status]
+                     (throw (SecurityException.
+                              (str "azanium-exit " status))))))
+               true
+               (catch UnsupportedOperationException e
+                 false))))"""
+
+WORKER_COMMAND_FORM = """\
+(let [status (try
+               (apply pseudoace.cli/-main [{args}])
+               0
+               (catch Throwable e
+                 (if-let [[_ s] (re-find #"^azanium-exit (\\d+)$"
+                                         (str (.getMessage e)))]
+                   (Long/parseLong s)
+                   (do (.printStackTrace e (java.io.PrintWriter. *out*))
+                       1))))]
+  (flush)
+  (println "azanium-done" status))"""
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _cpu_and_io(pid):
+    proc = psutil.Process(pid)
+    with proc.oneshot():
+        cpu = proc.cpu_times()
+        io = proc.io_counters()
+    return (cpu.user + cpu.system, io.read_bytes, io.write_bytes)
+
+
+class Worker:
+    """A long running pseudoace JVM, sent commands over a socket REPL.
+
+    Running each pseudoace command in the same JVM saves starting the JVM
+    and loading Clojure and pseudoace for every command, and re-uses the
+    Datomic peer's connections and cache.
+    Commands are run one at a time.  The JVM is started on the first
+    command, and the time it took to start is recorded in the metrics
+    as ``pseudoace worker startup``.
+    Its heap is held for as long as it runs, sized by the
+    ``pseudoace-worker`` JVM profile.
+    Should the JVM not allow trapping the exits of pseudoace commands
+    (Java 18 and later), the worker is disabled.
+    """
+
+    def __init__(self, context, startup_timeout=300):
+        self.context = context
+        self.startup_timeout = startup_timeout
+        self.startup_seconds = None
+        self.n_commands = 0
+        self.process = None
+        self.disabled = False
+        self._reservation = None
+        self._sock = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def _connect(self, port, deadline):
+        delays = util.backoff_delays(self.startup_timeout * 4,
+                                     initial_delay=0.25,
+                                     max_delay=5.0)
+        for delay in delays:
+            if self.process.poll() is not None:
+                break
+            try:
+                return socket.create_connection(('127.0.0.1', port))
+            except OSError:
+                if time.time() + delay > deadline:
+                    break
+                time.sleep(delay)
+        raise util.LocalCommandError(
+            'pseudoace worker not accepting connections on port {}'.format(
+                port).encode('utf-8'))
+
+    def _send(self, form):
+        self._sock.sendall(form.encode('utf-8') + b'\n')
+
+    def _read_until(self, sentinel):
+        for line in self._reader:
+            # strip the REPL prompts preceding output
+            line = re.sub(r'^(\S+=> )+', '', line.rstrip('\n'))
+            if line.startswith(sentinel):
+                # skip the value of the form (nil)
+                self._reader.readline()
+                return line[len(sentinel):].strip()
+            if line:
+                logger.info('{}', line)
+        raise util.LocalCommandError(b'pseudoace worker exited')
+
+    def start(self):
+        port = _free_port()
+        self._reservation = self.context.jvm_planner.acquire(
+            'pseudoace-worker', held=True)
+        repl_opt = ('-Dclojure.server.azanium='
+                    '{{:port {:d} :accept clojure.core.server/repl}}').format(
+                        port)
+        cmd = self.context.java_cmd.split()
+        cmd.extend(self._reservation.options.split())
+        cmd.extend([repl_opt,
+                    '-cp',
+                    self.context.pseudoace_jar_path,
+                    'clojure.main',
+                    '-e',
+                    '@(promise)'])
+        log_path = os.path.join(self.context.path('logs'),
+                                'pseudoace-worker.log')
+        logger.info('Starting pseudoace worker: {}', ' '.join(cmd))
+        started = time.time()
+        with open(log_path, 'ab') as log_file:
+            self.process = subprocess.Popen(cmd,
+                                            stdout=log_file,
+                                            stderr=subprocess.STDOUT,
+                                            start_new_session=True)
+        util.register_process_group(self.process)
+        self._sock = self._connect(port, started + self.startup_timeout)
+        self._reader = self._sock.makefile('r', encoding='utf-8')
+        self._send(WORKER_BOOTSTRAP_FORM)
+        if self._read_until('azanium-ready') != 'true':
+            logger.warning('pseudoace worker disabled, since its JVM does '
+                           'not allow trapping exits; pseudoace commands '
+                           'run in JVMs of their own (with Java 18 to 23, '
+                           'add -Djava.security.manager=allow to the '
+                           'gc_flags of the pseudoace-worker JVM profile)')
+            self._terminate()
+            self.disabled = True
+            return
+        self.startup_seconds = time.time() - started
+        logger.info('pseudoace worker started in {:.1f}s',
+                    self.startup_seconds)
+        metrics.record(metrics.Usage(command='pseudoace worker startup',
+                                     started=started,
+                                     wall_seconds=self.startup_seconds,
+                                     cpu_seconds=_cpu_and_io(
+                                         self.process.pid)[0],
+                                     peak_rss=0,
+                                     read_bytes=0,
+                                     write_bytes=0))
+
+    def available(self):
+        """Returns whether commands can run in the worker, starting it."""
+        with self._lock:
+            if self.process is None and not self.disabled:
+                self.start()
+            return not self.disabled
+
+    def run(self, *args):
+        """Runs the pseudoace command-line with `args` in the worker."""
+        with self._lock:
+            if self.process is None:
+                self.start()
+            if self.disabled:
+                raise util.LocalCommandError(
+                    b'pseudoace worker disabled')
+            label = 'pseudoace ' + args[-1]
+            logger.info('Running pseudoace command in worker: {}',
+                        ' '.join(args))
+            (cpu, read_bytes, write_bytes) = _cpu_and_io(self.process.pid)
+            sampler = metrics.ProcessTreeSampler(
+                self.process.pid,
+                label,
+                interval=metrics.sample_interval()).start()
+            self._send(WORKER_COMMAND_FORM.format(
+                args=' '.join(map(json.dumps, args))))
+            status = self._read_until('azanium-done')
+            usage = sampler.stop()
+            metrics.record(usage._replace(
+                cpu_seconds=usage.cpu_seconds - cpu,
+                read_bytes=usage.read_bytes - read_bytes,
+                write_bytes=usage.write_bytes - write_bytes))
+            self.n_commands += 1
+            if status != '0':
+                raise util.LocalCommandError(
+                    '{} exited with status {}'.format(label, status).encode(
+                        'utf-8'))
+
+    def _terminate(self):
+        if self._sock is not None:
+            self._reader.close()
+            self._sock.close()
+            self._sock = None
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        util.unregister_process_group(self.process)
+        self._reservation.release()
+        self.process = None
+
+    def stop(self):
+        with self._lock:
+            if self.process is None:
+                return
+            self._terminate()
+            if self.startup_seconds is not None:
+                logger.info('pseudoace worker ran {} commands, saving about '
+                            '{:.0f}s of JVM start-up',
+                            self.n_commands,
+                            self.startup_seconds * (self.n_commands - 1))
+
+
+@contextlib.contextmanager
+def worker_session(context):
+    """Runs the pseudoace commands of `context` in a `Worker`."""
+    context.pseudoace_worker = Worker(context)
+    try:
+        yield context.pseudoace_worker
+    finally:
+        context.pseudoace_worker.stop()
+        context.pseudoace_worker = None
+
+
 def run_pseudoace(context, *args, **kw):
+    """Runs the pseudoace command-line with `args`.
+
+    Commands run in the pseudoace worker when there is one, unless given
+    a `heap_share` of the JVM memory budget, in which case they run in
+    a JVM of their own with that share.
+    """
     url = context.datomic_url(db_name=kw.get('db_name'))
-    cmd = [context.java_cmd,
-           '-cp',
-           context.pseudoace_jar_path,
-           'clojure.main',
-           '-m',
-           'pseudoace.cli',
-           '--url=' + url]
-    cmd.extend(list(args))
-    logger.info('Running pseudoace command: {}', ' '.join(cmd))
-    out = util.local(cmd)
-    logger.info(out)
+    heap_share = kw.get('heap_share')
+    worker = getattr(context, 'pseudoace_worker', None)
+    if worker is not None and heap_share is None and worker.available():
+        return worker.run('--url=' + url, *args)
+    planner = context.jvm_planner
+    with planner.acquire('pseudoace', share=heap_share) as jvm_opts:
+        cmd = [context.java_cmd,
+               jvm_opts,
+               '-cp',
+               context.pseudoace_jar_path,
+               'clojure.main',
+               '-m',
+               'pseudoace.cli',
+               '--url=' + url]
+        cmd.extend(list(args))
+        logger.info('Running pseudoace command: {}', ' '.join(cmd))
+        util.local(cmd, logger=logger, label='pseudoace ' + args[-1])
 
 def _read_annotated_models(version):
     """Read the contents of the annotated models file from github."""
@@ -42,15 +299,22 @@ def _read_annotated_models(version):
 def source_annotated_models_file(context):
     """Sources the annotated models file from github into a local file.
 
+    The file is named after the release tag, so a file already sourced
+    for the release is re-used.
+
     Returns the local filename. """
     target_dir = context.base_path
     release_tag = util.ws_release_tag()
-    annot_file_content = _read_annotated_models(release_tag)
     am_local_filename = os.path.basename(annot_models_gh_file_path) + '.' + release_tag
     am_local_path = os.path.join(target_dir, am_local_filename)
-    with open(am_local_path, mode='wb') as fp:
+    if os.path.isfile(am_local_path):
+        logger.info('Using annotated models file {}', am_local_path)
+        return am_local_path
+    annot_file_content = _read_annotated_models(release_tag)
+    with open(am_local_path + '.part', mode='wb') as fp:
         fp.write(annot_file_content)
-    return fp.name
+    os.rename(fp.name, am_local_path)
+    return am_local_path
 
 
 def create_database(context):
@@ -66,14 +330,91 @@ def create_database(context):
                   'create-database')
 
 
-def acedb_dump_to_edn_logs(context, acedb_dump_dir, edn_logs_dir):
+def acedb_dump_to_edn_logs(context, acedb_dump_dir, edn_logs_dir,
+                           heap_share=None):
     logger.info('Convering ACeDB files to EDN logs')
     os.makedirs(edn_logs_dir, exist_ok=True)
     run_pseudoace(context,
                   '--acedump-dir=' + acedb_dump_dir,
                   '--log-dir=' + edn_logs_dir,
                   '--verbose',
-                  'acedump-to-edn-logs')
+                  'acedump-to-edn-logs',
+                  heap_share=heap_share)
+
+
+def merge_edn_log_shards(shard_logs_dirs, edn_logs_dir):
+    """Merges the EDN logs written by each shard into `edn_logs_dir`.
+
+    Logs only written by one shard are moved; logs with the same name
+    written by several shards are concatenated (as gzip members),
+    and are put in order by ``sort-edn-logs``.
+    """
+    sources = collections.defaultdict(list)
+    for shard_logs_dir in shard_logs_dirs:
+        for path in edn_log_paths(shard_logs_dir):
+            sources[os.path.relpath(path, shard_logs_dir)].append(path)
+    for (rel_path, paths) in sorted(sources.items()):
+        out_path = os.path.join(edn_logs_dir, rel_path)
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        if len(paths) == 1:
+            os.replace(paths[0], out_path)
+            continue
+        with open(out_path + '.part', 'wb') as out_file:
+            for path in paths:
+                with open(path, 'rb') as fp:
+                    shutil.copyfileobj(fp, out_file)
+        os.replace(out_path + '.part', out_path)
+        for path in paths:
+            os.remove(path)
+    return len(sources)
+
+
+def sharded_acedb_dump_to_edn_logs(context, acedb_dump_dir, edn_logs_dir,
+                                   n_shards):
+    """Converts ACeDB dump files to EDN logs with `n_shards` pseudoace JVMs.
+
+    The ``.ace.gz`` files are partitioned by size into shards, each
+    converted by its own JVM, with an equal share of the pseudoace
+    JVM memory budget, into a log directory of its own.
+    The logs of all shards are then merged into `edn_logs_dir`.
+    """
+    paths = sorted(glob.glob(os.path.join(acedb_dump_dir, '*.ace.gz')))
+    shards = util.partition_by_size(paths, n_shards, os.path.getsize)
+    shards_dir = os.path.normpath(edn_logs_dir) + '.shards'
+    shutil.rmtree(shards_dir, ignore_errors=True)
+    heap_share = float(
+        context.jvm_planner.profile('pseudoace')['share']) / len(shards)
+    shard_dirs = []
+    for (shard_n, shard) in enumerate(shards, start=1):
+        shard_dir = os.path.join(shards_dir, 'shard-{:02d}'.format(shard_n))
+        shard_dump_dir = os.path.join(shard_dir, 'acedb-dump')
+        os.makedirs(shard_dump_dir)
+        for path in shard:
+            os.symlink(os.path.abspath(path),
+                       os.path.join(shard_dump_dir, os.path.basename(path)))
+        logger.info('Shard {:d} has {:d} files, {:.2f} GB',
+                    shard_n,
+                    len(shard),
+                    sum(map(os.path.getsize, shard)) / 2 ** 30)
+        shard_dirs.append(shard_dir)
+    with concurrent.futures.ThreadPoolExecutor(len(shard_dirs)) as executor:
+        futures = [executor.submit(metrics.bind(acedb_dump_to_edn_logs),
+                                   context,
+                                   os.path.join(shard_dir, 'acedb-dump'),
+                                   os.path.join(shard_dir, 'edn-logs'),
+                                   heap_share=heap_share)
+                   for shard_dir in shard_dirs]
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+    os.makedirs(edn_logs_dir, exist_ok=True)
+    n_logs = merge_edn_log_shards(
+        [os.path.join(shard_dir, 'edn-logs') for shard_dir in shard_dirs],
+        edn_logs_dir)
+    logger.info('Merged {:d} shards into {:d} EDN logs in {}',
+                len(shard_dirs),
+                n_logs,
+                edn_logs_dir)
+    shutil.rmtree(shards_dir)
 
 
 def prepare_target_db(context, edn_logs_dir, acedb_dump_dir):
@@ -84,22 +425,190 @@ def prepare_target_db(context, edn_logs_dir, acedb_dump_dir):
                   'prepare-import')
 
 
-def sort_edn_logs(context, edn_logs_dir):
-    pseudoace_path = context.path('pseudoace')
-    script_path = os.path.join(pseudoace_path, 'sort-edn-log.sh')
-    n_procs = str(psutil.cpu_count())
-    cmd = ['find', edn_logs_dir, '-type', 'f', '-name', '"*.edn.gz"']
-    cmd.extend(['|', 'xargs', '-n', '1', '-P', n_procs, script_path])
+def edn_log_paths(edn_logs_dir):
+    return [os.path.join(dirpath, filename)
+            for (dirpath, _, filenames) in os.walk(edn_logs_dir)
+            for filename in filenames
+            if filename.endswith('.edn.gz')]
+
+
+def _sort_with_script(script_path, paths, n_procs, on_complete):
+    with concurrent.futures.ThreadPoolExecutor(n_procs) as executor:
+        futures = {executor.submit(metrics.bind(util.local),
+                                   [script_path, path]): path
+                   for path in paths}
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+            on_complete(futures[future])
+
+
+def sort_edn_logs(context, edn_logs_dir, engine='script', n_procs=None,
+                  tmp_dir=None, memory_budget=ednsort.MEMORY_BUDGET):
+    """Sort the EDN logs in `edn_logs_dir` by timestamp.
+
+    :param engine: Either "script", to run pseudoace's sort-edn-log.sh on
+                   each file, or "native" to use ``ednsort``.
+    :type engine: str
+    :param n_procs: Number of files to sort concurrently.
+    :type n_procs: int
+    :param tmp_dir: Directory for the sorted runs of the native engine.
+    :type tmp_dir: str
+    :param memory_budget: Bytes of memory shared by the native sorters.
+    :type memory_budget: int
+    """
+    n_procs = n_procs or psutil.cpu_count()
+    manifest = util.FileManifest(context.app_state, 'sort-edn-logs')
+    index = ednsort.read_index(edn_logs_dir)
+    input_stats = collections.OrderedDict()
+    for path in sorted(edn_log_paths(edn_logs_dir),
+                       key=os.path.getsize,
+                       reverse=True):
+        if manifest.is_done(path, path):
+            logger.info('Skipping {}, sorted by a previous run', path)
+        else:
+            input_stats[path] = util.file_stat(path)
     logger.info('Sorting EDN logs')
-    util.local(cmd)
+    if engine == 'native':
+
+        def on_sorted(result):
+            manifest.record(result.path,
+                            result.path,
+                            input_stats[result.path],
+                            out_sha256=result.sha256)
+            index[result.path] = ednsort.index_entry(result)
+
+        ednsort.sort_logs(list(input_stats),
+                          n_procs=n_procs,
+                          tmp_dir=tmp_dir,
+                          memory_budget=memory_budget,
+                          on_complete=on_sorted)
+    else:
+        script_path = os.path.join(context.path('pseudoace'),
+                                   'sort-edn-log.sh')
+        _sort_with_script(
+            script_path,
+            list(input_stats),
+            n_procs,
+            lambda path: manifest.record(path, path, input_stats[path]))
     logger.info('Finished sorting EDN logs')
-
-
-def import_logs(context, edn_logs_dir):
-    run_pseudoace(context,
-                  '--log-dir=' + edn_logs_dir,
-                  '--verbose',
-                  'import-logs')
+    index_edn_logs(edn_logs_dir, index, n_procs=n_procs)
+
+
+def index_edn_logs(edn_logs_dir, index, n_procs=None):
+    """Write the timestamp index for the sorted EDN logs in `edn_logs_dir`.
+
+    Entries in `index` for files of the same size are reused; other files
+    are scanned.
+    """
+    entries = []
+    to_scan = []
+    for path in edn_log_paths(edn_logs_dir):
+        entry = index.get(path)
+        if entry is not None and entry.n_bytes == os.path.getsize(path):
+            entries.append(entry)
+        else:
+            to_scan.append(path)
+    with util.process_pool(n_procs) as executor:
+        entries.extend(executor.map(ednsort.scan_log, to_scan))
+    out_path = ednsort.index_path(edn_logs_dir)
+    ednsort.write_index(edn_logs_dir, entries)
+    logger.info('Indexed the timestamps of {:d} EDN logs in {}',
+                len(entries),
+                out_path)
+
+
+def benchmark_sort_edn_logs(context, paths, tmp_dir=None, n_procs=None):
+    """Time the native sort engine against sort-edn-log.sh on copies of
+    `paths`, checking that both produce the same content.
+
+    :returns: Mapping of engine name to seconds taken.
+    :rtype: collections.OrderedDict
+    """
+    n_procs = n_procs or psutil.cpu_count()
+    script_path = os.path.join(context.path('pseudoace'), 'sort-edn-log.sh')
+    timings = collections.OrderedDict()
+    work_dir = tempfile.mkdtemp(prefix='edn-sort-benchmark-', dir=tmp_dir)
+    try:
+        copies = {}
+        for engine in ('script', 'native'):
+            engine_dir = os.path.join(work_dir, engine)
+            os.makedirs(engine_dir)
+            copies[engine] = [shutil.copy(path, engine_dir)
+                              for path in paths]
+        started = time.time()
+        _sort_with_script(script_path, copies['script'], n_procs,
+                          lambda path: None)
+        timings['script'] = time.time() - started
+        started = time.time()
+        ednsort.sort_logs(copies['native'], n_procs=n_procs, tmp_dir=tmp_dir)
+        timings['native'] = time.time() - started
+        for (script_copy, native_copy) in zip(copies['script'],
+                                              copies['native']):
+            with gzip.open(script_copy) as s_fp, \
+                    gzip.open(native_copy) as n_fp:
+                if s_fp.read() != n_fp.read():
+                    logger.warning('Sorted output differs for {}',
+                                   os.path.basename(script_copy))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return timings
+
+
+IMPORT_BATCHES_STATE_KEY = 'import-logs-batches'
+
+
+def import_logs(context, edn_logs_dir, batch_bytes=None):
+    """Import the EDN logs in `edn_logs_dir` into the Datomic database.
+
+    When `batch_bytes` is given and the logs have been indexed, the logs
+    are imported in time-ordered batches of about `batch_bytes`, resuming
+    after the last batch committed by a previous run.
+    """
+    index = ednsort.read_index(edn_logs_dir)
+    paths = edn_log_paths(edn_logs_dir)
+    if not batch_bytes or not index or set(paths) - set(index):
+        run_pseudoace(context,
+                      '--log-dir=' + edn_logs_dir,
+                      '--verbose',
+                      'import-logs')
+        return
+    batches = ednsort.plan_batches((index[p] for p in paths), batch_bytes)
+    plan = [[entry.path for entry in batch] for batch in batches]
+    state = context.app_state.get(IMPORT_BATCHES_STATE_KEY, {})
+    n_done = state.get('n_done', 0) if state.get('plan') == plan else 0
+    batches_dir = os.path.normpath(edn_logs_dir) + '.batches'
+    total_bytes = sum(e.n_bytes for batch in batches for e in batch)
+    done_bytes = sum(e.n_bytes for batch in batches[:n_done] for e in batch)
+    imported_bytes = 0
+    started = time.time()
+    for (batch_n, batch) in enumerate(batches[n_done:], start=n_done + 1):
+        batch_dir = os.path.join(batches_dir, 'batch-{:04d}'.format(batch_n))
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        os.makedirs(batch_dir)
+        for entry in batch:
+            # Logs of different directories (e.g shards) share file names.
+            link_path = os.path.join(batch_dir,
+                                     os.path.relpath(entry.path, edn_logs_dir))
+            os.makedirs(os.path.dirname(link_path), exist_ok=True)
+            os.symlink(os.path.abspath(entry.path), link_path)
+        logger.info('Importing batch {:d}/{:d} ({} to {})',
+                    batch_n,
+                    len(batches),
+                    batch[0].min_timestamp,
+                    max(e.max_timestamp for e in batch))
+        run_pseudoace(context,
+                      '--log-dir=' + batch_dir,
+                      '--verbose',
+                      'import-logs')
+        context.app_state[IMPORT_BATCHES_STATE_KEY] = dict(plan=plan,
+                                                           n_done=batch_n)
+        imported_bytes += sum(e.n_bytes for e in batch)
+        rate = imported_bytes / max(time.time() - started, 1e-6)
+        remaining = total_bytes - done_bytes - imported_bytes
+        logger.info('Imported {:.1f}% of EDN logs, ETA {:.0f} minutes',
+                    100.0 * (done_bytes + imported_bytes) / total_bytes,
+                    remaining / rate / 60)
+    shutil.rmtree(batches_dir, ignore_errors=True)
 
 
 def apply_patches(context):
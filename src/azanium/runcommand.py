@@ -1,4 +1,5 @@
 import collections
+import concurrent.futures
 import datetime
 import functools
 import getpass
@@ -16,12 +17,18 @@ import boto3 as aws
 
 import click
 
+from . import acedb
+from . import archive
 from . import artefact
+from . import compress
 from . import datomic
+from . import ednsort
 from . import log
+from . import metrics
 from . import notifications
 from . import pseudoace
 from . import root_command
+from . import s3
 from . import util
 from .install import installers
 
@@ -29,6 +36,16 @@ logger = log.get_logger(namespace=__name__)
 
 LAST_STEP_OK_STATE_KEY = 'last-step-ok-idx'
 
+PROFILE_METRICS = collections.OrderedDict([
+    ('seconds', 'Wall time (s)'),
+    ('cpu_seconds', 'CPU time (s)'),
+    ('peak_rss', 'Peak RSS (bytes)'),
+    ('read_bytes', 'Bytes read'),
+    ('write_bytes', 'Bytes written'),
+    ('input_bytes', 'Input size (bytes)'),
+    ('output_bytes', 'Output size (bytes)')])
+
+
 @root_command.group()
 @util.pass_command_context
 def run(context):
@@ -46,7 +63,9 @@ def acedb_id_catalog(
                                    regexp,
                                    meta.download_dir,
                                    logger,
-                                   initial_cwd=cwd)
+                                   initial_cwd=cwd,
+                                   cache=artefact.get_cache(logger),
+                                   cache_version=meta.version)
 
     downloaded_path = downloaded[0]
     with gzip.open(downloaded_path) as gz_fp:
@@ -75,8 +94,26 @@ def input_validation(context):
 @util.option('--file-selector-regexp',
              default='.*\.tar\.gz$',
              help='File selection regexp')
+@util.option('--ftp-connections',
+             default=util.FTP_MAX_CONNECTIONS,
+             type=int,
+             help='Maximum number of concurrent FTP connections')
+@util.option('--stream/--no-stream',
+             default=False,
+             help=('Extract archives as they are downloaded, '
+                   'without storing them on disk'))
+@util.option('--keep-archives/--no-keep-archives',
+             default=False,
+             help='Keep a copy of streamed archives in the download directory')
+@util.option('--cache/--no-cache',
+             default=True,
+             help='Use the artefact cache for downloaded archives')
 @artefact.prepared
 def acedb_database(context, afct, file_selector_regexp,
+                   ftp_connections=util.FTP_MAX_CONNECTIONS,
+                   stream=False,
+                   keep_archives=False,
+                   cache=True,
                    acedb_dir=None,
                    acedb_id_catalog_dir=None):
     """Fetches all data, then installs and configures the ACeDB database."""
@@ -87,14 +124,31 @@ def acedb_database(context, afct, file_selector_regexp,
     (host, path, version) = util.split_ftp_url(ftp_url)
     cwd = os.path.join(path, 'acedb')
     wspec_dir = os.path.join(afct.install_dir, 'wspec')
-    ftp_get = functools.partial(util.ftp_download,
-                                logger=logger,
-                                initial_cwd=cwd)
-    downloaded = ftp_get(host, file_selector_regexp, afct.download_dir)
-    for path in downloaded:
-        with tarfile.open(path) as tf:
-            logger.info('Extracting {} to {}', path, afct.install_dir)
-            tf.extractall(path=afct.install_dir)
+    cache_kw = {}
+    if cache:
+        cache_kw.update(cache=artefact.get_cache(logger),
+                        cache_version=afct.version)
+    if stream:
+        archive_dir = afct.download_dir if keep_archives else None
+        util.ftp_extract(host,
+                         file_selector_regexp,
+                         afct.install_dir,
+                         logger,
+                         initial_cwd=cwd,
+                         max_connections=ftp_connections,
+                         archive_dir=archive_dir,
+                         **cache_kw)
+    else:
+        ftp_get = functools.partial(util.ftp_download,
+                                    logger=logger,
+                                    initial_cwd=cwd,
+                                    max_connections=ftp_connections,
+                                    **cache_kw)
+        downloaded = ftp_get(host, file_selector_regexp, afct.download_dir)
+        for path in downloaded:
+            with tarfile.open(path) as tf:
+                logger.info('Extracting {} to {}', path, afct.install_dir)
+                tf.extractall(path=afct.install_dir)
 
     # Enable the Dump command (requires adding user to ACeDB pw file)
     passwd_path = os.path.join(wspec_dir, 'passwd.wrm')
@@ -113,40 +167,96 @@ def acedb_database(context, afct, file_selector_regexp,
 
 @run.command('acedb-compress-dump',
              short_help='Compresses all ACeDB dump files.')
+@util.option('-j', '--jobs',
+             default=psutil.cpu_count(),
+             type=int,
+             help='Number of compression processes')
+@util.option('--chunk-size',
+             default=compress.CHUNK_SIZE,
+             type=int,
+             help='Bytes per gzip member compressed in parallel')
 @click.argument('dump_dir')
 @util.pass_command_context
-def acedb_compress_dump(context, dump_dir):
+def acedb_compress_dump(context, dump_dir, jobs=None,
+                        chunk_size=compress.CHUNK_SIZE):
     """gzip .ace files generated from an ACeDB dump (pseudoace compliance).
     """
-    gzip_cmd = ['find', dump_dir, '-type', 'f', '-name', '"*.ace"']
-    gzip_cmd.extend([
-        '|',
-        'xargs',
-        '--no-run-if-empty',
-        '-n', '1',
-        '-P', str(psutil.cpu_count()),
-        'gzip'
-    ])
-    util.local(gzip_cmd)
+    manifest = util.FileManifest(context.app_state, 'acedb-compress-dump')
+    input_stats = {}
+    for (dirpath, _, filenames) in os.walk(dump_dir):
+        for filename in filenames:
+            if not filename.endswith('.ace'):
+                continue
+            path = os.path.join(dirpath, filename)
+            if manifest.is_done(path, path + '.gz'):
+                logger.info('Skipping {}, compressed by a previous run', path)
+                os.remove(path)
+                continue
+            input_stats[path] = util.file_stat(path)
+
+    def record(result):
+        manifest.record(result.path,
+                        result.out_path,
+                        input_stats[result.path],
+                        out_sha256=result.sha256)
+
+    compress.compress_files(list(input_stats),
+                            n_procs=jobs,
+                            chunk_size=chunk_size,
+                            on_complete=record)
     logger.info('Compressed all .ace files in {}', dump_dir)
 
 
 @run.command('acedb-dump', short_help='Dumps all ACeDB data to .ace files')
 @util.option('-c',
              '--tace-dump-options',
-             default='-s -T -C',
-             help='tace "Dump" command options')
+             default=None,
+             help=('tace "Dump" command options ({}), not supported with '
+                   '--jobs, which dumps each class with "Show {}"').format(
+                       acedb.DUMP_OPTIONS, acedb.SHOW_OPTIONS))
+@util.option('-j', '--jobs',
+             default=1,
+             type=int,
+             help=('Number of tace processes to dump with. '
+                   'More than one dumps the ACeDB classes in shards'))
+@util.option('--compress/--no-compress',
+             'compress_while_dumping',
+             default=False,
+             help='Compress .ace files while the dump is still running')
 @click.argument('dump_dir')
 @util.pass_command_context
-def acedb_dump(context, dump_dir, tace_dump_options):
+def acedb_dump(context, dump_dir, tace_dump_options=None, jobs=1,
+               compress_while_dumping=False):
     """Dump the ACeDB database."""
+    if jobs > 1 and tace_dump_options is not None:
+        raise click.UsageError('--tace-dump-options cannot be used with '
+                               '--jobs, as a sharded dump does not use '
+                               'the Dump command')
+    if tace_dump_options is None:
+        tace_dump_options = acedb.DUMP_OPTIONS
     if os.path.isdir(dump_dir):
         return dump_dir
     db_directory = context.path('acedb_database')
     os.makedirs(dump_dir, exist_ok=True)
-    dump_cmd = ' '.join(['Dump', tace_dump_options, dump_dir])
+    if jobs > 1:
+        dump = partial(acedb.sharded_dump,
+                       db_directory,
+                       dump_dir,
+                       jobs,
+                       verify=not compress_while_dumping)
+    else:
+        dump_cmd = ' '.join(['Dump', tace_dump_options, dump_dir])
+        dump = partial(util.local,
+                       'tace ' + db_directory,
+                       input=dump_cmd,
+                       logger=logger)
     logger.info('Dumping ACeDB files to {}', dump_dir)
-    util.local('tace ' + db_directory, input=dump_cmd)
+    if compress_while_dumping:
+        classes = acedb.dump_and_compress(dump, dump_dir)
+        if jobs > 1:
+            acedb.verify_dump(dump_dir, classes)
+    else:
+        dump()
     return dump_dir
 
 
@@ -155,34 +265,96 @@ def acedb_dump(context, dump_dir, tace_dump_options):
 @util.pass_command_context
 def create_database(context, datomic_path):
     """Creates a Datomic datbase for importing EDN logs into."""
-    datomic.configure_transactor(context, datomic_path)
-    # Allow a small amount of time for the transactor to start
-    time.sleep(2)
+    ready_seconds = datomic.configure_transactor(context, datomic_path)
     pseudoace.create_database(context)
-    return 'Created'
+    return 'Created (transactor ready in {:.1f}s)'.format(ready_seconds)
 
 
 @run.command('acedb-dump-to-edn-logs',
              short_help='Converts .ace files to EDN logs')
+@util.option('-j', '--jobs',
+             default=1,
+             type=int,
+             help=('Number of pseudoace processes converting shards '
+                   'of the .ace files, partitioned by size'))
 @util.pass_command_context
 @click.argument('acedb_dump_dir')
 @click.argument('edn_logs_dir')
-def ace_to_edn(context, acedb_dump_dir, edn_logs_dir):
+def ace_to_edn(context, acedb_dump_dir, edn_logs_dir, jobs=1):
     """Converts ACeDB dump files (.ace) to EDN log files."""
-    pseudoace.acedb_dump_to_edn_logs(context, acedb_dump_dir, edn_logs_dir)
+    if jobs > 1:
+        pseudoace.sharded_acedb_dump_to_edn_logs(context,
+                                                 acedb_dump_dir,
+                                                 edn_logs_dir,
+                                                 jobs)
+    else:
+        pseudoace.acedb_dump_to_edn_logs(context,
+                                         acedb_dump_dir,
+                                         edn_logs_dir)
     # restart the transactor to force jvm return memory to speed up later steps.
-    # wrapped with retries due to circusctl bug.
-    util.retries(3, lambda : util.local('python -m circus.circusctl --timeout=5 restart datomic-transactor',
-                                   timeout=6))
+    datomic.restart_transactor()
     return edn_logs_dir
 
 
 @run.command('sort-edn-logs', short_help='Sorts EDN logs')
+@util.option('--engine',
+             default='script',
+             type=click.Choice(choices=('script', 'native')),
+             help=('Sort with pseudoace\'s sort-edn-log.sh script, '
+                   'or the native external merge sort'))
+@util.option('-j', '--jobs',
+             default=psutil.cpu_count(),
+             type=int,
+             help='Number of EDN logs to sort concurrently')
+@util.option('--tmp-dir',
+             default=None,
+             help='Directory for the temporary runs of the native engine')
+@util.option('--memory-budget-mb',
+             default=ednsort.MEMORY_BUDGET // 2 ** 20,
+             type=int,
+             help='Memory used by the native engine, across all jobs')
 @click.argument('edn_logs_dir')
 @util.pass_command_context
-def sort_edn_logs(context, edn_logs_dir):
+def sort_edn_logs(context, edn_logs_dir, engine='script', jobs=None,
+                  tmp_dir=None,
+                  memory_budget_mb=ednsort.MEMORY_BUDGET // 2 ** 20):
     """Sort the EDN logs by timestamp in preparation for Datomic import."""
-    pseudoace.sort_edn_logs(context, edn_logs_dir)
+    pseudoace.sort_edn_logs(context,
+                            edn_logs_dir,
+                            engine=engine,
+                            n_procs=jobs,
+                            tmp_dir=tmp_dir,
+                            memory_budget=memory_budget_mb * 2 ** 20)
+
+
+@run.command('benchmark-sort-edn-logs',
+             short_help='Compares the EDN log sort engines')
+@util.option('-n', '--n-files',
+             default=4,
+             type=int,
+             help='Number of (the largest) EDN logs to benchmark with')
+@util.option('--tmp-dir',
+             default=None,
+             help='Directory to copy the EDN logs into')
+@click.argument('edn_logs_dir')
+@util.pass_command_context
+def benchmark_sort_edn_logs(context, edn_logs_dir, n_files=4, tmp_dir=None):
+    """Times the native EDN log sort against sort-edn-log.sh.
+
+    Both engines sort copies of the same (unsorted) EDN logs.
+    """
+    paths = sorted(pseudoace.edn_log_paths(edn_logs_dir),
+                   key=os.path.getsize,
+                   reverse=True)[:n_files]
+    timings = pseudoace.benchmark_sort_edn_logs(context,
+                                                paths,
+                                                tmp_dir=tmp_dir)
+    n_bytes = sum(map(os.path.getsize, paths))
+    click.echo('Sorted {:d} EDN logs ({:.1f} MB)'.format(len(paths),
+                                                         n_bytes / 2 ** 20))
+    for (engine, seconds) in timings.items():
+        click.echo('{:>8}: {:8.1f}s {:8.2f} MB/s'.format(
+            engine, seconds, n_bytes / 2 ** 20 / max(seconds, 1e-6)))
 
 
 @run.command('qa-report')
@@ -204,11 +376,19 @@ def qa_report(context, acedb_id_catalog):
 
 
 @run.command('import-logs')
+@util.option('--batch-size-mb',
+             default=0,
+             type=int,
+             help=('Import the EDN logs in time-ordered batches of this size, '
+                   'using the index written by sort-edn-logs '
+                   '(0 imports all logs at once)'))
 @click.argument('edn_logs_dir')
 @util.pass_command_context
-def import_logs(context, edn_logs_dir):
+def import_logs(context, edn_logs_dir, batch_size_mb=0):
     """Imports EDN logs into a Datomic database ."""
-    pseudoace.import_logs(context, edn_logs_dir)
+    pseudoace.import_logs(context,
+                          edn_logs_dir,
+                          batch_bytes=batch_size_mb * 2 ** 20)
 
 
 @run.command('apply-patches')
@@ -223,38 +403,249 @@ def apply_patches(context):
 @util.option('--db-name',
              default=None,
              help='Datomic database name to backup to')
+@util.option('--archive-engine',
+             default=None,
+             type=click.Choice(choices=tuple(archive.ENGINES)),
+             help=('Archive engine, defaults to the [azanium.archive] '
+                   'engine setting or xz; upload-result expects .tar.xz'))
+@util.option('--archive-level',
+             default=None,
+             type=int,
+             help='Compression level of the archive')
+@util.option('--archive-threads',
+             default=None,
+             type=int,
+             help='Number of threads compressing the archive')
+@util.option('--upload/--no-upload',
+             default=False,
+             help=('Upload the archive to S3 (as upload-result would) '
+                   'while it is being created'))
+@util.option('--local-archive/--no-local-archive',
+             default=True,
+             help='Also write the archive to local disk when uploading')
+@util.option('--incremental/--no-incremental',
+             default=True,
+             help=('Update an existing backup, or one seeded from the '
+                   'previous backup of the database, rather than only '
+                   'backing up when there is none'))
 @util.pass_command_context
-def backup_db(context, db_name=None):
+def backup_db(context, db_name=None, archive_engine=None, archive_level=None,
+              archive_threads=None, upload=False, local_archive=True,
+              incremental=True):
     """Back up the Datomic database to the local disk."""
-    os.chdir(context.path('datomic_free'))
     if db_name is None:
         db_name = util.get_data_release_version()
+    (engine, level, threads) = archive.settings(archive_engine,
+                                                archive_level,
+                                                archive_threads)
     date_stamp = datetime.date.today().isoformat()
     local_backup_path = os.path.join(context.path('datomic-db-backup'),
                                      date_stamp,
                                      db_name)
-    archive_filename = '{}.tar.xz'.format(db_name)
+    archive_filename = archive.archive_filename(db_name, engine)
     archive_path = os.path.join(os.path.dirname(local_backup_path),
                                 archive_filename)
 
-    if not os.path.isdir(local_backup_path):
+    changed = False
+    backup_summary = ''
+    if incremental:
+        logger.info('Updating datomic backup for DB {}.', db_name)
+        backup = datomic.incremental_backup_db(context,
+                                               local_backup_path,
+                                               db_name)
+        changed = backup.written > 0
+        backup_summary = ('Backed up in {s:.0f}s ({r:d} segments reused, '
+                          '{w:d} written). ').format(s=backup.seconds,
+                                                     r=backup.reused,
+                                                     w=backup.written)
+    elif not os.path.isdir(local_backup_path):
         logger.info('Creating datomic backup for DB {}.', db_name)
         datomic.backup_db(context, local_backup_path, db_name)
+        changed = True
+    if changed and os.path.isfile(archive_path):
+        logger.info('Removing archive {} of the previous backup',
+                    archive_path)
+        os.remove(archive_path)
 
     result = None
-    if not os.path.isfile(archive_path):
+    archive_key = s3.release_key(util.get_data_release_version(),
+                                 archive_filename)
+    s3_client = aws.client('s3') if upload else None
+    # shared with upload-result, which then skips the archive uploaded
+    manifest = util.FileManifest(context.app_state, 'upload-result')
+    if upload and os.path.isfile(archive_path):
+        [uploaded] = s3.upload_files(s3_client,
+                                     [(archive_path, archive_key)],
+                                     manifest)
+        result = 'Datomic database archive {bp} {done} to {key}.'.format(
+            bp=archive_path,
+            done='already uploaded' if uploaded.skipped else 'uploaded',
+            key=archive_key)
+    elif (upload and
+            not changed and
+            s3.object_sha256(s3_client, archive_key) is not None):
+        # uploaded by a previous run without keeping a local archive
+        result = 'Datomic database archive already uploaded to {}.'.format(
+            archive_key)
+        logger.info(result)
+    elif upload:
+        logger.info('Creating archive {} while uploading to S3',
+                    archive_key)
+        with s3.MultipartWriter(archive_key, client=s3_client) as s3_file:
+            if local_archive:
+                with open(archive_path + '.part', 'wb') as fp:
+                    archived = archive.archive_to(local_backup_path,
+                                                  db_name,
+                                                  s3.Tee(fp, s3_file),
+                                                  archive_path,
+                                                  engine=engine,
+                                                  level=level,
+                                                  threads=threads)
+                os.rename(archive_path + '.part', archive_path)
+            else:
+                archived = archive.archive_to(local_backup_path,
+                                              db_name,
+                                              s3_file,
+                                              archive_key,
+                                              engine=engine,
+                                              level=level,
+                                              threads=threads)
+        if local_archive:
+            manifest.record(archive_path,
+                            archive_path,
+                            util.file_stat(archive_path),
+                            out_sha256=archived.sha256)
+        result = ('Datomic database compressed and uploaded to {key} '
+                  'in {s:.0f}s (ratio {r:.3f}).').format(key=archive_key,
+                                                         s=archived.seconds,
+                                                         r=archived.ratio)
+    elif not os.path.isfile(archive_path):
         logger.info('Creating archive {} for upload', archive_path)
-        with tarfile.open(archive_path, mode='w:xz') as tf:
-            tf.add(local_backup_path, arcname=db_name)
-        result = 'Datomic database compressed to {bp}.'.format(bp=archive_path)
+        archived = archive.create_archive(local_backup_path,
+                                          db_name,
+                                          archive_path,
+                                          engine=engine,
+                                          level=level,
+                                          threads=threads)
+        result = ('Datomic database compressed to {bp} in {s:.0f}s '
+                  '(ratio {r:.3f}).').format(bp=archive_path,
+                                             s=archived.seconds,
+                                             r=archived.ratio)
     else:
         result = 'Compressed datomic database file {bp} already exists, no changes made.'.format(bp=archive_path)
         logger.info(result)
 
+    result = backup_summary + result
     click.echo(result)
     return result
 
 
+@run.command('benchmark-archive',
+             short_help='Compares the archive engines on a directory')
+@util.option('-e', '--engine',
+             'engines',
+             multiple=True,
+             type=click.Choice(choices=tuple(archive.ENGINES)),
+             help='Archive engine to benchmark (all by default)')
+@util.option('-l', '--level',
+             'levels',
+             multiple=True,
+             type=int,
+             help='Compression level (the engine\'s default by default)')
+@util.option('-t', '--threads',
+             'threads',
+             multiple=True,
+             type=int,
+             help='Number of compression threads (all CPUs by default)')
+@util.option('--tmp-dir',
+             default=None,
+             help='Directory to write the archives into')
+@click.argument('src_dir')
+@util.pass_command_context
+def benchmark_archive(context, src_dir, engines=(), levels=(), threads=(),
+                      tmp_dir=None):
+    """Times archiving SRC_DIR (e.g a Datomic backup) with each combination
+    of the engines, levels and threads given, against the compression ratio.
+    """
+    configurations = [(engine, level, n_threads)
+                      for engine in engines or tuple(archive.ENGINES)
+                      for level in levels or (archive.DEFAULT_LEVELS[engine],)
+                      for n_threads in threads or (psutil.cpu_count(),)]
+    out_dir = tmp_dir or os.path.dirname(os.path.abspath(src_dir))
+    results = archive.benchmark(src_dir, out_dir, configurations)
+    click.echo('{:>8} {:>5} {:>7} {:>9} {:>9} {:>7}'.format(
+        'engine', 'level', 'threads', 'seconds', 'MB/s', 'ratio'))
+    for result in results:
+        click.echo('{:>8} {:5d} {:7d} {:9.1f} {:9.2f} {:7.3f}'.format(
+            result.engine,
+            result.level,
+            result.threads,
+            result.seconds,
+            result.throughput / 2 ** 20,
+            result.ratio))
+
+
+def _format_metric(metric, value):
+    if value is None:
+        return '-'
+    if metric.endswith('seconds'):
+        return '{:.0f}'.format(value)
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(value) < 1024:
+            return '{:.1f}{}'.format(value, unit)
+        value /= 1024
+    return '{:.1f}TB'.format(value)
+
+
+@run.command('report', short_help='Compare step profiles across releases')
+@util.option('-n', '--n-releases',
+             default=4,
+             type=int,
+             help='Number of releases to compare')
+@util.option('-m', '--metric',
+             default='seconds',
+             type=click.Choice(choices=tuple(PROFILE_METRICS)),
+             help='The step profile metric to compare')
+@util.pass_command_context
+def report(context, n_releases=4, metric='seconds'):
+    """Prints a table comparing a metric of each migration step across the
+    most recent releases migrated.
+
+    The last column is the change from the previous release.
+    """
+    history = context.history_state
+    releases = sorted(history)[-n_releases:]
+    if not releases:
+        click.echo('No migration steps have been profiled yet.')
+        return
+    step_names = [step.func.name
+                  for step in _get_steps(context, with_homol=True)]
+    for release in releases:
+        step_names.extend(name for name in history[release]
+                          if name not in step_names)
+    rows = [['Step'] + releases + ['Change']]
+    for name in step_names:
+        values = [history[release].get(name, {}).get(metric)
+                  for release in releases]
+        if not any(v is not None for v in values):
+            continue
+        change = '-'
+        if len(values) > 1 and values[-2] and values[-1] is not None:
+            change = '{:+.0f}%'.format(100.0 * (values[-1] - values[-2]) /
+                                       values[-2])
+        rows.append([name] +
+                    [_format_metric(metric, v) for v in values] +
+                    [change])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    click.echo(PROFILE_METRICS[metric])
+    for (row_n, row) in enumerate(rows):
+        click.echo('  '.join([row[0].ljust(widths[0])] +
+                             [cell.rjust(width)
+                              for (cell, width) in zip(row[1:], widths[1:])]))
+        if row_n == 0:
+            click.echo('  '.join('-' * width for width in widths))
+
+
 @root_command.command(
     'clean-previous-state',
     short_help='Removes data from a previous migration run.')
@@ -266,6 +657,8 @@ def clean_previous_state(context):
         'acedb_id_catalog',
         'acedb-dump',
         'edn-logs',
+        'edn-logs.batches',
+        'edn-logs.shards',
         'homol-edn-logs',
         'datomic-db-backup'
     }
@@ -273,6 +666,10 @@ def clean_previous_state(context):
     for name in to_remove:
         logger.info('Removing directory: {}', name)
         force_rmdir(context.path(name))
+    edn_logs_index_path = ednsort.index_path(context.path('edn-logs'))
+    if os.path.isfile(edn_logs_index_path):
+        logger.info('Removing file: {}', edn_logs_index_path)
+        os.remove(edn_logs_index_path)
     try:
         os.remove(os.path.expanduser('~/.db-migration.db'))
     except OSError as err:
@@ -285,11 +682,155 @@ def clean_previous_state(context):
 def homol_import(context):
     pseudoace.homol_import(context)
 
-Step = collections.namedtuple('Step', ('description', 'func', 'kwargs'))
+
+@root_command.command('backup-homol-db',
+                      short_help='Backup the homology database')
+@util.option('--upload/--no-upload',
+             default=False,
+             help=('Upload the archive to S3 (as upload-result would) '
+                   'while it is being created'))
+@util.pass_command_context
+def backup_homol_db(context, upload=False):
+    ctx = click.get_current_context()
+    database_name = util.get_data_release_version() + '-homol'
+    return ctx.invoke(backup_db, db_name=database_name, upload=upload)
+
+
+@root_command.command('restore',
+                      short_help='Restores a migrated database from S3')
+@util.option('--release',
+             default=None,
+             help=('Release of the migration results to restore from '
+                   '(the configured release by default)'))
+@util.option('--db-name',
+             default=None,
+             help='Name of the database to restore (the release by default)')
+@util.option('--archive-engine',
+             default='xz',
+             type=click.Choice(choices=tuple(archive.ENGINES)),
+             help='Archive engine of the database archive')
+@util.option('--connections',
+             default=None,
+             type=int,
+             help=('Number of concurrent ranged downloads, defaults to the '
+                   '[azanium.s3] max_concurrency setting'))
+@util.option('--part-size-mb',
+             default=None,
+             type=int,
+             help=('Size of each ranged download, defaults to the '
+                   '[azanium.s3] part_size_mb setting'))
+@util.pass_command_context
+def restore(context, release=None, db_name=None, archive_engine='xz',
+            connections=None, part_size_mb=None):
+    """Restore a database from the migration results in S3.
+
+    The database archive is downloaded with concurrent ranged requests,
+    decompressed and extracted as it downloads, then restored into a
+    transactor started by azanium.
+    """
+    if release is None:
+        release = util.get_data_release_version()
+    if db_name is None:
+        db_name = release
+    transfer = s3.transfer_config()
+    if connections is None:
+        connections = transfer.max_concurrency
+    part_size = (transfer.multipart_chunksize if part_size_mb is None
+                 else part_size_mb * 2 ** 20)
+    archive_key = s3.release_key(release,
+                                 archive.archive_filename(db_name,
+                                                          archive_engine))
+    restore_dir = context.path('datomic-db-restore', release)
+    local_backup_path = os.path.join(restore_dir, db_name)
+    timings = collections.OrderedDict()
+
+    if os.path.isdir(local_backup_path):
+        logger.info('Using the backup previously extracted to {}',
+                    local_backup_path)
+    else:
+        s3_client = aws.client('s3')
+        head = s3.head(s3_client, archive_key)
+        if head is None:
+            util.echo_error('No database archive at s3://{}/{}'.format(
+                s3.BUCKET, archive_key))
+            return
+        expected_sha256 = s3.object_sha256(s3_client, archive_key)
+        partial_dir = restore_dir + '.part'
+        if os.path.isdir(partial_dir):
+            shutil.rmtree(partial_dir)
+        os.makedirs(partial_dir)
+        logger.info('Downloading and extracting s3://{}/{} to {}',
+                    s3.BUCKET, archive_key, restore_dir)
+        started = time.time()
+        with s3.RangedReader(archive_key,
+                             client=s3_client,
+                             part_size=part_size,
+                             max_concurrency=connections) as reader:
+            archive.extract_archive(reader, partial_dir, engine=archive_engine)
+            # hash the rest of the object, not read by the decompressor
+            for data in iter(partial(reader.read, part_size), b''):
+                pass
+        timings['download'] = reader.download_seconds
+        timings['download and extract'] = time.time() - started
+        sha256 = reader.digest.hexdigest()
+        if expected_sha256 is not None and sha256 != expected_sha256:
+            shutil.rmtree(partial_dir)
+            util.echo_error('SHA-256 of s3://{}/{} is {}, expected {}'.format(
+                s3.BUCKET, archive_key, sha256, expected_sha256))
+            return
+        os.makedirs(restore_dir, exist_ok=True)
+        os.rename(os.path.join(partial_dir, db_name), local_backup_path)
+        shutil.rmtree(partial_dir)
+        logger.info('Downloaded {:.1f} MB at {:.1f} MB/s',
+                    reader.n_bytes / 2 ** 20,
+                    reader.n_bytes / 2 ** 20 / max(timings['download'], 1e-6))
+
+    if datomic.transactor_running():
+        logger.info('Using the running datomic transactor')
+    else:
+        timings['transactor start'] = datomic.configure_transactor(
+            context,
+            context.path('datomic_free'))
+
+    started = time.time()
+    datomic.restore_db(context, local_backup_path, db_name)
+    timings['restore-db'] = time.time() - started
+
+    result = 'Restored {db} from s3://{bucket}/{key} ({timings}).'.format(
+        db=context.datomic_url(db_name),
+        bucket=s3.BUCKET,
+        key=archive_key,
+        timings=', '.join('{} {:.1f}s'.format(phase, seconds)
+                          for (phase, seconds) in timings.items()))
+    click.echo(result)
+    return result
+
+
+Step = collections.namedtuple('Step', ('description',
+                                       'func',
+                                       'kwargs',
+                                       'requires',
+                                       'weight'))
 
 LOGS_DIR = 'edn-logs'
 
-def _get_steps(context):
+COMPLETED_STEPS_STATE_KEY = 'completed-steps'
+
+# Whether the steps of the migration include those of the homology database.
+WITH_HOMOL_STATE_KEY = 'migrate-with-homol'
+
+# The total weight of the steps run at once, by default one at a time
+# as before steps ran concurrently.
+MAX_STEPS_WEIGHT = 1
+
+# The steps heavy on CPU and memory weigh 2, so with a total weight of 3
+# only one of them runs alongside the lighter steps (such as creating
+# the database).
+CONCURRENT_STEPS_WEIGHT = 3
+
+
+def _get_steps(context, pipeline_dump=False, with_homol=False,
+               ace_to_edn_jobs=1, upload_backups=False):
     datomic_path = context.path('datomic_free')
     dump_dir = context.path('acedb-dump')
     id_catalog_path = context.path('acedb_id_catalog')
@@ -299,64 +840,124 @@ def _get_steps(context):
     steps = [
         Step('Input validation',
              input_validation,
-             {}),
+             {},
+             (),
+             1),
         Step('Fetch ACeDB data for release',
              acedb_database,
              dict(acedb_dir=acedb_dir,
-                  acedb_id_catalog_dir=acedb_id_catalog_dir)),
+                  acedb_id_catalog_dir=acedb_id_catalog_dir),
+             ('input-validation',),
+             1),
         Step('Dumping all ACeDB files',
              acedb_dump,
-             dict(dump_dir=dump_dir)),
+             dict(dump_dir=dump_dir,
+                  compress_while_dumping=pipeline_dump),
+             ('acedb-database',),
+             2),
         Step('Compresssing all ACeDB files',
              acedb_compress_dump,
-             dict(dump_dir=dump_dir)),
+             dict(dump_dir=dump_dir),
+             ('acedb-dump',),
+             2),
         Step('Creating Datomic database',
              create_database,
-             dict(datomic_path=datomic_path)),
+             dict(datomic_path=datomic_path),
+             ('input-validation',),
+             1),
         Step('Converting ACeDB files to EDN logs',
              ace_to_edn,
-             dict(acedb_dump_dir=dump_dir, edn_logs_dir=logs_dir)),
+             dict(acedb_dump_dir=dump_dir,
+                  edn_logs_dir=logs_dir,
+                  jobs=ace_to_edn_jobs),
+             ('acedb-compress-dump', 'create-database'),
+             2),
         Step('Sorting EDN logs by timestamp',
              sort_edn_logs,
-             dict(edn_logs_dir=logs_dir)),
+             dict(edn_logs_dir=logs_dir),
+             ('acedb-dump-to-edn-logs',),
+             2),
         Step('Import EDN logs into Datomic database',
              import_logs,
-             dict(edn_logs_dir=logs_dir)),
+             dict(edn_logs_dir=logs_dir),
+             ('sort-edn-logs',),
+             2),
         Step('Apply ACe patches from the PATCHES directory on the FTP site.',
              apply_patches,
-             {}),
+             {},
+             ('import-logs',),
+             1),
         Step('Running QA report on Datomic database',
              qa_report,
-             dict(acedb_id_catalog=id_catalog_path)),
+             dict(acedb_id_catalog=id_catalog_path),
+             ('apply-patches',),
+             1),
         Step('Backup main migration database.',
              backup_db,
-             {})]
+             dict(upload=upload_backups),
+             # Only back up a database that passed QA, as before steps
+             # ran concurrently.
+             ('qa-report',),
+             1)]
+    if with_homol:
+        # The homology import only reads the dump and the sorted EDN logs,
+        # so it can run alongside the main import; being as heavy, only
+        # with a total weight of 4.
+        steps.extend([
+            Step('Create the homology database',
+                 homol_import,
+                 {},
+                 ('sort-edn-logs', 'create-database'),
+                 2),
+            Step('Backup the homology database',
+                 backup_homol_db,
+                 dict(upload=upload_backups),
+                 ('homol-import',),
+                 1)])
     return steps
 
 
-def available_reset_steps(context):
-    steps = _get_steps(context)
-    last_ok_step_n = context.app_state[LAST_STEP_OK_STATE_KEY]
-    avail_steps = collections.OrderedDict()
-    for (step_n, t) in enumerate(steps[:last_ok_step_n - 1], start=1):
-        avail_steps[step_n] = t.description
-    return avail_steps
+def completed_steps(context, steps):
+    """Returns the names of the steps completed by previous runs.
+
+    The index of the last step completed, as recorded by previous versions,
+    is converted to the names of the steps up to and including it.
+    """
+    state = context.app_state
+    if LAST_STEP_OK_STATE_KEY in state:
+        last_ok_step_n = int(state[LAST_STEP_OK_STATE_KEY])
+        if COMPLETED_STEPS_STATE_KEY not in state:
+            state[COMPLETED_STEPS_STATE_KEY] = [
+                step.func.name for step in steps[:last_ok_step_n]]
+        del state[LAST_STEP_OK_STATE_KEY]
+        state.sync()
+    return set(state.get(COMPLETED_STEPS_STATE_KEY, []))
+
+
+def _dependants(steps, name):
+    """Returns the names of the steps which depend on step `name`."""
+    names = {name}
+    for step in steps:
+        if names.intersection(step.requires):
+            names.add(step.func.name)
+    return names - {name}
 
 
 @root_command.command('reset-to-step',
                       short_help='Reset the migration to a previous step')
 @util.pass_command_context
 def reset_to_step(context):
+    """Marks a completed step, and all the steps depending on it, as not done.
+    """
     error = lambda msg: util.echo_error('ERROR: {}'.format(msg), notify=False)
-    last_ok_step_n = context.app_state.get(LAST_STEP_OK_STATE_KEY)
-    if not last_ok_step_n:
+    steps = _get_steps(context,
+                       with_homol=context.app_state.get(WITH_HOMOL_STATE_KEY,
+                                                        False))
+    completed = completed_steps(context, steps)
+    if not completed:
         error('Migration has not been run, cannot reset to any state.')
         click.get_current_context().exit(1)
     click.echo('Reset to previous migration step')
-    click.echo(
-        'The last step that completed successfully was: {}'.format(last_ok_step_n),
-        nl=False)
-    click.echo(color='green')
     click.echo()
     click.echo("""\
     WARNING!:
@@ -365,75 +966,247 @@ def reset_to_step(context):
     the step you want to revert to.
     """, color='red')
     out_lines = []
-    available_steps = available_reset_steps(context)
-    for (step_n, step_desc) in available_steps.items():
-        out_lines.append('Step {num}: {desc}'.format(num=step_n, desc=step_desc))
+    available_steps = collections.OrderedDict()
+    for (step_n, step) in enumerate(steps, start=1):
+        if step.func.name in completed:
+            available_steps[step_n] = step
+            out_lines.append('Step {num}: {desc} (done)'.format(
+                num=step_n,
+                desc=step.description))
     separator = '-' * max(map(len, out_lines))
     click.echo(separator)
     for out_line in out_lines:
         click.echo(out_line)
     click.echo(separator)
     step_n_req = click.prompt('Reset to step',
-                              default=abs(last_ok_step_n - 1),
-                              type=int,
+                              default=max(available_steps),
+                              type=click.Choice(
+                                  choices=list(map(str, available_steps))),
                               show_default=True)
-    step_n_req -= 1
-    if step_n_req < last_ok_step_n:
-        if click.confirm('Reset step to {}?'.format(step_n_req), abort=True):
-            context.app_state[LAST_STEP_OK_STATE_KEY] = step_n_req
-    elif step_n_req > last_ok_step_n:
-        error('Refusing to set migration step to a future step')
-    step_n = context.app_state[LAST_STEP_OK_STATE_KEY]
-    click.echo('Migration step is now set to {}'.format(step_n + 1))
-
-def process_steps(context, steps):
+    step = available_steps[int(step_n_req)]
+    to_reset = {step.func.name} | _dependants(steps, step.func.name)
+    if click.confirm('Reset steps {}?'.format(', '.join(sorted(to_reset))),
+                     abort=True):
+        context.app_state[COMPLETED_STEPS_STATE_KEY] = [
+            s.func.name for s in steps
+            if s.func.name in completed - to_reset]
+        context.app_state.sync()
+    click.echo('Migration will resume from step {}'.format(step_n_req))
+
+
+def profiled(context, name, description, func, paths=()):
+    """Wraps `func`, a migration step, to record its profile when it succeeds.
+
+    The profile holds the start and end times of the step,
+    the resources used by the commands it ran, and the size of `paths`
+    before (input) and after (output) the step.
+    Profiles are stored per release in ``util.history_state``.
+    """
+    def profile_step():
+        release = util.get_data_release_version()
+        input_bytes = sum(map(util.path_size, paths))
+        started = time.time()
+        with metrics.collect() as usages:
+            result = func()
+        finished = time.time()
+        profile = dict(description=description,
+                       started=started,
+                       finished=finished,
+                       seconds=finished - started,
+                       cpu_seconds=sum(u.cpu_seconds for u in usages),
+                       peak_rss=max([u.peak_rss for u in usages] or [0]),
+                       read_bytes=sum(u.read_bytes for u in usages),
+                       write_bytes=sum(u.write_bytes for u in usages),
+                       input_bytes=input_bytes,
+                       output_bytes=sum(map(util.path_size, paths)))
+        # Steps running concurrently update the profiles of the release.
+        with context.history_state.lock:
+            profiles = context.history_state.get(release, {})
+            profiles[name] = profile
+            context.history_state[release] = profiles
+            context.history_state.sync()
+        return result
+
+    return profile_step
+
+
+def _step_paths(step):
+    return [value for value in step.kwargs.values()
+            if isinstance(value, str) and os.path.isabs(value)]
+
+
+def process_steps(context, steps, max_weight=MAX_STEPS_WEIGHT):
+    """Runs the steps not yet completed as their required steps complete.
+
+    Steps run concurrently while their total weight is within `max_weight`;
+    a step weighing more runs on its own.
+    Each step is recorded as completed as soon as it succeeds, so that a
+    re-run after a failure only runs the steps not completed.
+    """
     headline_fmt = 'Migrating ACeDB {release} to Datomic, *Step {step}*'
     release = util.get_data_release_version()
     ctx = click.get_current_context()
-    step_idx = int(context.app_state.get(LAST_STEP_OK_STATE_KEY, '0'))
-    step_n = step_idx + 1
-    for (step_n, step) in enumerate(steps[step_idx:], start=step_n):
-        step_command = partial(ctx.invoke, step.func, **step.kwargs)
-        headline = headline_fmt.format(release=release, step=step_n)
+    step_numbers = {step.func.name: step_n
+                    for (step_n, step) in enumerate(steps, start=1)}
+    for step in steps:
+        unknown = set(step.requires) - set(step_numbers)
+        if unknown:
+            raise ValueError('Step {} requires unknown steps: {}'.format(
+                step.func.name, ', '.join(sorted(unknown))))
+    completed = completed_steps(context, steps)
+    pending = [step for step in steps if step.func.name not in completed]
+
+    def run_step(step):
+        step_command = profiled(context,
+                                step.func.name,
+                                step.description,
+                                partial(ctx.invoke, step.func, **step.kwargs),
+                                paths=_step_paths(step))
+        headline = headline_fmt.format(release=release,
+                                       step=step_numbers[step.func.name])
         with logger:
-            notifications.around(step_command,
-                                 headline,
-                                 step.description)
-            # if a step (above) fails, an exception will be thrown
+            # if a step fails, an exception will be thrown
             # (uncaught), such that exception is propergated (i.e will
             # be visible verbatim in slack)
-            # only write the "last step ok" to disk when successful.
-            context.app_state[LAST_STEP_OK_STATE_KEY] = step_n
+            return notifications.around(step_command,
+                                        headline,
+                                        step.description)
+
+    running = {}
+    error = None
+    executor = concurrent.futures.ThreadPoolExecutor(len(steps))
+    try:
+        while pending or running:
+            weight = sum(min(s.weight, max_weight) for s in running.values())
+            for step in list(pending if error is None else []):
+                step_weight = min(step.weight, max_weight)
+                if not completed.issuperset(step.requires):
+                    continue
+                if running and weight + step_weight > max_weight:
+                    continue
+                logger.info('Starting step {}: {}',
+                            step_numbers[step.func.name],
+                            step.description)
+                pending.remove(step)
+                running[executor.submit(run_step, step)] = step
+                weight += step_weight
+            if not running:
+                break
+            (done, _) = concurrent.futures.wait(
+                running,
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                step = running.pop(future)
+                try:
+                    future.result()
+                except Exception as exc:
+                    # let the steps already running finish,
+                    # but don't start any more.
+                    error = error or exc
+                    continue
+                # only record the step as completed when successful.
+                completed.add(step.func.name)
+                context.app_state[COMPLETED_STEPS_STATE_KEY] = [
+                    s.func.name for s in steps if s.func.name in completed]
+                context.app_state.sync()
+    except KeyboardInterrupt:
+        # The commands of steps run in sessions of their own, so are not
+        # interrupted: kill them, rather than wait for them to finish.
+        logger.warning('Interrupted, killing the commands of {:d} '
+                       'running steps', len(running))
+        util.kill_process_groups()
+        raise
+    finally:
+        executor.shutdown()
+    if error is not None:
+        raise error
     notifications.notify('{} migration'.format(release),
                          attachments=[notifications.Attachment(title='*all done!*')],
                          icon_emoji=':fireworks:')
 
 @root_command.command('migrate',
                       short_help='Run all db-migration steps.')
+@util.option('--pipeline-dump/--no-pipeline-dump',
+             default=False,
+             help='Compress ACeDB files while they are being dumped')
+@util.option('-j', '--jobs',
+             default=MAX_STEPS_WEIGHT,
+             type=int,
+             help=('Total weight of the steps run concurrently: '
+                   'the default of 1 runs one step at a time, '
+                   '{:d} runs one heavy step alongside the '
+                   'lighter ones'.format(CONCURRENT_STEPS_WEIGHT)))
+@util.option('--with-homol/--without-homol',
+             default=False,
+             help=('Also migrate the homology database, '
+                   'concurrently with the main database given '
+                   '--jobs 4'))
+@util.option('--pseudoace-worker/--no-pseudoace-worker',
+             default=False,
+             help=('Run all pseudoace commands in one long running JVM, '
+                   'one at a time'))
+@util.option('--ace-to-edn-jobs',
+             default=1,
+             type=int,
+             help=('Number of pseudoace processes converting .ace files '
+                   'to EDN logs'))
+@util.option('--upload-backups/--no-upload-backups',
+             default=False,
+             help=('Upload the database archives to S3 while they are '
+                   'being created'))
 @util.pass_command_context
-def migrate(context):
+def migrate(context, pipeline_dump=False, jobs=MAX_STEPS_WEIGHT,
+            with_homol=False, pseudoace_worker=False, ace_to_edn_jobs=1,
+            upload_backups=False):
     """Migrate the main WormBase ACeDB database to Datomic.
 
     Steps:
-        1. Dump ACeDB files (.ace files)
+        1. Validate the input (data release version)
+
+        2. Fetch the ACeDB data for the release
+
+        3. Dump ACeDB files (.ace files)
+
+        4. Compress ACedB files using gzip
+
+        5. Create Datomic Database
 
-        2. Compress ACedB files using gzip
+        6. Convert .ace files to EDN logs
 
-        3. Create Datomic Database
+        7. Sort EDN log files by timestamp
 
-        4. Convert .ace files to EDN logs
+        8. Import EDN logs into Datomic database
 
-        5. Sort EDN log files by timestamp
+        9. Apply any ACe patches from the PATCHES directory on the FTP site.
 
-        6. Import EDN logs into Datomic database
+        10. Run the QA report on the Datomic database
 
-        7. Apply any ACe patches from the PATCHES directory on the FTP site.
+        11. Backup Datomic database locally.
 
-        8. Backup Datomic database locally.
+    By default the steps run one at a time, in the order above.
+    With `--jobs` greater than 1, steps run as soon as the steps they
+    depend on have completed, e.g the Datomic database is created while
+    ACeDB is dumped.
 
+    With `--with-homol`, the homology database is created once the EDN logs
+    are sorted, alongside the main import with `--jobs 4`, and backed up;
+    both backups are then ready for `upload-result`.
+
+    The heap sizes of the JVMs running concurrently are planned within
+    the memory available (see `azanium.jvm`).
     """
-    steps = _get_steps(context)
-    process_steps(context, steps)
+    steps = _get_steps(context,
+                       pipeline_dump=pipeline_dump,
+                       with_homol=with_homol,
+                       ace_to_edn_jobs=ace_to_edn_jobs,
+                       upload_backups=upload_backups)
+    context.app_state[WITH_HOMOL_STATE_KEY] = with_homol
+    context.app_state.sync()
+    if pseudoace_worker:
+        with pseudoace.worker_session(context):
+            process_steps(context, steps, max_weight=jobs)
+    else:
+        process_steps(context, steps, max_weight=jobs)
 
 
 @root_command.command('migrate-homol',
@@ -445,17 +1218,21 @@ def migrate_homol(context):
     headline_fmt = ''.join(['Migrating ACeDB homology for ',
                             '{release} to Datomic, *Step {step}*'])
     release = util.get_data_release_version()
-    database_name = release+"-homol"
     datomic_path = context.path('datomic_free')
     datomic.configure_transactor(context, datomic_path)
     with logger:
-        notifications.around(partial(ctx.invoke, homol_import),
+        notifications.around(profiled(context,
+                                      'homol-import',
+                                      'Create the homology database',
+                                      partial(ctx.invoke, homol_import),
+                                      paths=[context.path('homol-edn-logs')]),
                              headline_fmt.format(release=release,
                                                  step=1),
                              'Create the homology database')
-        notifications.around(partial(ctx.invoke,
-                                     backup_db,
-                                     **dict(db_name=database_name)),
+        notifications.around(profiled(context,
+                                      'backup-homol-db',
+                                      'Backup the homology database',
+                                      partial(ctx.invoke, backup_homol_db)),
                              headline_fmt.format(release=release,
                                                  step=2),
                              'Backup the homology database')
@@ -464,6 +1241,13 @@ def migrate_homol(context):
                       short_help='Upload the result of both migrations to S3, available for the Wormbase web team.')
 @util.pass_command_context
 def upload_result(context):
+    """Uploads the database archives, QA report and log to S3.
+
+    The files are uploaded concurrently, with their SHA-256 recorded in the
+    objects' metadata and in a manifest (``manifest.json``) written last.
+    Files already uploaded by a previous run, and unchanged since,
+    are skipped.
+    """
     release = util.get_data_release_version()
 
     # Get local file paths
@@ -473,26 +1257,39 @@ def upload_result(context):
     report_filename = '{}-report.csv'.format(release)
 
     db_file_path = context.path('datomic-db-backup')
-    main_db_files = glob.glob('{}/*/{}'.format(db_file_path,main_db_filename))
-    homol_db_files = glob.glob('{}/*/{}'.format(db_file_path,homol_db_filename))
-
-    #Ensure exactly 1 db_file is found for each
-    if len(main_db_files) != 1:
-        util.echo_error('ERROR: Main migration DB dump file count != 1. Cleanup redundant dumps from {}, or ensure a database dump is available.'.format(db_file_path))
-        click.get_current_context().exit(1)
-    if len(homol_db_files) != 1:
-        util.echo_error('ERROR: Main migration DB dump file count != 1. Cleanup redundant dumps from {}, or ensure a database dump is available.'.format(db_file_path))
-        click.get_current_context().exit(1)
-
-    main_db_filepath = main_db_files[0]
-    homol_db_filepath = homol_db_files[0]
     log_filepath    = os.path.join( context.path('logs'), log_filename)
     report_filepath = os.path.join( context.base_path, report_filename)
+    s3_client = aws.client('s3')
+    uploads = []
+    uploaded = []
+    for (label, db_filename) in (('Main', main_db_filename),
+                                 ('Homology', homol_db_filename)):
+        db_files = glob.glob('{}/*/{}'.format(db_file_path, db_filename))
+        db_key = s3.release_key(release, db_filename)
+        # archives uploaded by `backup-db --upload` may not be kept locally
+        response = None if db_files else s3.head(s3_client, db_key)
+        if response is not None:
+            logger.info('{} already uploaded to S3', db_filename)
+            uploaded.append(s3.UploadResult(
+                key=db_key,
+                size=response['ContentLength'],
+                sha256=s3.object_sha256(s3_client, db_key),
+                skipped=True))
+            continue
+        #Ensure exactly 1 db_file is found for each
+        if len(db_files) != 1:
+            util.echo_error('ERROR: {} migration DB dump file count != 1. Cleanup redundant dumps from {}, or ensure a database dump is available.'.format(label, db_file_path))
+            click.get_current_context().exit(1)
+        uploads.append((db_files[0], db_key))
+    uploads.append((report_filepath, s3.release_key(release, report_filename)))
+    uploads.append((log_filepath, s3.release_key(release, log_filename)))
 
     # Upload to S3
-    s3_filepath = 'db-migration/{release}/{{}}'.format(release=release)
-    s3 = aws.client('s3')
-    s3.upload_file(main_db_filepath, 'wormbase', s3_filepath.format(main_db_filename))
-    s3.upload_file(homol_db_filepath, 'wormbase', s3_filepath.format(homol_db_filename))
-    s3.upload_file(log_filepath, 'wormbase', s3_filepath.format(log_filename))
-    s3.upload_file(report_filepath, 'wormbase', s3_filepath.format(report_filename))
+    manifest = util.FileManifest(context.app_state, 'upload-result')
+    uploaded.extend(s3.upload_files(s3_client, uploads, manifest))
+    s3.write_manifest(s3_client,
+                      s3.release_key(release, s3.MANIFEST_FILENAME),
+                      uploaded)
+    n_skipped = sum(1 for result in uploaded if result.skipped)
+    return 'Uploaded {:d} files to S3, {:d} were already uploaded'.format(
+        len(uploaded) - n_skipped, n_skipped)
@@ -0,0 +1,366 @@
+import collections
+import concurrent.futures
+import hashlib
+import json
+import os
+import time
+
+import boto3 as aws
+import boto3.s3.transfer
+import botocore.exceptions
+
+from . import config
+from . import log
+from . import util
+
+
+logger = log.get_logger(namespace=__name__)
+
+BUCKET = 'wormbase'
+
+# S3 requires all parts but the last to be at least 5 MB.
+MIN_PART_SIZE = 5 * 2 ** 20
+
+PART_SIZE = 64 * 2 ** 20
+
+MAX_CONCURRENCY = 4
+
+# Number of files uploaded at once by ``upload_files``.
+MAX_FILES = 4
+
+MANIFEST_FILENAME = 'manifest.json'
+
+UploadResult = collections.namedtuple('UploadResult', ('key',
+                                                       'size',
+                                                       'sha256',
+                                                       'skipped'))
+
+
+def transfer_config():
+    """Returns the ``TransferConfig`` for uploads and copies.
+
+    The part size and the number of threads per file are read from the
+    ``part_size_mb`` and ``max_concurrency`` settings of the
+    ``[azanium.s3]`` section.
+    """
+    conf = config.parse().get(__name__, {})
+    part_size = int(float(conf.get('part_size_mb', PART_SIZE / 2 ** 20)) *
+                    2 ** 20)
+    return boto3.s3.transfer.TransferConfig(
+        multipart_threshold=part_size,
+        multipart_chunksize=max(part_size, MIN_PART_SIZE),
+        max_concurrency=int(conf.get('max_concurrency', MAX_CONCURRENCY)))
+
+
+def release_key(release, filename):
+    """Returns the key of `filename` in the migration results of `release`.
+    """
+    return 'db-migration/{release}/{filename}'.format(release=release,
+                                                      filename=filename)
+
+
+def head(client, key, bucket=BUCKET):
+    """Returns the ``head_object`` response for `key`, or None when the
+    object does not exist."""
+    try:
+        return client.head_object(Bucket=bucket, Key=key)
+    except botocore.exceptions.ClientError as err:
+        if err.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+            return None
+        raise
+
+
+def object_size(client, key, bucket=BUCKET):
+    """Returns the size of object `key`, or None when it does not exist."""
+    response = head(client, key, bucket=bucket)
+    return None if response is None else response['ContentLength']
+
+
+def sha256_key(key):
+    """Returns the key of the object holding the SHA-256 of object `key`,
+    for objects uploaded before their SHA-256 was known."""
+    return key + '.sha256'
+
+
+def object_sha256(client, key, bucket=BUCKET):
+    """Returns the SHA-256 of object `key`, recorded in its metadata,
+    or otherwise in the object at ``sha256_key(key)``."""
+    response = head(client, key, bucket=bucket)
+    if response is None:
+        return None
+    sha256 = response['Metadata'].get('sha256')
+    if sha256 is None:
+        try:
+            response = client.get_object(Bucket=bucket, Key=sha256_key(key))
+        except botocore.exceptions.ClientError as err:
+            if err.response.get('Error', {}).get('Code') in ('404',
+                                                             'NoSuchKey'):
+                return None
+            raise
+        sha256 = response['Body'].read().decode('ascii').split()[0]
+    return sha256
+
+
+def upload_file(client, path, key, bucket=BUCKET, transfer=None):
+    """Upload `path` to `key`, with its SHA-256 in the object's metadata.
+
+    The file is hashed before it is uploaded, since object metadata can
+    only be changed afterwards by copying the object onto itself.
+
+    :returns: The SHA-256 of the file.
+    """
+    sha256 = util.sha256sum(path)
+    client.upload_file(path,
+                       bucket,
+                       key,
+                       ExtraArgs=dict(Metadata=dict(sha256=sha256)),
+                       Config=transfer or transfer_config())
+    return sha256
+
+
+def upload_files(client, uploads, manifest, bucket=BUCKET,
+                 max_files=MAX_FILES):
+    """Upload files concurrently, skipping those already uploaded.
+
+    A file is skipped when it is unchanged since `manifest` recorded its
+    upload, and the object's SHA-256 metadata matches.
+
+    :param uploads: Pairs of local path and S3 key.
+    :param manifest: A ``util.FileManifest`` of the files uploaded.
+    :returns: The ``UploadResult`` of each upload, in the order given.
+    :rtype: list
+    """
+    transfer = transfer_config()
+
+    def upload(path, key):
+        entry = manifest.entry(path)
+        if (manifest.is_done(path, path) and
+                object_sha256(client, key, bucket=bucket) ==
+                entry['output_sha256']):
+            logger.info('Skipping {}, already uploaded to s3://{}/{}',
+                        path, bucket, key)
+            return UploadResult(key=key,
+                                size=os.path.getsize(path),
+                                sha256=entry['output_sha256'],
+                                skipped=True)
+        input_stat = util.file_stat(path)
+        logger.info('Uploading {} to s3://{}/{}', path, bucket, key)
+        sha256 = upload_file(client, path, key,
+                             bucket=bucket, transfer=transfer)
+        manifest.record(path, path, input_stat, out_sha256=sha256)
+        return UploadResult(key=key,
+                            size=input_stat['size'],
+                            sha256=sha256,
+                            skipped=False)
+
+    with concurrent.futures.ThreadPoolExecutor(max_files) as executor:
+        futures = [executor.submit(upload, path, key)
+                   for (path, key) in uploads]
+        return [future.result() for future in futures]
+
+
+def write_manifest(client, key, results, bucket=BUCKET):
+    """Write the manifest of the objects uploaded as JSON to `key`."""
+    objects = collections.OrderedDict(
+        (os.path.basename(result.key), dict(key=result.key,
+                                            size=result.size,
+                                            sha256=result.sha256))
+        for result in results)
+    body = json.dumps(dict(objects=objects), indent=2).encode('utf-8')
+    client.put_object(Bucket=bucket, Key=key, Body=body)
+    logger.info('Wrote manifest of {:d} objects to s3://{}/{}',
+                len(objects), bucket, key)
+
+
+class MultipartWriter:
+    """A file object writing to an S3 object with a multipart upload.
+
+    The data written is uploaded in parts of `part_size` bytes by up to
+    `max_concurrency` threads, while the writer carries on, such that
+    the data need not be written to disk before it is uploaded.
+    The object only exists once the writer is closed; when used as a
+    context manager, the upload is aborted if an exception is raised.
+    The SHA-256 of the data, only known once it is all written, is then
+    recorded in the object at ``sha256_key(key)``.
+    """
+
+    def __init__(self, key, bucket=BUCKET, client=None, part_size=PART_SIZE,
+                 max_concurrency=MAX_CONCURRENCY, extra_args=None):
+        self.key = key
+        self.bucket = bucket
+        self.client = client or aws.client('s3')
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.max_concurrency = max_concurrency
+        self.n_bytes = 0
+        self.digest = hashlib.sha256()
+        # the SHA-256 of an object previously uploaded to `key`
+        self.client.delete_object(Bucket=bucket, Key=sha256_key(key))
+        response = self.client.create_multipart_upload(Bucket=bucket,
+                                                       Key=key,
+                                                       **(extra_args or {}))
+        self.upload_id = response['UploadId']
+        self._buffer = bytearray()
+        self._parts = []
+        self._in_flight = collections.deque()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_concurrency)
+        logger.info('Started multipart upload to s3://{}/{}', bucket, key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _upload_part(self, part_number, data):
+        response = self.client.upload_part(Bucket=self.bucket,
+                                           Key=self.key,
+                                           UploadId=self.upload_id,
+                                           PartNumber=part_number,
+                                           Body=data)
+        return dict(ETag=response['ETag'], PartNumber=part_number)
+
+    def _wait(self, max_in_flight):
+        while len(self._in_flight) > max_in_flight:
+            self._parts.append(self._in_flight.popleft().result())
+
+    def _submit(self, data):
+        part_number = len(self._parts) + len(self._in_flight) + 1
+        self._in_flight.append(
+            self._executor.submit(self._upload_part, part_number, data))
+        self._wait(self.max_concurrency)
+
+    def write(self, data):
+        self._buffer.extend(data)
+        self.n_bytes += len(data)
+        self.digest.update(data)
+        while len(self._buffer) >= self.part_size:
+            self._submit(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+        return len(data)
+
+    def close(self):
+        """Upload the remaining data and complete the upload."""
+        if self._buffer or not (self._parts or self._in_flight):
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+        self._wait(0)
+        self._executor.shutdown()
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload=dict(Parts=self._parts))
+        sha256 = self.digest.hexdigest()
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=sha256_key(self.key),
+            Body='{}  {}\n'.format(sha256,
+                                   os.path.basename(self.key)).encode('ascii'))
+        logger.info('Uploaded {:.1f} MB to s3://{}/{} in {:d} parts',
+                    self.n_bytes / 2 ** 20,
+                    self.bucket,
+                    self.key,
+                    len(self._parts))
+
+    def abort(self):
+        for future in self._in_flight:
+            future.cancel()
+        self._executor.shutdown()
+        self.client.abort_multipart_upload(Bucket=self.bucket,
+                                           Key=self.key,
+                                           UploadId=self.upload_id)
+        logger.warning('Aborted multipart upload to s3://{}/{}',
+                       self.bucket,
+                       self.key)
+
+
+class Tee:
+    """A file object writing to each of `fps`."""
+
+    def __init__(self, *fps):
+        self.fps = fps
+
+    def write(self, data):
+        for fp in self.fps:
+            fp.write(data)
+        return len(data)
+
+
+class RangedReader:
+    """A file object reading an S3 object with ranged GETs.
+
+    Parts of `part_size` bytes are downloaded by up to `max_concurrency`
+    threads ahead of the reader, and read in order, such that the object
+    can be processed as a stream while it is being downloaded.
+    The SHA-256 of the data read is computed as it is read.
+    """
+
+    def __init__(self, key, bucket=BUCKET, client=None, part_size=PART_SIZE,
+                 max_concurrency=MAX_CONCURRENCY):
+        self.key = key
+        self.bucket = bucket
+        self.client = client or aws.client('s3')
+        self.part_size = part_size
+        self.max_concurrency = max_concurrency
+        self.size = object_size(self.client, key, bucket=bucket)
+        if self.size is None:
+            raise FileNotFoundError('s3://{}/{}'.format(bucket, key))
+        self.n_bytes = 0
+        self.digest = hashlib.sha256()
+        self.started = time.time()
+        self.finished = None
+        self._offset = 0
+        self._buffer = bytearray()
+        self._in_flight = collections.deque()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_concurrency)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    @property
+    def download_seconds(self):
+        """Seconds taken to download the object (so far)."""
+        return (self.finished or time.time()) - self.started
+
+    def _get_range(self, start, end):
+        response = self.client.get_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Range='bytes={:d}-{:d}'.format(start, end))
+        return response['Body'].read()
+
+    def _fill(self):
+        while (len(self._in_flight) < self.max_concurrency and
+               self._offset < self.size):
+            end = min(self._offset + self.part_size, self.size) - 1
+            self._in_flight.append(
+                self._executor.submit(self._get_range, self._offset, end))
+            self._offset = end + 1
+
+    def read(self, size=-1):
+        self._fill()
+        while self._in_flight and (size < 0 or len(self._buffer) < size):
+            self._buffer.extend(self._in_flight.popleft().result())
+            self._fill()
+        if not self._in_flight and self.finished is None:
+            self.finished = time.time()
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self.n_bytes += len(data)
+        self.digest.update(data)
+        return data
+
+    def close(self):
+        for future in self._in_flight:
+            future.cancel()
+        self._executor.shutdown()
@@ -1,18 +1,26 @@
 # -*- coding: utf-8 -*-
 import collections
+import concurrent.futures
 import contextlib
 import ftplib
 import functools
+import hashlib
+import importlib
 import itertools
 import logging
+import multiprocessing
 import operator
 import os
-import psutil
+import queue
 import re
 import shelve
+import shutil
+import signal
 import subprocess
 import stat
+import tarfile
 import tempfile
+import threading
 import time
 import urllib.parse
 
@@ -22,6 +30,7 @@ import configobj
 import requests
 
 from . import config
+from . import metrics
 from . import notifications
 
 
@@ -41,8 +50,144 @@ echo_retry = functools.partial(click.secho, fg='cyan')
 pkgpath = functools.partial(resource_filename, __package__)
 
 
+class SyncedShelf:
+    """A shelf which can be shared by the threads running migration steps.
+    """
+
+    def __init__(self, path):
+        self._shelf = shelve.open(path)
+        self._lock = threading.RLock()
+
+    def __getitem__(self, key):
+        with self._lock:
+            return self._shelf[key]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._shelf[key] = value
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._shelf[key]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._shelf
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._shelf))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._shelf)
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._shelf.get(key, default)
+
+    @property
+    def lock(self):
+        """The lock to hold while reading then writing back an item."""
+        return self._lock
+
+    def sync(self):
+        with self._lock:
+            self._shelf.sync()
+
+    def close(self):
+        with self._lock:
+            self._shelf.close()
+
+
 def app_state():
-    return shelve.open(os.path.expanduser('~/.db-migration.db'))
+    return SyncedShelf(os.path.expanduser('~/.db-migration.db'))
+
+
+def history_state():
+    """Opens the store of step profiles for all releases migrated.
+
+    Unlike ``app_state``, this is kept across migrations.
+    """
+    return SyncedShelf(os.path.expanduser('~/.db-migration-history.db'))
+
+
+def path_size(path):
+    """Returns the size in bytes of a file, or all files under a directory.
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(dirpath, filename))
+               for (dirpath, _, filenames) in os.walk(path)
+               for filename in filenames
+               if not os.path.islink(os.path.join(dirpath, filename)))
+
+
+def sha256sum(path, chunk_size=2 ** 20):
+    """Returns the hex SHA-256 digest of the file at `path`."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for chunk in iter(functools.partial(fp.read, chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_stat(path):
+    """Returns the size and modification time of `path` as a dict."""
+    st = os.stat(path)
+    return dict(size=st.st_size, mtime=st.st_mtime_ns)
+
+
+class FileManifest:
+    """Records the files completed by a step in the application state.
+
+    Each entry is keyed by the input path, and holds the size and mtime
+    of the input and output files along with the SHA-256 of the output.
+    A step re-run after a failure can then skip the files completed by the
+    previous run and only redo the incomplete ones.
+    """
+
+    def __init__(self, state, step_name):
+        self.state = state
+        self.prefix = 'manifest:{}:'.format(step_name)
+
+    def _key(self, path):
+        return self.prefix + os.path.abspath(path)
+
+    def is_done(self, path, out_path):
+        """Whether `path` was completed into `out_path` by a previous run.
+
+        For steps that rewrite files in place, `path` and `out_path` are
+        the same file.
+        """
+        entry = self.state.get(self._key(path))
+        if entry is None or not os.path.isfile(out_path):
+            return False
+        if file_stat(out_path) != entry['output']:
+            return False
+        if path != out_path and os.path.isfile(path):
+            return file_stat(path) == entry['input']
+        return True
+
+    def entry(self, path):
+        """Returns what was recorded for `path`, or None."""
+        return self.state.get(self._key(path))
+
+    def record(self, path, out_path, input_stat, out_sha256=None):
+        """Record that `path` (with `input_stat`) was completed as `out_path`.
+        """
+        if out_sha256 is None:
+            out_sha256 = sha256sum(out_path)
+        self.state[self._key(path)] = dict(input=input_stat,
+                                           output=file_stat(out_path),
+                                           output_path=out_path,
+                                           output_sha256=out_sha256)
+        self.state.sync()
+
+    def clear(self):
+        for key in [k for k in self.state if k.startswith(self.prefix)]:
+            del self.state[key]
+        self.state.sync()
 
 
 def echo_warning(message,
@@ -114,44 +259,172 @@ def split_ftp_url(ftp_url):
     return (pr.netloc, pr.path, version)
 
 
+STDERR_TAIL_LINES = 200
+
+
+def _pump(stream, on_line):
+    with stream:
+        for line in iter(stream.readline, b''):
+            on_line(line)
+
+
+def _feed(stream, data):
+    try:
+        with stream:
+            stream.write(data)
+    except BrokenPipeError:
+        pass
+
+
+def _kill_process_group(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    proc.wait()
+
+
+# Processes started in a session of their own, which (unlike the rest of
+# the process group of azanium) are not sent the SIGINT of a Ctrl-C.
+_process_groups = set()
+
+_process_groups_lock = threading.Lock()
+
+
+def register_process_group(proc):
+    """Register `proc` to be killed by ``kill_process_groups``."""
+    with _process_groups_lock:
+        _process_groups.add(proc)
+
+
+def unregister_process_group(proc):
+    with _process_groups_lock:
+        _process_groups.discard(proc)
+
+
+def kill_process_groups():
+    """Kill the process groups of all registered processes.
+
+    Called when interrupted, so that the threads waiting for them finish.
+    """
+    with _process_groups_lock:
+        procs = list(_process_groups)
+    for proc in procs:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
 def local(cmd,
           input=None,
           timeout=None,
           shell=True,
           output_decoding='utf-8',
-          cwd=None):
+          cwd=None,
+          logger=None,
+          stderr_tail_lines=STDERR_TAIL_LINES,
+          label=None,
+          sample_interval=None):
     """Run a command locally.
 
+    The output of `cmd` is read as it is produced.
+    If a `logger` is given, each line of output is logged as it arrives
+    instead of being returned.
+    Only the last `stderr_tail_lines` lines of stderr are kept, to report
+    in the error raised when `cmd` fails.
+    The CPU time, peak memory and disk I/O of `cmd` and its child processes
+    are sampled every `sample_interval` seconds, and recorded with
+    ``metrics.record`` once `cmd` exits.
+
     :param cmd: The command to execute.
     :type cmd: str
     :param input: Optional text to pipe as input to `cmd`.
     :type input: str
     :param timeout: Optional number of seconds to wait for `cmd` to execute.
+                    The command and all of its child processes are killed
+                    when it times out.
     :param timeout: int
     :param shell: Whether or not to execute `cmd` in a shell (Default: True)
     :type shell: boolean
     :param output_decoding: The encoding to decode the binary result of `cmd`.
                             Default: utf-8.
     :type output_decoding: str
-    :returns: The result of the command
+    :param logger: Optional logger to stream the output of `cmd` to.
+    :type logger: logging.LoggerAdapter
+    :param stderr_tail_lines: Number of lines of stderr to keep.
+    :type stderr_tail_lines: int
+    :param label: Name to record resource usage under (Default: `cmd`).
+    :type label: str
+    :param sample_interval: Seconds between resource usage samples.
+                            Default: as configured, 0 disables sampling.
+    :type sample_interval: float
+    :returns: The result of the command (empty when streamed to `logger`).
     :raises: LocalCommandError if result code was non-zero.
+    :raises: subprocess.TimeoutExpired if `timeout` was exceeded.
     """
     if isinstance(cmd, (list, tuple)) and shell:
         cmd = ' '.join(cmd)
-    if input:
-        input_stream = input.encode(output_decoding)
-    else:
-        input_stream = None
+    out_lines = []
+    err_tail = collections.deque(maxlen=stderr_tail_lines)
+
+    def log_line(line):
+        logger.info('{}', line.decode(output_decoding, 'replace').rstrip())
+
+    def on_stdout(line):
+        if logger is None:
+            out_lines.append(line)
+        else:
+            log_line(line)
+
+    def on_stderr(line):
+        err_tail.append(line)
+        if logger is not None:
+            log_line(line)
+
     proc = subprocess.Popen(cmd,
                             stdin=subprocess.PIPE,
                             stdout=subprocess.PIPE,
                             stderr=subprocess.PIPE,
                             cwd=cwd,
-                            shell=shell)
-    (out, err) = proc.communicate(input=input_stream, timeout=timeout)
+                            shell=shell,
+                            start_new_session=True)
+    register_process_group(proc)
+    if sample_interval is None:
+        sample_interval = metrics.sample_interval()
+    sampler = None
+    if sample_interval > 0:
+        if label is None:
+            label = cmd if isinstance(cmd, str) else ' '.join(cmd)
+        sampler = metrics.ProcessTreeSampler(proc.pid,
+                                             label,
+                                             interval=sample_interval)
+        sampler.start()
+    threads = [threading.Thread(target=_pump, args=(proc.stdout, on_stdout)),
+               threading.Thread(target=_pump, args=(proc.stderr, on_stderr))]
+    if input:
+        input_stream = input.encode(output_decoding)
+        threads.append(threading.Thread(target=_feed,
+                                        args=(proc.stdin, input_stream)))
+    else:
+        proc.stdin.close()
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        proc.wait(timeout=timeout)
+    except BaseException:
+        _kill_process_group(proc)
+        raise
+    finally:
+        unregister_process_group(proc)
+        for thread in threads:
+            thread.join()
+        if sampler is not None:
+            metrics.record(sampler.stop())
     if proc.returncode != 0:
-        raise LocalCommandError(err)
-    return out.decode(output_decoding)
+        raise LocalCommandError(b''.join(err_tail))
+    return b''.join(out_lines).decode(output_decoding)
 
 
 def setup_py(rest_of_args):
@@ -209,36 +482,404 @@ def download(url, local_filename, chunk_size=1024 * 10):
     return fp.name
 
 
-@contextlib.contextmanager
-def ftp_connection(host, logger):
+FTP_MAX_CONNECTIONS = 4
+
+FTP_RETRY_ATTEMPTS = 5
+
+FtpFile = collections.namedtuple('FtpFile', ('name', 'size'))
+
+
+class FtpTransferError(ftplib.Error):
+    """Raised when a transferred file does not match its size on the server."""
+
+
+def backoff_delays(attempts, initial_delay=1.0, factor=2.0, max_delay=60.0):
+    """Generate `attempts` exponentially increasing delays (in seconds).
+
+    :param attempts: The number of delays to generate.
+    :type attempts: int
+    :param initial_delay: The first delay.
+    :type initial_delay: float
+    :param factor: The multiplier applied to each successive delay.
+    :type factor: float
+    :param max_delay: The upper bound for any single delay.
+    :type max_delay: float
+    """
+    delay = initial_delay
+    for _ in range(attempts):
+        yield min(delay, max_delay)
+        delay *= factor
+
+
+def _ftp_open(host, logger, initial_cwd=None):
     logger.info('Connecting to {}', host)
     ftp = ftplib.FTP(host=host, user='anonymous')
     ftp.set_pasv(True)
-    yield ftp
+    if initial_cwd is not None:
+        ftp.cwd(initial_cwd)
+    return ftp
+
+
+def _ftp_close(ftp, host, logger):
     logger.info('Disconnecting from {}', host)
-    ftp.quit()
+    try:
+        ftp.quit()
+    except ftplib.all_errors:
+        ftp.close()
+
+
+@contextlib.contextmanager
+def ftp_connection(host, logger):
+    ftp = _ftp_open(host, logger)
+    try:
+        yield ftp
+    finally:
+        _ftp_close(ftp, host, logger)
+
+
+def ftp_list(ftp, file_selector):
+    """List the files selected by `file_selector` in the current directory.
+
+    File sizes are taken from a ``MLSD`` listing where the server supports
+    it, falling back to one ``SIZE`` command per file otherwise.
+
+    :param ftp: An open FTP connection.
+    :type ftp: ftplib.FTP
+    :param file_selector: Predicate called with each filename.
+    :type file_selector: callable
+    :returns: A list of ``FtpFile`` in the order listed by the server.
+    """
+    try:
+        sizes = collections.OrderedDict(
+            (name, int(facts['size']))
+            for (name, facts) in ftp.mlsd(facts=['type', 'size'])
+            if facts.get('type') == 'file' and 'size' in facts)
+        filenames = list(filter(file_selector, sizes))
+    except ftplib.error_perm:
+        filenames = list(filter(file_selector, ftp.nlst('.')))
+        ftp.voidcmd('TYPE I')
+        sizes = {name: ftp.size(name) or 0 for name in filenames}
+    return [FtpFile(name=name, size=sizes[name]) for name in filenames]
+
+
+def ftp_pool(host,
+             ftp_files,
+             handler,
+             logger,
+             initial_cwd=None,
+             max_connections=FTP_MAX_CONNECTIONS,
+             retry_attempts=FTP_RETRY_ATTEMPTS):
+    """Process `ftp_files` concurrently over a pool of FTP connections.
+
+    Each connection is owned by one worker thread, which calls
+    ``handler(ftp, ftp_file)`` for one file at a time.
+    The largest files are scheduled first.
+
+    When `handler` fails with an FTP or socket error, the worker
+    reconnects and calls `handler` again for the same file after an
+    exponentially increasing delay, up to `retry_attempts` times.
+
+    :param host: The FTP host name.
+    :type host: str
+    :param ftp_files: The files to process.
+    :type ftp_files: sequence of ``FtpFile``
+    :param handler: Callable invoked for each file with an open connection.
+    :type handler: callable
+    :param max_connections: Maximum number of concurrent FTP connections.
+    :type max_connections: int
+    :param retry_attempts: Number of retries per file.
+    :type retry_attempts: int
+    :returns: A mapping of filename to the result of `handler`.
+    :rtype: dict
+    """
+    if not ftp_files:
+        return {}
+    pending = queue.Queue()
+    for ftp_file in sorted(ftp_files, key=operator.attrgetter('size'),
+                           reverse=True):
+        pending.put(ftp_file)
+    failed = threading.Event()
+    results = {}
+
+    def process(ftp, ftp_file):
+        delays = backoff_delays(retry_attempts)
+        while True:
+            try:
+                if ftp is None:
+                    ftp = _ftp_open(host, logger, initial_cwd=initial_cwd)
+                results[ftp_file.name] = handler(ftp, ftp_file)
+                return ftp
+            except ftplib.all_errors as err:
+                if ftp is not None:
+                    ftp.close()
+                    ftp = None
+                delay = next(delays, None)
+                if delay is None:
+                    raise
+                logger.warning('Transfer of {} failed ({}), '
+                               'retrying in {:.0f}s',
+                               ftp_file.name,
+                               err,
+                               delay)
+                time.sleep(delay)
+
+    def worker():
+        ftp = None
+        try:
+            while not failed.is_set():
+                try:
+                    ftp_file = pending.get_nowait()
+                except queue.Empty:
+                    return
+                ftp = process(ftp, ftp_file)
+        except Exception:
+            failed.set()
+            raise
+        finally:
+            if ftp is not None:
+                _ftp_close(ftp, host, logger)
+
+    n_workers = min(max_connections, len(ftp_files))
+    total_bytes = sum(f.size for f in ftp_files)
+    started = time.time()
+    with concurrent.futures.ThreadPoolExecutor(n_workers) as executor:
+        futures = [executor.submit(worker) for _ in range(n_workers)]
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+    elapsed = max(time.time() - started, 1e-6)
+    logger.info('Transferred {:d} files ({:.1f} MB) from {} '
+                'in {:.1f}s using {:d} connections ({:.2f} MB/s)',
+                len(ftp_files),
+                total_bytes / 2 ** 20,
+                host,
+                elapsed,
+                n_workers,
+                total_bytes / 2 ** 20 / elapsed)
+    return results
+
+
+def ftp_retrieve(ftp, ftp_file, out_path, logger):
+    """Retrieve `ftp_file` into `out_path`, resuming any partial download.
+
+    An existing `out_path` smaller than the file on the server is
+    continued from its current size using a ``REST`` offset;
+    one that already matches the server size is left untouched.
+    Any other file at `out_path` is replaced, not written to, since it
+    may be hard-linked to a blob of the artefact cache.
+
+    :raises: FtpTransferError if the local size differs from the server
+             size once the transfer completes.
+    :returns: `out_path`
+    """
+    offset = os.path.getsize(out_path) if os.path.isfile(out_path) else 0
+    if offset > ftp_file.size:
+        offset = 0
+    if offset and offset == ftp_file.size:
+        logger.info('Already downloaded {} to {}', ftp_file.name, out_path)
+        return out_path
+    if offset and os.stat(out_path).st_nlink > 1:
+        # Linked to a blob of the artefact cache, which is never appended to.
+        offset = 0
+    if not offset and os.path.lexists(out_path):
+        # Replaced rather than truncated, for the same reason.
+        os.remove(out_path)
+    mode = 'ab' if offset else 'wb'
+    if offset:
+        logger.info('Resuming {} at byte {:d} of {:d}',
+                    ftp_file.name,
+                    offset,
+                    ftp_file.size)
+    else:
+        logger.info('Saving {} to {}', ftp_file.name, out_path)
+    with open(out_path, mode) as fp:
+        ftp.retrbinary('RETR ' + ftp_file.name, fp.write, rest=offset or None)
+    local_size = os.path.getsize(out_path)
+    if local_size != ftp_file.size:
+        msg = 'Downloaded {} is {:d} bytes, expected {:d}'
+        raise FtpTransferError(msg.format(out_path,
+                                          local_size,
+                                          ftp_file.size))
+    return out_path
+
+
+def ftp_file_url(host, cwd, filename):
+    return 'ftp://{}/{}'.format(host,
+                                os.path.join(cwd or '', filename).lstrip('/'))
 
 
 def ftp_download(host,
                  file_selector_regexp,
                  download_dir,
                  logger=None,
-                 initial_cwd=None):
+                 initial_cwd=None,
+                 max_connections=FTP_MAX_CONNECTIONS,
+                 cache=None,
+                 cache_version=''):
+    """Download the files matching `file_selector_regexp` into `download_dir`.
+
+    Files already (partially) present in `download_dir` are resumed
+    rather than downloaded again.
+
+    :param max_connections: Maximum number of concurrent FTP connections.
+    :type max_connections: int
+    :param cache: Optional artefact cache to read from and store into.
+    :type cache: azanium.artefact.Cache
+    :param cache_version: The version each file is cached under.
+    :type cache_version: str
+    :returns: The paths of the downloaded files, in server listing order.
+    :rtype: list
+    """
+    if logger is None:
+        logger = logging.getLogger(__package__)
+    file_selector = functools.partial(re.match, file_selector_regexp)
+    with ftp_connection(host, logger) as ftp:
+        if initial_cwd is not None:
+            ftp.cwd(initial_cwd)
+        ftp_files = ftp_list(ftp, file_selector)
+
+    def retrieve(ftp, ftp_file):
+        out_path = os.path.join(download_dir, ftp_file.name)
+        if cache is None:
+            return ftp_retrieve(ftp, ftp_file, out_path, logger)
+        url = ftp_file_url(host, initial_cwd, ftp_file.name)
+        return cache.fetch(url,
+                           cache_version,
+                           out_path,
+                           lambda path: ftp_retrieve(ftp,
+                                                     ftp_file,
+                                                     path,
+                                                     logger))
+
+    downloaded = ftp_pool(host,
+                          ftp_files,
+                          retrieve,
+                          logger,
+                          initial_cwd=initial_cwd,
+                          max_connections=max_connections)
+    return [downloaded[ftp_file.name] for ftp_file in ftp_files]
+
+
+class TeeReader:
+    """File-like reader that copies everything read from `fileobj` to `sink`.
+    """
+
+    def __init__(self, fileobj, sink):
+        self.fileobj = fileobj
+        self.sink = sink
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.sink.write(data)
+        return data
+
+
+@contextlib.contextmanager
+def ftp_stream(ftp, filename):
+    """Open a binary read stream for `filename` over an open FTP connection.
+    """
+    ftp.voidcmd('TYPE I')
+    conn = ftp.transfercmd('RETR ' + filename)
+    try:
+        with conn.makefile('rb') as stream:
+            yield stream
+    finally:
+        conn.close()
+    ftp.voidresp()
+
+
+def extract_tar_stream(fileobj, path, mode='r|gz'):
+    """Extract a tar archive from the non-seekable `fileobj` into `path`.
+
+    Several archives may be extracted into the same `path` concurrently.
+    """
+    with tarfile.open(fileobj=fileobj, mode=mode) as tf:
+        for member in tf:
+            try:
+                tf.extract(member, path=path)
+            except FileExistsError:
+                # Another archive created a shared parent directory
+                # between the existence check and makedirs.
+                tf.extract(member, path=path)
+
+
+def ftp_extract(host,
+                file_selector_regexp,
+                extract_dir,
+                logger=None,
+                initial_cwd=None,
+                max_connections=FTP_MAX_CONNECTIONS,
+                archive_dir=None,
+                cache=None,
+                cache_version=''):
+    """Stream the ``.tar.gz`` files matching `file_selector_regexp` straight
+    into `extract_dir`, without storing the archives on disk.
+
+    Each archive is decompressed and extracted as it arrives, with up to
+    `max_connections` archives in flight at once.
+
+    :param archive_dir: When given, a copy of each archive is kept in this
+                        directory, and archives already there are extracted
+                        from disk instead of being downloaded again.
+    :type archive_dir: str
+    :param cache: Optional artefact cache; archives kept in `archive_dir`
+                  are added to it, and cached archives are extracted
+                  without downloading.
+    :type cache: azanium.artefact.Cache
+    :param cache_version: The version each archive is cached under.
+    :type cache_version: str
+    :returns: The names of the extracted archives, in server listing order.
+    :rtype: list
+    """
     if logger is None:
         logger = logging.getLogger(__package__)
-    downloaded = []
     file_selector = functools.partial(re.match, file_selector_regexp)
     with ftp_connection(host, logger) as ftp:
         if initial_cwd is not None:
             ftp.cwd(initial_cwd)
-        filenames = filter(file_selector, ftp.nlst('.'))
-        for filename in filenames:
-            out_path = os.path.join(download_dir, filename)
-            logger.info('Saving {} to {}', filename, out_path)
-            with open(out_path, 'wb') as fp:
-                ftp.retrbinary('RETR ' + filename, fp.write)
-            downloaded.append(fp.name)
-    return downloaded
+        ftp_files = ftp_list(ftp, file_selector)
+
+    def extract(ftp, ftp_file):
+        url = ftp_file_url(host, initial_cwd, ftp_file.name)
+        cached_path = cache.lookup(url, cache_version) if cache else None
+        if cached_path is not None:
+            logger.info('Extracting cached {} to {}', url, extract_dir)
+            with open(cached_path, 'rb') as fp:
+                extract_tar_stream(fp, extract_dir)
+            return ftp_file.name
+        if archive_dir is None:
+            logger.info('Streaming {} into {}', ftp_file.name, extract_dir)
+            with ftp_stream(ftp, ftp_file.name) as stream:
+                extract_tar_stream(stream, extract_dir)
+            return ftp_file.name
+        archive_path = os.path.join(archive_dir, ftp_file.name)
+        if not (os.path.isfile(archive_path) and
+                os.path.getsize(archive_path) == ftp_file.size):
+            logger.info('Streaming {} into {}, keeping a copy in {}',
+                        ftp_file.name,
+                        extract_dir,
+                        archive_path)
+            partial_path = archive_path + '.part'
+            with ftp_stream(ftp, ftp_file.name) as stream:
+                with open(partial_path, 'wb') as fp:
+                    extract_tar_stream(TeeReader(stream, fp), extract_dir)
+                    # drain any trailing padding not read by tarfile
+                    shutil.copyfileobj(stream, fp)
+            os.rename(partial_path, archive_path)
+        else:
+            logger.info('Extracting {} to {}', archive_path, extract_dir)
+            with open(archive_path, 'rb') as fp:
+                extract_tar_stream(fp, extract_dir)
+        if cache is not None:
+            cache.store(url, cache_version, archive_path)
+        return ftp_file.name
+
+    ftp_pool(host,
+             ftp_files,
+             extract,
+             logger,
+             initial_cwd=initial_cwd,
+             max_connections=max_connections)
+    return [ftp_file.name for ftp_file in ftp_files]
 
 
 def get_ftp_url():
@@ -276,14 +917,39 @@ def get_deploy_versions(purpose='default'):
     return dv
 
 
-def jvm_mem_opts(pct_of_free_mem):
-    bytes_free = psutil.virtual_memory().free
-    gb_free = bytes_free // (2 ** 30)
-    max_heap_size = round(gb_free * pct_of_free_mem)
-    init_heap_size = max_heap_size
-    format_Gb = '{:d}G'.format
-    return ' '.join(['-Xmx' + format_Gb(max_heap_size),
-                     '-Xms' + format_Gb(init_heap_size)])
+def process_pool(max_workers=None):
+    """Returns a ``ProcessPoolExecutor`` whose processes are started by a
+    fork server rather than forked from the calling process.
+
+    Migration steps run in threads, and a process forked from a
+    multi-threaded process can inherit locks held by the other threads.
+    Functions run in the pool must be importable.
+    """
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers,
+        mp_context=multiprocessing.get_context('forkserver'))
+
+
+def partition_by_size(items, n_parts, size):
+    """Partition `items` into at most `n_parts` lists of similar total size.
+
+    Items are assigned largest first, each to the currently smallest part.
+
+    :param items: The items to partition.
+    :type items: iterable
+    :param n_parts: The number of partitions.
+    :type n_parts: int
+    :param size: Callable returning the size of an item.
+    :type size: callable
+    :returns: The non-empty partitions, largest total size first.
+    :rtype: list of lists
+    """
+    parts = [(0, n, []) for n in range(max(1, n_parts))]
+    for item in sorted(items, key=size, reverse=True):
+        (total, n, part) = min(parts)
+        part.append(item)
+        parts[n] = (total + size(item), n, part)
+    return [part for (_, _, part) in sorted(parts, reverse=True) if part]
 
 
 def make_executable(path, logger, mode=0o775, symlink_dir='~/.local/bin'):
@@ -301,15 +967,26 @@ def make_executable(path, logger, mode=0o775, symlink_dir='~/.local/bin'):
         logger.debug('Created symlink from {} to {}', path, bin_path)
 
 
+_context_lock = threading.Lock()
+
+
 class CommandContext:
 
+    java_cmd = 'java -server'
+
     def __init__(self, base_path):
         self.base_path = base_path
         self.logfile_path = ''
 
     @property
-    def java_cmd(self):
-        return 'java -server ' + jvm_mem_opts(0.75)
+    def jvm_planner(self):
+        # avoid circular import
+        jvm = importlib.import_module(__package__ + '.jvm')
+        with _context_lock:
+            planner = getattr(self, '_jvm_planner', None)
+            if planner is None:
+                planner = self._jvm_planner = jvm.Planner()
+        return planner
 
     @property
     def pseudoace_jar_path(self):
@@ -323,9 +1000,18 @@ class CommandContext:
 
     @property
     def app_state(self):
-        state = getattr(self, '_app_state', None)
-        if state is None:
-            state = self._app_state = app_state()
+        with _context_lock:
+            state = getattr(self, '_app_state', None)
+            if state is None:
+                state = self._app_state = app_state()
+        return state
+
+    @property
+    def history_state(self):
+        with _context_lock:
+            state = getattr(self, '_history_state', None)
+            if state is None:
+                state = self._history_state = history_state()
         return state
 
     @property
@@ -366,14 +1052,3 @@ def touch_dir(path):
     with tempfile.NamedTemporaryFile(dir=path, suffix='azanium', mode='wb'):
         pass
 
-
-def retries(attempts, callback):
-    while attempts > 0:
-        try:
-            callback()
-        except LocalCommandError:
-            attempts -= 1
-            click.echo("Retrying %d more times..." % attempts)
-        time.sleep(0.5)
-    return attempts > 0
-
@@ -0,0 +1,172 @@
+import gzip
+import os
+import shlex
+
+import pytest
+
+from azanium import acedb
+from azanium import util
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+MODELS = """// Models of a test database
+?Analysis Title UNIQUE Text
+?Gene Evidence #Evidence
+?Gene_regulation Summary UNIQUE ?LongText
+?Person Standard_name UNIQUE Text
+?Protein Peptide UNIQUE ?Peptide UNIQUE Int
+?Sequence DNA UNIQUE ?DNA UNIQUE Int
+?Paper Title UNIQUE ?LongText
+#Evidence Paper_evidence ?Paper
+"""
+
+
+def _classes_output():
+    with open(os.path.join(DATA_DIR, 'tace-classes.txt')) as fp:
+        return fp.read()
+
+
+def test_parse_classes():
+    counts = acedb.parse_classes(_classes_output())
+    assert counts['Session'] == 31
+    assert counts['Gene'] == 203452
+    assert counts['Gene_regulation'] == 2211
+    assert counts['Sequence'] == 3021
+    assert counts['Paper'] == 0
+    assert len(counts) == 17
+
+
+def test_list_classes_excludes_system_classes(tmpdir, monkeypatch):
+    tmpdir.mkdir('wspec').join('models.wrm').write(MODELS)
+    monkeypatch.setattr(acedb, 'tace', lambda db_dir, cmds: _classes_output())
+    classes = acedb.list_classes(str(tmpdir))
+    assert [c.name for c in classes] == ['Protein',
+                                         'Gene',
+                                         'Peptide',
+                                         'Person',
+                                         'LongText',
+                                         'Sequence',
+                                         'Gene_regulation',
+                                         'Analysis',
+                                         'DNA']
+    assert classes[0] == acedb.AceClass(name='Protein', count=481122)
+
+
+def test_dump_and_compress_leaves_partial_files(tmpdir):
+    dump_dir = tmpdir.mkdir('acedb-dump')
+    # A "tace" dumping one class, then failing while writing the next.
+    script = ('printf "Gene : a\\n" > Gene.ace; '
+              'exec 3> Paper.ace; printf "Paper : " >&3; '
+              'sleep 1; exit 1')
+
+    def dump():
+        util.local(['sh', '-c', shlex.quote(script)], cwd=str(dump_dir))
+
+    with pytest.raises(util.LocalCommandError):
+        acedb.dump_and_compress(dump, str(dump_dir), n_procs=1,
+                                poll_interval=0.05)
+    assert dump_dir.join('Paper.ace').read() == 'Paper : '
+    assert not dump_dir.join('Paper.ace.gz').exists()
+    with gzip.open(str(dump_dir.join('Gene.ace.gz'))) as fp:
+        assert fp.read() == b'Gene : a\n'
+
+
+class _Tace:
+    """Answers the tace commands of a dump from an in-memory database.
+
+    `database` maps each class name to the names of its objects.
+    Objects listed in `unshown` are left out by ``Show``.
+    """
+
+    def __init__(self, database, unshown=()):
+        self.database = database
+        self.unshown = set(unshown)
+        self.sessions = []
+
+    def _objects(self, class_name, exclude=()):
+        fmt = '{0} : "{1}"\nTitle "{1} of {0}"\n\n'.format
+        return ''.join(fmt(class_name, name)
+                       for name in self.database[class_name]
+                       if name not in exclude)
+
+    def __call__(self, db_directory, commands):
+        self.sessions.append(list(commands))
+        output = []
+        found = None
+        for command in commands:
+            (verb, _, args) = command.partition(' ')
+            if verb == 'Classes':
+                output.append(' '.join('{} {:d}'.format(name, len(objs))
+                                       for (name, objs)
+                                       in self.database.items()))
+            elif verb == 'Find':
+                found = args
+            elif verb == 'Show':
+                out_path = args.split('-f ', 1)[1]
+                with open(out_path, 'w') as fp:
+                    fp.write(self._objects(found, exclude=self.unshown))
+            else:
+                raise AssertionError(command)
+        return '\n'.join(output)
+
+    def dump(self, dump_dir):
+        """Writes the files of ``Dump -s``: a file per class, other than
+        the system classes.
+        """
+        for (class_name, names) in self.database.items():
+            if names and class_name not in SYSTEM_CLASSES:
+                path = os.path.join(dump_dir, class_name + '.ace')
+                with open(path, 'w') as fp:
+                    fp.write(self._objects(class_name))
+
+
+SYSTEM_CLASSES = ('Session', 'Model')
+
+DATABASE = {'Session': ['1', '2'],
+            'Model': ['?Gene'],
+            'Gene': ['WBGene{:08d}'.format(n) for n in range(20)],
+            'Person': ['WBPerson1', 'WBPerson2', 'WBPerson3'],
+            'Analysis': ['a', 'b'],
+            'LongText': ['text'],
+            'Paper': []}
+
+
+def _dumped_objects(dump_dir):
+    """Returns the objects of all .ace files in `dump_dir`."""
+    objects = []
+    for path in sorted(os.listdir(dump_dir)):
+        with open(os.path.join(dump_dir, path)) as fp:
+            objects.extend(obj for obj in fp.read().split('\n\n') if obj)
+    return sorted(objects)
+
+
+def test_sharded_dump_matches_dump(tmpdir, monkeypatch):
+    db_dir = tmpdir.mkdir('acedb')
+    db_dir.mkdir('wspec').join('models.wrm').write(MODELS)
+    fake_tace = _Tace(DATABASE)
+    monkeypatch.setattr(acedb, 'tace', fake_tace)
+    sharded_dir = tmpdir.mkdir('sharded')
+    classes = acedb.sharded_dump(str(db_dir), str(sharded_dir), 2)
+    assert sorted(c.name for c in classes) == ['Analysis',
+                                               'Gene',
+                                               'LongText',
+                                               'Person']
+    # Classes listed once, then dumped by two tace processes.
+    assert fake_tace.sessions[0] == ['Classes']
+    assert len(fake_tace.sessions) == 3
+    dump_dir = tmpdir.mkdir('dump')
+    fake_tace.dump(str(dump_dir))
+    assert sorted(sharded_dir.listdir()) == sorted(
+        sharded_dir.join(p.basename) for p in dump_dir.listdir())
+    assert (_dumped_objects(str(sharded_dir)) ==
+            _dumped_objects(str(dump_dir)))
+
+
+def test_sharded_dump_missing_objects(tmpdir, monkeypatch):
+    db_dir = tmpdir.mkdir('acedb')
+    db_dir.mkdir('wspec').join('models.wrm').write(MODELS)
+    monkeypatch.setattr(acedb, 'tace', _Tace(DATABASE, unshown=['WBPerson2']))
+    with pytest.raises(acedb.AceDumpError) as exc_info:
+        acedb.sharded_dump(str(db_dir), str(tmpdir.mkdir('dump')), 2)
+    assert 'Person (expected 3, dumped 2)' in str(exc_info.value)
@@ -0,0 +1,120 @@
+import io
+import lzma
+import os
+import shutil
+import tarfile
+import threading
+
+import pytest
+
+from azanium import archive
+
+
+def _engine(engine):
+    command = {'xz-cli': 'xz', 'zstd': 'zstd'}.get(engine)
+    if command is not None and shutil.which(command) is None:
+        pytest.skip('{} not installed'.format(command))
+    return engine
+
+
+@pytest.fixture(params=list(archive.ENGINES))
+def engine(request):
+    return _engine(request.param)
+
+
+def _src_dir(tmpdir, n_bytes=1000):
+    src = tmpdir.mkdir('backup')
+    src.mkdir('values').join('segment').write_binary(os.urandom(n_bytes))
+    src.join('roots').write_binary(b'root' * 100)
+    return src
+
+
+def _finished(target, *args):
+    """Runs `target` in a thread, returning its error unless it hangs."""
+    errors = []
+
+    def run():
+        try:
+            target(*args)
+        except Exception as err:
+            errors.append(err)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout=30)
+    assert not thread.is_alive(), 'hung'
+    return errors[0] if errors else None
+
+
+def test_archive_round_trip(engine, tmpdir):
+    src = _src_dir(tmpdir)
+    out_path = str(tmpdir.join(archive.archive_filename('backup', engine)))
+    result = archive.create_archive(str(src), 'backup', out_path,
+                                    engine=engine, level=1, threads=2)
+    assert result.out_bytes == os.path.getsize(out_path)
+    # .tar.xz archives of either xz engine are read in-process
+    assert (archive.ENGINES[archive.engine_for(out_path)] ==
+            archive.ENGINES[engine])
+    dest = tmpdir.mkdir('dest')
+    with open(out_path, 'rb') as fp:
+        archive.extract_archive(fp, str(dest), engine=engine, threads=2)
+    extracted = dest.join('backup')
+    assert (extracted.join('values', 'segment').read_binary() ==
+            src.join('values', 'segment').read_binary())
+    assert extracted.join('roots').read_binary() == b'root' * 100
+
+
+def test_xz_archive_is_read_by_tarfile(tmpdir):
+    src = _src_dir(tmpdir)
+    out = io.BytesIO()
+    archive.write_archive(str(src), 'backup', out,
+                          engine='xz', level=1, threads=2, chunk_size=256)
+    with tarfile.open(fileobj=io.BytesIO(out.getvalue()), mode='r:xz') as tf:
+        assert 'backup/values/segment' in tf.getnames()
+
+
+class _FailingWriter:
+
+    def write(self, data):
+        raise OSError('upload failed')
+
+
+@pytest.mark.parametrize('engine', ['xz-cli', 'zstd'])
+def test_cli_write_error_does_not_hang(engine, tmpdir):
+    src = _src_dir(tmpdir, n_bytes=8 * 2 ** 20)
+    err = _finished(archive.write_archive,
+                    str(src), 'backup', _FailingWriter(),
+                    _engine(engine), 1, 1)
+    assert isinstance(err, OSError)
+
+
+def test_cli_extract_error_does_not_hang(tmpdir):
+    _engine('xz-cli')
+    not_a_tar = io.BytesIO(lzma.compress(os.urandom(8 * 2 ** 20),
+                                         preset=0))
+    err = _finished(archive.extract_archive,
+                    not_a_tar, str(tmpdir), 'xz-cli', 1)
+    assert isinstance(err, tarfile.ReadError)
+
+
+def test_failed_archive_is_removed(engine, tmpdir):
+    out_path = str(tmpdir.join(archive.archive_filename('backup', engine)))
+    err = _finished(archive.create_archive,
+                    str(tmpdir.join('missing')), 'backup', out_path,
+                    engine, 1, 1)
+    assert isinstance(err, OSError)
+    assert tmpdir.listdir() == []
+
+
+def test_benchmark_removes_archives(tmpdir):
+    src = _src_dir(tmpdir)
+    out_dir = tmpdir.mkdir('benchmark')
+    results = archive.benchmark(str(src), str(out_dir), [('xz', 1, 1),
+                                                         ('xz', 1, 2)])
+    assert [r.out_bytes > 0 for r in results] == [True, True]
+    assert out_dir.listdir() == []
+    with pytest.raises(OSError):
+        archive.benchmark(str(tmpdir.join('missing')),
+                          str(out_dir),
+                          [('xz', 1, 1)])
+    assert out_dir.listdir() == []
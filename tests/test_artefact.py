@@ -0,0 +1,110 @@
+import os
+
+from azanium import artefact
+from azanium import log
+from azanium import util
+
+
+logger = log.get_logger(namespace=__name__)
+
+URL = 'ftp://ftp.example.org/acedb/database.tar.gz'
+
+
+class _Ftp:
+    """Serves `data` for any file retrieved."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def retrbinary(self, cmd, callback, rest=None):
+        callback(self.data[rest or 0:])
+
+
+def _cache(tmpdir):
+    return artefact.Cache(path=str(tmpdir.join('cache')), logger=logger)
+
+
+def test_fetch_links_cached_blob(tmpdir):
+    cache = _cache(tmpdir)
+    first = str(tmpdir.join('first'))
+    second = str(tmpdir.join('second'))
+    cache.fetch(URL, '1', first, lambda path: open(path, 'wb').write(b'abc'))
+    cache.fetch(URL, '1', second, lambda path: 1 / 0)
+    with open(second, 'rb') as fp:
+        assert fp.read() == b'abc'
+
+
+def test_retrieve_does_not_write_to_cached_blob(tmpdir):
+    cache = _cache(tmpdir)
+    out_path = str(tmpdir.join('database.tar.gz'))
+    data = b'version 1'
+    cache.fetch(URL, '1', out_path, lambda path: open(path, 'wb').write(data))
+    blob_path = cache.lookup(URL, '1')
+    assert os.stat(out_path).st_nlink > 1
+    # e.g a --no-cache run after the file changed on the server,
+    # both larger (resumed) and smaller (restarted) than the local file.
+    for new_data in (b'version 1 and more', b'v2'):
+        ftp_file = util.FtpFile(name='database.tar.gz', size=len(new_data))
+        util.ftp_retrieve(_Ftp(new_data), ftp_file, out_path, logger)
+        with open(out_path, 'rb') as fp:
+            assert fp.read() == new_data
+        with open(blob_path, 'rb') as fp:
+            assert fp.read() == data
+    assert cache.lookup(URL, '1') == blob_path
+
+
+def test_fetch_on_miss_does_not_write_to_cached_blob(tmpdir):
+    cache = _cache(tmpdir)
+    out_path = str(tmpdir.join('database.tar.gz'))
+    cache.fetch(URL, '1', out_path, lambda path: open(path, 'wb').write(b'1'))
+    cache.fetch(URL, '2', out_path, lambda path: open(path, 'wb').write(b'2'))
+    with open(cache.lookup(URL, '1'), 'rb') as fp:
+        assert fp.read() == b'1'
+    with open(cache.lookup(URL, '2'), 'rb') as fp:
+        assert fp.read() == b'2'
+
+
+def test_lookup_removes_corrupt_blob(tmpdir):
+    cache = _cache(tmpdir)
+    path = str(tmpdir.join('file'))
+    with open(path, 'wb') as fp:
+        fp.write(b'abc')
+    blob_path = cache.store(URL, '1', path)
+    mtime_ns = os.stat(blob_path).st_mtime_ns
+    with open(blob_path, 'wb') as fp:
+        fp.write(b'xyz')
+    # Within the file system's timestamp granularity of the store.
+    os.utime(blob_path, ns=(mtime_ns, mtime_ns + 10 ** 9))
+    assert cache.lookup(URL, '1') is None
+    assert not os.path.exists(blob_path)
+
+
+def test_lookup_only_hashes_modified_blob(tmpdir, monkeypatch):
+    cache = _cache(tmpdir)
+    path = str(tmpdir.join('file'))
+    with open(path, 'wb') as fp:
+        fp.write(b'abc')
+    blob_path = cache.store(URL, '1', path)
+    hashed = []
+    sha256sum = util.sha256sum
+
+    def counting_sha256sum(path):
+        hashed.append(path)
+        return sha256sum(path)
+
+    monkeypatch.setattr(util, 'sha256sum', counting_sha256sum)
+    assert cache.lookup(URL, '1') == blob_path
+    assert cache.lookup(URL, '1') == blob_path
+    assert hashed == []
+    # Same size and content, but touched: hashed once, then trusted again.
+    stat = os.stat(blob_path)
+    os.utime(blob_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert cache.lookup(URL, '1') == blob_path
+    assert cache.lookup(URL, '1') == blob_path
+    assert hashed == [blob_path]
+    # Same size, different content.
+    with open(blob_path, 'wb') as fp:
+        fp.write(b'xyz')
+    os.utime(blob_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10 ** 9))
+    assert cache.lookup(URL, '1') is None
+    assert not os.path.exists(blob_path)
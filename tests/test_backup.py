@@ -0,0 +1,185 @@
+import datetime
+import hashlib
+import io
+import os
+import tarfile
+
+import boto3
+import pytest
+from click.testing import CliRunner
+from moto import mock_aws
+
+from azanium import datomic
+from azanium import runcommand
+from azanium import s3
+from azanium import util
+
+
+RELEASE = 'WS900'
+
+ARCHIVE_KEY = s3.release_key(RELEASE, RELEASE + '.tar.xz')
+
+
+@pytest.fixture
+def base_path(tmpdir, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmpdir))
+    monkeypatch.setattr(util, 'app_state',
+                        lambda: util.SyncedShelf(str(tmpdir.join('state'))))
+    monkeypatch.setattr(util, 'get_data_release_version', lambda: RELEASE)
+    return tmpdir.mkdir('base')
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+        monkeypatch.setenv(name, 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with mock_aws():
+        client = boto3.client('s3')
+        client.create_bucket(Bucket=s3.BUCKET)
+        yield client
+
+
+@pytest.fixture
+def backups(monkeypatch):
+    """Backs up a database of random segments instead of running Datomic.
+
+    Yields the number of segments each backup writes.
+    """
+    written = [1]
+
+    def backup(context, local_backup_path, db_name):
+        segments_dir = os.path.join(local_backup_path,
+                                    datomic.BACKUP_SEGMENTS_DIR)
+        os.makedirs(segments_dir, exist_ok=True)
+        for n in range(written[0]):
+            path = os.path.join(segments_dir, os.urandom(4).hex())
+            with open(path, 'wb') as fp:
+                fp.write(os.urandom(6 * 2 ** 20))
+
+    def incremental_backup(context, local_backup_path, db_name):
+        backup(context, local_backup_path, db_name)
+        return datomic.BackupReport(path=local_backup_path,
+                                    seed=None,
+                                    reused=0,
+                                    written=written[0],
+                                    seconds=0.0)
+
+    monkeypatch.setattr(datomic, 'backup_db', backup)
+    monkeypatch.setattr(datomic, 'incremental_backup_db', incremental_backup)
+    monkeypatch.setattr(s3, 'PART_SIZE', s3.MIN_PART_SIZE)
+    return written
+
+
+def _backup_db(base_path, *args):
+    result = CliRunner().invoke(runcommand.root_command,
+                                ['-b', str(base_path), 'run', 'backup-db',
+                                 '--archive-threads', '2'] + list(args))
+    assert result.exception is None, result.output
+    return result.output
+
+
+def _archive_path(base_path):
+    return base_path.join('datomic-db-backup',
+                          datetime.date.today().isoformat(),
+                          RELEASE + '.tar.xz')
+
+
+def _uploaded(client):
+    body = client.get_object(Bucket=s3.BUCKET, Key=ARCHIVE_KEY)['Body']
+    data = body.read()
+    with tarfile.open(fileobj=io.BytesIO(data), mode='r:xz') as tf:
+        names = tf.getnames()
+    return (data, names)
+
+
+def test_backup_db_streams_upload(base_path, bucket, backups):
+    output = _backup_db(base_path, '--upload')
+    assert 'compressed and uploaded' in output
+    (data, names) = _uploaded(bucket)
+    assert data == _archive_path(base_path).read_binary()
+    assert sum(1 for name in names if '/values/' in name) == 1
+    assert (s3.object_sha256(bucket, ARCHIVE_KEY) ==
+            hashlib.sha256(data).hexdigest())
+    assert not bucket.list_multipart_uploads(
+        Bucket=s3.BUCKET).get('Uploads')
+
+
+def test_backup_db_uploads_existing_archive(base_path, bucket, backups):
+    _backup_db(base_path)
+    assert bucket.list_objects_v2(Bucket=s3.BUCKET)['KeyCount'] == 0
+    backups[0] = 0
+    output = _backup_db(base_path, '--upload')
+    assert 'uploaded to' in output
+    (data, _) = _uploaded(bucket)
+    assert data == _archive_path(base_path).read_binary()
+    assert 'already uploaded' in _backup_db(base_path, '--upload')
+
+
+def test_backup_db_uploads_fresh_backup(base_path, bucket, backups):
+    _backup_db(base_path, '--upload', '--no-local-archive')
+    (first, _) = _uploaded(bucket)
+    backups[0] = 0
+    assert 'already uploaded' in _backup_db(base_path, '--upload',
+                                            '--no-local-archive')
+    backup_dir = _archive_path(base_path).dirpath(RELEASE)
+    backup_dir.remove()
+    backups[0] = 2
+    _backup_db(base_path, '--upload', '--no-local-archive',
+               '--no-incremental')
+    (second, names) = _uploaded(bucket)
+    assert second != first
+    assert sum(1 for name in names if '/values/' in name) == 2
+
+
+@pytest.fixture
+def restored(monkeypatch):
+    """Records the backups restored, instead of running Datomic."""
+    backups = []
+
+    def restore_db(context, local_backup_path, db_name):
+        backups.append((db_name,
+                        sorted(datomic._backup_segments(local_backup_path))))
+
+    monkeypatch.setattr(datomic, 'transactor_running', lambda: True)
+    monkeypatch.setattr(datomic, 'restore_db', restore_db)
+    return backups
+
+
+def _restore(base_path):
+    result = CliRunner().invoke(runcommand.root_command,
+                                ['-b', str(base_path), 'restore',
+                                 '--connections', '3',
+                                 '--part-size-mb', '1'])
+    assert result.exception is None, result.output
+    return result.output
+
+
+def test_restore_streams_archive(base_path, bucket, backups, restored):
+    backups[0] = 2
+    _backup_db(base_path, '--upload')
+    (data, names) = _uploaded(bucket)
+    # Downloaded in several ranges.
+    assert len(data) > 2 * 2 ** 20
+    backup_dir = _archive_path(base_path).dirpath(RELEASE)
+    segments = sorted(datomic._backup_segments(str(backup_dir)))
+    assert 'Restored' in _restore(base_path)
+    assert restored == [(RELEASE, segments)]
+    restore_dir = base_path.join('datomic-db-restore', RELEASE, RELEASE)
+    for segment in segments:
+        assert (restore_dir.join(segment).read_binary() ==
+                backup_dir.join(segment).read_binary())
+    assert not base_path.join('datomic-db-restore', RELEASE + '.part').check()
+
+
+def test_restore_rejects_corrupt_archive(base_path, bucket, backups,
+                                         restored):
+    _backup_db(base_path, '--upload')
+    (data, _) = _uploaded(bucket)
+    bucket.put_object(Bucket=s3.BUCKET,
+                      Key=ARCHIVE_KEY,
+                      Body=data,
+                      Metadata=dict(sha256='0' * 64))
+    assert 'SHA-256' in _restore(base_path)
+    assert restored == []
+    assert not base_path.join('datomic-db-restore').listdir()
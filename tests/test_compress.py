@@ -0,0 +1,37 @@
+import gzip
+import hashlib
+import os
+
+from azanium import compress
+
+
+def test_compress_round_trip(tmpdir):
+    # compressible, but not trivially so
+    data = b''.join(os.urandom(64) * 16 for _ in range(1000))
+    path = str(tmpdir.join('Gene.ace'))
+    with open(path, 'wb') as fp:
+        fp.write(data)
+    [result] = compress.compress_files([path], n_procs=2, chunk_size=100000)
+    assert not os.path.exists(path)
+    assert result.out_path == path + '.gz'
+    assert result.in_bytes == len(data)
+    with open(result.out_path, 'rb') as fp:
+        compressed = fp.read()
+    assert result.sha256 == hashlib.sha256(compressed).hexdigest()
+    # one gzip member per chunk
+    assert compressed.count(b'\x1f\x8b\x08') >= len(data) // 100000
+    with gzip.open(result.out_path, 'rb') as fp:
+        assert fp.read() == data
+
+
+def test_compress_empty_file(tmpdir):
+    path = tmpdir.join('empty.ace')
+    path.write_binary(b'')
+    [result] = compress.compress_files([str(path)], n_procs=1)
+    with gzip.open(result.out_path, 'rb') as fp:
+        assert fp.read() == b''
+
+
+def test_window_grows_with_processes(tmpdir):
+    with compress.ParallelGzip(n_procs=3) as pgz:
+        assert pgz.max_in_flight == 6
@@ -0,0 +1,183 @@
+import os
+import socket
+import time
+
+import pytest
+
+from azanium import datomic
+from azanium import metrics
+from azanium import util
+
+
+LINEAGE_ERROR = (b'java.lang.IllegalArgumentException: :backup/different-db '
+                 b'Backup target contains a different database\n')
+
+
+@pytest.fixture
+def backups_dir(tmpdir):
+    seed = tmpdir.join('2017-01-01', 'WS900', datomic.BACKUP_SEGMENTS_DIR)
+    seed.ensure('a', 'segment-1')
+    seed.ensure('a', 'segment-2')
+    seed.dirpath().ensure('roots', '1')
+    return tmpdir
+
+
+def _backup(errors, calls):
+    """Fails with each of `errors`, then writes a segment."""
+    def backup_db(context, local_backup_path, db_name):
+        calls.append(sorted(datomic._backup_segments(local_backup_path)))
+        if errors:
+            raise util.LocalCommandError(errors.pop(0))
+        segment = os.path.join(local_backup_path,
+                               datomic.BACKUP_SEGMENTS_DIR, 'b', 'new')
+        os.makedirs(os.path.dirname(segment), exist_ok=True)
+        open(segment, 'w').close()
+
+    return backup_db
+
+
+def test_seeded_backup_reuses_segments(backups_dir, monkeypatch):
+    calls = []
+    monkeypatch.setattr(datomic, 'backup_db', _backup([], calls))
+    target = str(backups_dir.join('2017-02-01', 'WS900'))
+    report = datomic.incremental_backup_db(None, target, 'WS900')
+    assert (report.reused, report.written) == (2, 1)
+    assert report.seed == str(backups_dir.join('2017-01-01', 'WS900'))
+
+
+def test_seed_of_another_database_falls_back(backups_dir, monkeypatch):
+    calls = []
+    monkeypatch.setattr(datomic, 'backup_db',
+                        _backup([LINEAGE_ERROR], calls))
+    target = str(backups_dir.join('2017-02-01', 'WS900'))
+    report = datomic.incremental_backup_db(None, target, 'WS900')
+    assert len(calls[0]) == 2
+    assert calls[1] == []
+    assert (report.seed, report.reused, report.written) == (None, 0, 1)
+
+
+def test_other_errors_keep_seeded_backup(backups_dir, monkeypatch):
+    calls = []
+    monkeypatch.setattr(datomic, 'backup_db',
+                        _backup([b'Connection refused'], calls))
+    target = str(backups_dir.join('2017-02-01', 'WS900'))
+    with pytest.raises(util.LocalCommandError):
+        datomic.incremental_backup_db(None, target, 'WS900')
+    assert len(datomic._backup_segments(target)) == 2
+
+
+def test_existing_backup_is_never_removed(backups_dir, monkeypatch):
+    calls = []
+    monkeypatch.setattr(datomic, 'backup_db',
+                        _backup([LINEAGE_ERROR], calls))
+    target = str(backups_dir.join('2017-01-01', 'WS900'))
+    with pytest.raises(util.LocalCommandError):
+        datomic.incremental_backup_db(None, target, 'WS900')
+    assert len(datomic._backup_segments(target)) == 2
+
+
+class _Circus:
+    """Answers the circus commands about the transactor watcher.
+
+    A restart replaces the transactor processes after `restart_polls`
+    more listings, during which the old processes are still listed.
+    """
+
+    def __init__(self, pids=(), status='active', restart_polls=0):
+        self.pids = list(pids)
+        self.status = status
+        self.restart_polls = restart_polls
+        self.commands = []
+        self._restarting = None
+
+    def __call__(self, command, timeout=5.0, **properties):
+        assert properties == dict(name=datomic.TRANSACTOR_WATCHER)
+        self.commands.append(command)
+        if command == 'restart':
+            self._restarting = self.restart_polls
+            return {}
+        if command == 'list':
+            if self._restarting is not None:
+                if self._restarting == 0:
+                    self.pids = [pid + 100 for pid in self.pids]
+                    self._restarting = None
+                else:
+                    self._restarting -= 1
+            return dict(pids=self.pids)
+        if command == 'status':
+            return dict(status=self.status)
+        raise AssertionError(command)
+
+
+@pytest.fixture
+def transactor_port():
+    """The port of a listening socket, standing in for the transactor."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(5)
+        yield sock.getsockname()[1]
+
+
+def _closed_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_wait_for_transactor_ready(transactor_port, monkeypatch):
+    circus = _Circus(pids=[1])
+    monkeypatch.setattr(datomic, '_circus_call', circus)
+    with metrics.collect() as usages:
+        seconds = datomic.wait_for_transactor('127.0.0.1',
+                                              transactor_port,
+                                              timeout=5)
+    assert seconds < 5
+    assert [u.command for u in usages] == ['datomic transactor ready']
+
+
+@pytest.mark.parametrize('circus,port_open', [
+    (_Circus(pids=[]), True),
+    (_Circus(pids=[1], status='stopped'), True),
+    (_Circus(pids=[1]), False)])
+def test_wait_for_transactor_not_ready(circus, port_open, transactor_port,
+                                       monkeypatch):
+    monkeypatch.setattr(datomic, '_circus_call', circus)
+    port = transactor_port if port_open else _closed_port()
+    started = time.time()
+    with pytest.raises(datomic.TransactorNotReady):
+        datomic.wait_for_transactor('127.0.0.1',
+                                    port,
+                                    timeout=0.5,
+                                    initial_delay=0.05,
+                                    max_delay=0.1)
+    assert 0.5 <= time.time() - started < 5
+    assert circus.commands.count('list') > 1
+
+
+def test_restart_transactor_waits_for_new_pids(transactor_port,
+                                               monkeypatch):
+    circus = _Circus(pids=[1, 2], restart_polls=3)
+    monkeypatch.setattr(datomic, '_circus_call', circus)
+    port_open = datomic._port_open
+    monkeypatch.setattr(datomic,
+                        '_port_open',
+                        lambda host, port: port_open('127.0.0.1',
+                                                     transactor_port))
+    delays = []
+    monkeypatch.setattr(datomic.time, 'sleep', delays.append)
+    datomic.restart_transactor(timeout=60)
+    assert circus.pids == [101, 102]
+    # The old transactor is listed (and active) until replaced.
+    assert circus.commands[:2] == ['list', 'restart']
+    assert circus.commands.count('list') == 1 + 4
+    assert len(delays) == 3
+
+
+def test_restart_transactor_times_out_on_old_pids(transactor_port,
+                                                  monkeypatch):
+    circus = _Circus(pids=[1], restart_polls=10 ** 6)
+    monkeypatch.setattr(datomic, '_circus_call', circus)
+    monkeypatch.setattr(datomic, '_port_open', lambda host, port: True)
+    with pytest.raises(datomic.TransactorNotReady):
+        datomic.restart_transactor(timeout=0.3)
+    assert circus.pids == [1]
@@ -0,0 +1,109 @@
+import gzip
+import hashlib
+import os
+import random
+
+from azanium import ednsort
+
+
+def _log_lines(n_lines, n_timestamps=20, seed=0):
+    rnd = random.Random(seed)
+    return ['2017-01-{:02d}T00:00:00.000 [:db/add {:d}]\n'
+            .format(rnd.randint(1, n_timestamps), i).encode('utf-8')
+            for i in range(n_lines)]
+
+
+def _write_log(tmpdir, lines, name='log.edn.gz'):
+    path = str(tmpdir.join(name))
+    with gzip.open(path, 'wb') as fp:
+        fp.writelines(lines)
+    return path
+
+
+def _read_log(path):
+    with gzip.open(path, 'rb') as fp:
+        return fp.readlines()
+
+
+def test_sort_log_is_stable(tmpdir):
+    lines = [b'b 1\n',
+             b'a 2\n',
+             b'b 3\n',
+             b'a 4\n',
+             b'b 5']
+    path = _write_log(tmpdir, lines)
+    result = ednsort.sort_log(path)
+    assert _read_log(path) == [b'a 2\n',
+                               b'a 4\n',
+                               b'b 1\n',
+                               b'b 3\n',
+                               b'b 5\n']
+    assert result.n_runs == 1
+    assert result.n_lines == 5
+
+
+def test_sort_log_timestamp_key():
+    # Compared on the first field, not the whole line.
+    assert ednsort.timestamp_key(b'2 a\n') == b'2'
+    assert ednsort.timestamp_key(b'\n') == b''
+
+
+def test_sort_log_merges_spilled_runs(tmpdir):
+    lines = _log_lines(500)
+    expected = sorted(lines, key=ednsort.timestamp_key)
+    in_memory = ednsort.sort_log(_write_log(tmpdir, lines, 'a.edn.gz'))
+    spill_dir = tmpdir.mkdir('runs')
+    path = _write_log(tmpdir, lines, 'b.edn.gz')
+    spilled = ednsort.sort_log(path,
+                               tmp_dir=str(spill_dir),
+                               memory_budget=4096)
+    assert spilled.n_runs > 1
+    assert _read_log(path) == expected
+    assert _read_log(in_memory.path) == expected
+    assert spill_dir.listdir() == []
+    assert not os.path.exists(path + '.sorted.part')
+    with open(path, 'rb') as fp:
+        assert spilled.sha256 == hashlib.sha256(fp.read()).hexdigest()
+
+
+def test_sort_log_index_bounds(tmpdir):
+    lines = _log_lines(100)
+    path = _write_log(tmpdir, lines)
+    result = ednsort.sort_log(path, memory_budget=2048)
+    timestamps = sorted(ednsort.timestamp_key(line).decode('utf-8')
+                        for line in lines)
+    assert result.min_timestamp == timestamps[0]
+    assert result.max_timestamp == timestamps[-1]
+    assert result.n_bytes == os.path.getsize(path)
+    assert ednsort.scan_log(path) == ednsort.index_entry(result)
+
+
+def test_sort_empty_log(tmpdir):
+    path = _write_log(tmpdir, [])
+    result = ednsort.sort_log(path)
+    assert result.n_lines == 0
+    assert (result.min_timestamp, result.max_timestamp) == ('', '')
+    assert _read_log(path) == []
+
+
+def test_index_round_trip(tmpdir):
+    logs_dir = tmpdir.mkdir('edn-logs')
+    entries = []
+    for (i, lines) in enumerate((_log_lines(10, seed=1),
+                                 _log_lines(10, seed=2))):
+        path = _write_log(logs_dir, lines, '{}.edn.gz'.format(i))
+        entries.append(ednsort.index_entry(ednsort.sort_log(path)))
+    ednsort.write_index(str(logs_dir), entries)
+    assert ednsort.read_index(str(logs_dir)) == {e.path: e for e in entries}
+
+
+def test_plan_batches_keeps_overlapping_logs_together():
+    def entry(path, min_ts, max_ts):
+        return ednsort.IndexEntry(path, min_ts, max_ts, 1, 10)
+
+    entries = [entry('c', '5', '6'),
+               entry('a', '1', '3'),
+               entry('b', '2', '4')]
+    batches = ednsort.plan_batches(entries, max_bytes=10)
+    assert [[e.path for e in batch] for batch in batches] == [['a', 'b'],
+                                                              ['c']]
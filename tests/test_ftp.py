@@ -0,0 +1,272 @@
+import ftplib
+import io
+import os
+import tarfile
+import threading
+
+import pytest
+from pyftpdlib.authorizers import DummyAuthorizer
+from pyftpdlib.handlers import FTPHandler
+from pyftpdlib.servers import FTPServer
+
+from azanium import artefact
+from azanium import log
+from azanium import util
+
+
+logger = log.get_logger(namespace=__name__)
+
+FILES = {
+    'small.tar.gz': os.urandom(1000),
+    'large.tar.gz': os.urandom(300 * 1024),
+    'notes.txt': b'not selected'
+}
+
+
+def _serve(root, monkeypatch):
+    """Runs a local anonymous FTP server of `root`, yielding its host."""
+    authorizer = DummyAuthorizer()
+    authorizer.add_anonymous(str(root))
+    handler = type('Handler', (FTPHandler,), dict(authorizer=authorizer))
+    server = FTPServer(('127.0.0.1', 0), handler)
+    (host, port) = server.socket.getsockname()[:2]
+    # util opens connections on the default FTP port.
+    monkeypatch.setattr(ftplib.FTP, 'port', port)
+    thread = threading.Thread(target=server.serve_forever,
+                              kwargs=dict(timeout=0.1),
+                              daemon=True)
+    thread.start()
+    yield host
+    server.close_all()
+    thread.join()
+
+
+@pytest.fixture
+def ftp_server(tmpdir, monkeypatch):
+    """A local anonymous FTP server serving `FILES`."""
+    root = tmpdir.mkdir('ftp-root')
+    for (name, data) in FILES.items():
+        root.join(name).write_binary(data)
+    yield from _serve(root, monkeypatch)
+
+
+def _tarball(members):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz') as tf:
+        for (name, data) in sorted(members.items()):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+# Archives sharing a parent directory, as those of an ACeDB database.
+TARBALL_MEMBERS = {
+    'database-1.tar.gz': {'database/block1.wrm': os.urandom(200 * 1024),
+                          'database/log.wrm': b'log'},
+    'database-2.tar.gz': {'database/block2.wrm': os.urandom(1000),
+                          'wspec/models.wrm': b'?Gene'}
+}
+
+TARBALLS = {name: _tarball(members)
+            for (name, members) in TARBALL_MEMBERS.items()}
+
+
+@pytest.fixture
+def tarball_server(tmpdir, monkeypatch):
+    """A local anonymous FTP server serving `TARBALLS`."""
+    root = tmpdir.mkdir('ftp-root')
+    for (name, data) in TARBALLS.items():
+        root.join(name).write_binary(data)
+    yield from _serve(root, monkeypatch)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Records the backoff delays instead of sleeping."""
+    delays = []
+    monkeypatch.setattr(util.time, 'sleep', delays.append)
+    return delays
+
+
+def _download(host, download_dir, **kw):
+    return util.ftp_download(host,
+                             r'.*\.tar\.gz$',
+                             str(download_dir),
+                             logger=logger,
+                             **kw)
+
+
+def test_ftp_download(ftp_server, tmpdir):
+    paths = _download(ftp_server, tmpdir, max_connections=2)
+    assert sorted(map(os.path.basename, paths)) == ['large.tar.gz',
+                                                    'small.tar.gz']
+    for path in paths:
+        with open(path, 'rb') as fp:
+            assert fp.read() == FILES[os.path.basename(path)]
+
+
+def test_ftp_download_resumes_partial_file(ftp_server, tmpdir):
+    expected = FILES['large.tar.gz']
+    offset = 100 * 1024
+    # A prefix that differs from the server's file shows that only the
+    # rest of the file was transferred (REST offset).
+    partial = b'\0' * offset
+    tmpdir.join('large.tar.gz').write_binary(partial)
+    _download(ftp_server, tmpdir)
+    assert tmpdir.join('large.tar.gz').read_binary() == (partial +
+                                                         expected[offset:])
+
+
+def test_ftp_download_leaves_complete_file(ftp_server, tmpdir):
+    complete = b'x' * len(FILES['small.tar.gz'])
+    tmpdir.join('small.tar.gz').write_binary(complete)
+    _download(ftp_server, tmpdir)
+    assert tmpdir.join('small.tar.gz').read_binary() == complete
+
+
+def test_ftp_download_restarts_larger_file(ftp_server, tmpdir):
+    tmpdir.join('small.tar.gz').write_binary(b'x' * 5000)
+    _download(ftp_server, tmpdir)
+    assert tmpdir.join('small.tar.gz').read_binary() == FILES['small.tar.gz']
+
+
+class _ShortFtp:
+    """Sends fewer bytes than the size listed on the server."""
+
+    def retrbinary(self, cmd, callback, rest=None):
+        callback(b'abc')
+
+
+def test_ftp_retrieve_size_mismatch(tmpdir):
+    out_path = str(tmpdir.join('file.tar.gz'))
+    with pytest.raises(util.FtpTransferError):
+        util.ftp_retrieve(_ShortFtp(),
+                          util.FtpFile(name='file.tar.gz', size=10),
+                          out_path,
+                          logger)
+
+
+def test_ftp_pool_retries_with_backoff(ftp_server, sleeps):
+    calls = []
+
+    def flaky(ftp, ftp_file):
+        calls.append(ftp_file.name)
+        if len(calls) < 3:
+            raise ftplib.error_temp('421 Too many connections')
+        return ftp_file.name
+
+    files = [util.FtpFile(name='small.tar.gz', size=1000)]
+    results = util.ftp_pool(ftp_server, files, flaky, logger,
+                            retry_attempts=3)
+    assert results == {'small.tar.gz': 'small.tar.gz'}
+    assert calls == ['small.tar.gz'] * 3
+    assert sleeps == [1.0, 2.0]
+
+
+def test_ftp_pool_gives_up_after_retries(ftp_server, sleeps):
+    def failing(ftp, ftp_file):
+        raise ftplib.error_temp('421 Too many connections')
+
+    files = [util.FtpFile(name='small.tar.gz', size=1000)]
+    with pytest.raises(ftplib.error_temp):
+        util.ftp_pool(ftp_server, files, failing, logger, retry_attempts=2)
+    assert sleeps == [1.0, 2.0]
+
+
+def test_ftp_pool_schedules_largest_first(ftp_server):
+    order = []
+    files = [util.FtpFile(name='small.tar.gz', size=1000),
+             util.FtpFile(name='large.tar.gz', size=300 * 1024)]
+    util.ftp_pool(ftp_server,
+                  files,
+                  lambda ftp, ftp_file: order.append(ftp_file.name),
+                  logger,
+                  max_connections=1)
+    assert order == ['large.tar.gz', 'small.tar.gz']
+
+
+def test_ftp_pool_without_files_does_not_connect(monkeypatch):
+    def connect(*args, **kw):
+        raise AssertionError('connected')
+
+    monkeypatch.setattr(util, '_ftp_open', connect)
+    assert util.ftp_pool('ftp.example.org', [], None, logger) == {}
+
+
+def _fail_transfers(monkeypatch):
+    """Fails any archive transfer, e.g those expected from disk instead."""
+    def ftp_stream(ftp, filename):
+        raise AssertionError('{} transferred'.format(filename))
+
+    monkeypatch.setattr(util, 'ftp_stream', ftp_stream)
+
+
+def _extract(host, extract_dir, **kw):
+    return util.ftp_extract(host,
+                            r'.*\.tar\.gz$',
+                            str(extract_dir),
+                            logger=logger,
+                            max_connections=2,
+                            **kw)
+
+
+def _assert_extracted(extract_dir):
+    expected = {}
+    for members in TARBALL_MEMBERS.values():
+        expected.update(members)
+    extracted = {}
+    for (dirpath, _, filenames) in os.walk(str(extract_dir)):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            with open(path, 'rb') as fp:
+                extracted[os.path.relpath(path, str(extract_dir))] = fp.read()
+    assert extracted == expected
+
+
+def test_ftp_extract_streams_archives(tarball_server, tmpdir):
+    extract_dir = tmpdir.mkdir('acedb')
+    names = _extract(tarball_server, extract_dir)
+    assert sorted(names) == sorted(TARBALLS)
+    _assert_extracted(extract_dir)
+
+
+def test_ftp_extract_keeps_archives(tarball_server, tmpdir):
+    extract_dir = tmpdir.mkdir('acedb')
+    archive_dir = tmpdir.mkdir('archives')
+    _extract(tarball_server, extract_dir, archive_dir=str(archive_dir))
+    _assert_extracted(extract_dir)
+    assert sorted(archive_dir.listdir()) == sorted(
+        archive_dir.join(name) for name in TARBALLS)
+    for (name, data) in TARBALLS.items():
+        assert archive_dir.join(name).read_binary() == data
+
+
+def test_ftp_extract_from_kept_archives(tarball_server, tmpdir, monkeypatch):
+    archive_dir = tmpdir.mkdir('archives')
+    for (name, data) in TARBALLS.items():
+        archive_dir.join(name).write_binary(data)
+    _fail_transfers(monkeypatch)
+    extract_dir = tmpdir.mkdir('acedb')
+    _extract(tarball_server, extract_dir, archive_dir=str(archive_dir))
+    _assert_extracted(extract_dir)
+
+
+def test_ftp_extract_caches_archives(tarball_server, tmpdir, monkeypatch):
+    cache = artefact.Cache(path=str(tmpdir.join('cache')), logger=logger)
+    archive_dir = tmpdir.mkdir('archives')
+    _extract(tarball_server,
+             tmpdir.mkdir('first'),
+             archive_dir=str(archive_dir),
+             cache=cache,
+             cache_version='1')
+    for (name, data) in TARBALLS.items():
+        url = util.ftp_file_url(tarball_server, None, name)
+        with open(cache.lookup(url, '1'), 'rb') as fp:
+            assert fp.read() == data
+    # Cached archives are extracted without a transfer, nor a kept copy.
+    archive_dir.remove()
+    _fail_transfers(monkeypatch)
+    extract_dir = tmpdir.mkdir('second')
+    _extract(tarball_server, extract_dir, cache=cache, cache_version='1')
+    _assert_extracted(extract_dir)
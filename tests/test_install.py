@@ -0,0 +1,86 @@
+import collections
+import os
+import threading
+import time
+
+import click
+import pytest
+from click.testing import CliRunner
+
+from azanium import install
+from azanium import root_command
+from azanium import util
+
+
+NAMES = ('datomic_free', 'pseudoace', 'tace')
+
+
+@pytest.fixture
+def installed(monkeypatch):
+    """Replaces the installers with stubs recording the installs.
+
+    The installers in ``failing`` raise an error instead.
+    """
+    calls = dict(names=[], failing=set(), running=0, max_running=0)
+    lock = threading.Lock()
+
+    def stub(name):
+        @util.pass_command_context
+        def run(context):
+            with lock:
+                calls['running'] += 1
+                calls['max_running'] = max(calls['max_running'],
+                                           calls['running'])
+            time.sleep(0.1)
+            with lock:
+                calls['running'] -= 1
+            if name in calls['failing']:
+                raise RuntimeError('{} failed'.format(name))
+            os.makedirs(context.path(name), exist_ok=True)
+            with lock:
+                calls['names'].append(name)
+
+        return click.Command(name, callback=run)
+
+    commands = collections.OrderedDict((name, stub(name)) for name in NAMES)
+    monkeypatch.setattr(install.installers, 'commands', commands)
+    monkeypatch.setattr(install, 'preliminary_checks', lambda: None)
+    monkeypatch.setattr(util,
+                        'get_deploy_versions',
+                        lambda: dict.fromkeys(NAMES, '1.0'))
+    return calls
+
+
+def _run_installers(tmpdir, names, jobs):
+    context = util.CommandContext(str(tmpdir))
+    with click.Context(install.install, obj=context) as ctx:
+        return install.run_installers(ctx, names, jobs=jobs)
+
+
+def test_run_installers_concurrently(installed, tmpdir):
+    timings = _run_installers(tmpdir, NAMES, len(NAMES))
+    assert list(timings) == list(NAMES)
+    assert sorted(installed['names']) == sorted(NAMES)
+    assert installed['max_running'] == len(NAMES)
+
+
+def test_run_installers_one_at_a_time(installed, tmpdir):
+    timings = _run_installers(tmpdir, NAMES, 1)
+    assert list(timings) == installed['names'] == list(NAMES)
+    assert installed['max_running'] == 1
+
+
+def test_run_installers_raises_installer_error(installed, tmpdir):
+    installed['failing'].add('pseudoace')
+    with pytest.raises(RuntimeError):
+        _run_installers(tmpdir, NAMES, 2)
+    assert sorted(installed['names']) == ['datomic_free', 'tace']
+
+
+def test_install_jobs(installed, tmpdir):
+    result = CliRunner().invoke(root_command,
+                                ['-b', str(tmpdir), 'install', '-j', '2'],
+                                obj={})
+    assert result.exception is None, result.output
+    assert sorted(installed['names']) == sorted(NAMES)
+    assert installed['max_running'] == 2
@@ -0,0 +1,47 @@
+import threading
+
+import pytest
+
+from azanium import jvm
+
+
+def _planner(wait_timeout_hours=1.0):
+    default = dict(reserved_gb='0',
+                   share='0.5',
+                   min_gb='1',
+                   initial_ratio='1.0',
+                   gc_flags='',
+                   wait_timeout_hours=str(wait_timeout_hours))
+    profiles = dict(default=default,
+                    transactor=dict(default, share='0.75'))
+    return jvm.Planner(profiles=profiles, available_bytes=4 * jvm.GB)
+
+
+def test_acquire_waits_for_release():
+    planner = _planner()
+    first = planner.acquire('backup', share=0.9)
+    acquired = []
+    thread = threading.Thread(
+        target=lambda: acquired.append(planner.acquire('restore')))
+    thread.start()
+    thread.join(timeout=0.2)
+    assert thread.is_alive()
+    first.release()
+    thread.join(timeout=10)
+    assert acquired[0].heap_bytes == 2 * jvm.GB
+
+
+def test_acquire_does_not_wait_for_held_memory():
+    planner = _planner()
+    planner.hold('transactor')
+    planner.hold('pseudoace')
+    reservation = planner.acquire('backup')
+    assert reservation.heap_bytes == jvm.GB
+
+
+def test_acquire_times_out():
+    planner = _planner(wait_timeout_hours=0.0001)
+    planner.acquire('backup', share=0.9)
+    with pytest.raises(jvm.MemoryNotAvailable) as exc_info:
+        planner.acquire('restore')
+    assert 'backup' in str(exc_info.value)
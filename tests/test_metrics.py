@@ -0,0 +1,92 @@
+import concurrent.futures
+import json
+import shlex
+import sys
+import threading
+
+from azanium import metrics
+from azanium import notifications
+from azanium import util
+
+# Holds 64 MB in a child process while using CPU for half a second.
+CHILD = """
+import time
+data = bytearray(64 * 2 ** 20)
+deadline = time.time() + 0.5
+while time.time() < deadline:
+    pass
+"""
+
+
+def _usage(command):
+    return metrics.Usage(command=command,
+                         started=0.0,
+                         wall_seconds=0.0,
+                         cpu_seconds=0.0,
+                         peak_rss=0,
+                         read_bytes=0,
+                         write_bytes=0)
+
+
+def _step(name, executor, ready):
+    with metrics.collect() as usages:
+        executor.submit(metrics.bind(metrics.record), _usage(name)).result()
+        # while both steps are collecting
+        ready.wait()
+        metrics.record(_usage(name))
+    return [u.command for u in usages]
+
+
+def test_bound_pool_threads_record_to_their_step():
+    ready = threading.Barrier(2)
+    with concurrent.futures.ThreadPoolExecutor(2) as steps, \
+            concurrent.futures.ThreadPoolExecutor(2) as pool:
+        futures = [steps.submit(_step, name, pool, ready)
+                   for name in ('a', 'b')]
+        assert [f.result() for f in futures] == [['a', 'a'], ['b', 'b']]
+
+
+def test_unbound_threads_are_not_collected():
+    with metrics.collect() as usages:
+        thread = threading.Thread(target=metrics.record, args=(_usage('x'),))
+        thread.start()
+        thread.join()
+    assert usages == []
+
+
+def _run_child():
+    # The child runs below the shell (kept by `true`), in the sampled tree.
+    util.local('{} -c {}; true'.format(sys.executable, shlex.quote(CHILD)),
+               label='child',
+               sample_interval=0.05)
+
+
+def test_local_records_usage_of_child_processes(tmpdir, monkeypatch):
+    path = str(tmpdir.join('metrics.jsonl'))
+    monkeypatch.setitem(metrics._state, 'path', None)
+    metrics.set_path(path)
+    with metrics.collect() as usages:
+        _run_child()
+    assert len(usages) == 1
+    usage = usages[0]
+    assert usage.command == 'child'
+    assert usage.wall_seconds >= 0.5
+    assert usage.cpu_seconds >= 0.3
+    assert usage.peak_rss >= 64 * 2 ** 20
+    with open(path) as fp:
+        entries = [json.loads(line) for line in fp]
+    assert entries == [usage._asdict()]
+
+
+def test_around_attaches_usage(monkeypatch):
+    notified = []
+    monkeypatch.setattr(
+        notifications, 'notify',
+        lambda headline, **kw: notified.append((headline, kw)))
+    notifications.around(_run_child, 'Step 1', 'Running child')
+    (headline, kw) = notified[-1]
+    assert headline == 'Step 1 - *complete*'
+    (attachment,) = kw['attachments']
+    assert attachment.title == 'Resource usage'
+    assert [field['value'].split(':')[0]
+            for field in attachment.fields] == ['child']
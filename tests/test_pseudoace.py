@@ -0,0 +1,152 @@
+import gzip
+import os
+
+from azanium import ednsort
+from azanium import jvm
+from azanium import pseudoace
+from azanium import util
+
+
+class _Context:
+
+    java_cmd = 'java'
+    pseudoace_jar_path = 'pseudoace.jar'
+
+    def __init__(self):
+        self.app_state = {}
+        self.jvm_planner = jvm.Planner(profiles=jvm.load_profiles(),
+                                       available_bytes=8 * jvm.GB)
+
+    def datomic_url(self, db_name=None):
+        return 'datomic:free://localhost:4334/' + (db_name or 'WS260')
+
+
+class _DisabledWorker:
+
+    def available(self):
+        return False
+
+    def run(self, *args):
+        raise AssertionError('ran in disabled worker')
+
+
+def _write_log(path, timestamp):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with gzip.open(path, 'wb') as fp:
+        fp.write(timestamp.encode('utf-8') + b' [:db/add 1]\n')
+    return ednsort.scan_log(path)
+
+
+def test_import_logs_batches_keep_relative_paths(tmpdir, monkeypatch):
+    logs_dir = str(tmpdir.join('edn-logs'))
+    entries = [_write_log(os.path.join(logs_dir, shard, 'Gene.edn.gz'), ts)
+               for (shard, ts) in (('shard-01', '1'), ('shard-02', '2'))]
+    ednsort.write_index(logs_dir, entries)
+    imported = []
+
+    def run_pseudoace(context, log_dir_arg, *args):
+        batch_dir = log_dir_arg.split('=', 1)[1]
+        imported.append(sorted(
+            os.path.relpath(os.path.join(dirpath, name), batch_dir)
+            for (dirpath, _, names) in os.walk(batch_dir)
+            for name in names))
+
+    monkeypatch.setattr(pseudoace, 'run_pseudoace', run_pseudoace)
+    pseudoace.import_logs(_Context(), logs_dir, batch_bytes=2 ** 30)
+    assert imported == [[os.path.join('shard-01', 'Gene.edn.gz'),
+                         os.path.join('shard-02', 'Gene.edn.gz')]]
+
+
+def test_run_pseudoace_without_worker_when_disabled(monkeypatch):
+    commands = []
+    monkeypatch.setattr(util,
+                        'local',
+                        lambda cmd, **kw: commands.append(' '.join(cmd)))
+    context = _Context()
+    context.pseudoace_worker = _DisabledWorker()
+    pseudoace.run_pseudoace(context, 'import-logs')
+    assert len(commands) == 1
+    assert commands[0].endswith('-m pseudoace.cli --url={} import-logs'
+                                .format(context.datomic_url()))
+
+
+def test_sort_edn_logs_skips_sorted_logs(tmpdir, monkeypatch):
+    logs_dir = str(tmpdir.join('edn-logs'))
+    paths = [os.path.join(logs_dir, name) for name in ('a.edn.gz',
+                                                       'b.edn.gz')]
+    for path in paths:
+        _write_log(path, '2')
+    sorted_paths = []
+    sort_logs = ednsort.sort_logs
+
+    def recording_sort_logs(paths, **kw):
+        sorted_paths.append(sorted(paths))
+        return sort_logs(paths, **kw)
+
+    monkeypatch.setattr(ednsort, 'sort_logs', recording_sort_logs)
+    context = _Context()
+    context.app_state = util.SyncedShelf(str(tmpdir.join('state')))
+    pseudoace.sort_edn_logs(context, logs_dir, engine='native', n_procs=1)
+    pseudoace.sort_edn_logs(context, logs_dir, engine='native', n_procs=1)
+    # A changed log is sorted again.
+    with gzip.open(paths[1], 'wb') as fp:
+        fp.write(b'3 [:db/add 3]\n1 [:db/add 1]\n')
+    pseudoace.sort_edn_logs(context, logs_dir, engine='native', n_procs=1)
+    assert sorted_paths == [paths, [], [paths[1]]]
+    with gzip.open(paths[1]) as fp:
+        assert fp.read() == b'1 [:db/add 1]\n3 [:db/add 3]\n'
+    index = ednsort.read_index(logs_dir)
+    assert (index[paths[1]].min_timestamp,
+            index[paths[1]].max_timestamp) == ('1', '3')
+
+
+def test_sharded_dump_to_edn_logs_merges_shards(tmpdir, monkeypatch):
+    dump_dir = tmpdir.mkdir('acedb-dump')
+    for (name, size) in (('Gene', 3000), ('Paper', 2000), ('Variation', 1000)):
+        dump_dir.join(name + '.ace.gz').write_binary(b'x' * size)
+    logs_dir = str(tmpdir.join('edn-logs'))
+    shards = []
+
+    def ace_to_edn(context, acedb_dump_dir, edn_logs_dir, heap_share=None):
+        # Each shard writes a log of the same name, and one of its own.
+        names = sorted(name.split('.')[0]
+                       for name in os.listdir(acedb_dump_dir))
+        shards.append(names)
+        os.makedirs(os.path.join(edn_logs_dir, 'db'))
+        for (n, name) in enumerate(names):
+            with gzip.open(os.path.join(edn_logs_dir, name + '.edn.gz'),
+                           'wb') as fp:
+                fp.write('{} [:db/add {}]\n'.format(n, name).encode('utf-8'))
+        path = os.path.join(edn_logs_dir, 'db', 'Shared.edn.gz')
+        with gzip.open(path, 'wb') as fp:
+            for name in names:
+                fp.write('{:d} [:db/add {}]\n'.format(len(name), name)
+                         .encode('utf-8'))
+
+    monkeypatch.setattr(pseudoace, 'acedb_dump_to_edn_logs', ace_to_edn)
+    pseudoace.sharded_acedb_dump_to_edn_logs(_Context(),
+                                             str(dump_dir),
+                                             logs_dir,
+                                             2)
+    assert sorted(shards) == [['Gene'], ['Paper', 'Variation']]
+    assert not os.path.exists(logs_dir + '.shards')
+    assert sorted(os.path.relpath(path, logs_dir)
+                  for path in pseudoace.edn_log_paths(logs_dir)) == [
+        'Gene.edn.gz',
+        'Paper.edn.gz',
+        'Variation.edn.gz',
+        os.path.join('db', 'Shared.edn.gz')]
+    with gzip.open(os.path.join(logs_dir, 'Variation.edn.gz')) as fp:
+        assert fp.read() == b'1 [:db/add Variation]\n'
+    # The gzip members of both shards are read as one log, and sorted.
+    shared_path = os.path.join(logs_dir, 'db', 'Shared.edn.gz')
+    with gzip.open(shared_path) as fp:
+        assert sorted(fp.readlines()) == [b'4 [:db/add Gene]\n',
+                                          b'5 [:db/add Paper]\n',
+                                          b'9 [:db/add Variation]\n']
+    result = ednsort.sort_log(shared_path)
+    assert result.n_lines == 3
+    with gzip.open(shared_path) as fp:
+        assert fp.readlines() == [b'4 [:db/add Gene]\n',
+                                  b'5 [:db/add Paper]\n',
+                                  b'9 [:db/add Variation]\n']
@@ -0,0 +1,212 @@
+import gzip
+import os
+import threading
+import time
+
+import click
+import pytest
+from click.testing import CliRunner
+
+from azanium import runcommand
+from azanium import util
+
+
+RELEASE = 'WS900'
+
+
+@pytest.fixture
+def context(tmpdir, monkeypatch):
+    # app_state and history_state are kept under the home directory.
+    monkeypatch.setenv('HOME', str(tmpdir))
+    monkeypatch.setattr(util, 'get_data_release_version', lambda: RELEASE)
+    return util.CommandContext(str(tmpdir.mkdir('base')))
+
+
+class _Steps:
+    """Makes steps recording when they run, instead of migrating."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = []
+        self.finished = []
+        self.weight = 0
+        self.max_weight = 0
+
+    def step(self, name, requires=(), weight=1, fail=False):
+        def run():
+            with self.lock:
+                self.started.append(name)
+                self.weight += weight
+                self.max_weight = max(self.max_weight, self.weight)
+            time.sleep(0.05)
+            with self.lock:
+                self.weight -= weight
+                self.finished.append(name)
+            if fail:
+                raise RuntimeError('{} failed'.format(name))
+
+        return runcommand.Step(name.capitalize(),
+                               click.Command(name, callback=run),
+                               {},
+                               requires,
+                               weight)
+
+
+def _process_steps(context, steps, **kw):
+    with click.Context(click.Command('migrate'), obj={}):
+        runcommand.process_steps(context, steps, **kw)
+
+
+def test_process_steps_runs_required_steps_first(context):
+    stub = _Steps()
+    steps = [stub.step('a'),
+             stub.step('b', requires=('a',)),
+             stub.step('c', requires=('a',)),
+             stub.step('d', requires=('b', 'c'))]
+    _process_steps(context, steps, max_weight=3)
+    assert stub.started[0] == 'a'
+    assert set(stub.started[1:3]) == {'b', 'c'}
+    assert stub.started[3] == 'd'
+    assert stub.finished.index('b') < stub.started.index('d')
+    assert stub.finished.index('c') < stub.started.index('d')
+    assert stub.max_weight == 2
+    assert runcommand.completed_steps(context, steps) == set('abcd')
+
+
+def test_process_steps_within_max_weight(context):
+    stub = _Steps()
+    steps = [stub.step('a', weight=2),
+             stub.step('b', weight=2),
+             stub.step('c'),
+             stub.step('d')]
+    _process_steps(context, steps, max_weight=3)
+    assert stub.max_weight == 3
+    assert set(stub.finished) == set('abcd')
+
+
+def test_process_steps_one_at_a_time_by_default(context):
+    stub = _Steps()
+    steps = [stub.step('a', weight=2),
+             stub.step('b'),
+             stub.step('c', requires=('a',)),
+             stub.step('d')]
+    _process_steps(context, steps)
+    # A step weighing more than the maximum runs on its own.
+    assert stub.max_weight == 2
+    assert stub.started == stub.finished == ['a', 'b', 'c', 'd']
+
+
+def test_process_steps_resumes_incomplete_steps(context):
+    stub = _Steps()
+    steps = [stub.step('a'),
+             stub.step('b', requires=('a',), fail=True),
+             stub.step('c'),
+             stub.step('d', requires=('b',))]
+    with pytest.raises(RuntimeError):
+        _process_steps(context, steps, max_weight=3)
+    assert sorted(stub.started) == ['a', 'b', 'c']
+    assert runcommand.completed_steps(context, steps) == {'a', 'c'}
+    stub = _Steps()
+    steps = [stub.step('a'),
+             stub.step('b', requires=('a',)),
+             stub.step('c'),
+             stub.step('d', requires=('b',))]
+    _process_steps(context, steps, max_weight=3)
+    assert stub.started == ['b', 'd']
+    assert runcommand.completed_steps(context, steps) == set('abcd')
+
+
+def test_process_steps_rejects_unknown_requirement(context):
+    stub = _Steps()
+    steps = [stub.step('a'), stub.step('b', requires=('z',))]
+    with pytest.raises(ValueError):
+        _process_steps(context, steps)
+    assert stub.started == []
+
+
+def test_completed_steps_from_last_step_index(context):
+    stub = _Steps()
+    steps = [stub.step(name) for name in 'abcd']
+    context.app_state[runcommand.LAST_STEP_OK_STATE_KEY] = 2
+    context.app_state.sync()
+    assert runcommand.completed_steps(context, steps) == {'a', 'b'}
+    assert runcommand.LAST_STEP_OK_STATE_KEY not in context.app_state
+    assert (context.app_state[runcommand.COMPLETED_STEPS_STATE_KEY] ==
+            ['a', 'b'])
+
+
+def test_completed_steps_keeps_recorded_names(context):
+    stub = _Steps()
+    steps = [stub.step(name) for name in 'abcd']
+    context.app_state[runcommand.LAST_STEP_OK_STATE_KEY] = 3
+    context.app_state[runcommand.COMPLETED_STEPS_STATE_KEY] = ['a', 'c']
+    context.app_state.sync()
+    assert runcommand.completed_steps(context, steps) == {'a', 'c'}
+    assert runcommand.LAST_STEP_OK_STATE_KEY not in context.app_state
+
+
+def test_reset_to_step_resets_dependants(context):
+    steps = runcommand._get_steps(context)
+    names = [step.func.name for step in steps]
+    context.app_state[runcommand.COMPLETED_STEPS_STATE_KEY] = names
+    context.app_state.sync()
+    step_n = names.index('sort-edn-logs') + 1
+    result = CliRunner().invoke(runcommand.root_command,
+                                ['-b', context.base_path, 'reset-to-step'],
+                                input='{:d}\ny\n'.format(step_n))
+    assert result.exception is None, result.output
+    state = util.app_state()
+    assert (state[runcommand.COMPLETED_STEPS_STATE_KEY] ==
+            names[:names.index('sort-edn-logs')])
+
+
+def test_get_steps_with_homol(context):
+    steps = runcommand._get_steps(context, with_homol=True)
+    requires = {step.func.name: set(step.requires) for step in steps}
+    weights = {step.func.name: step.weight for step in steps}
+    assert requires['homol-import'] == {'sort-edn-logs', 'create-database'}
+    assert requires['backup-homol-db'] == {'homol-import'}
+    assert requires['backup-db'] == {'qa-report'}
+    assert requires['import-logs'] == {'sort-edn-logs'}
+    # Both imports are heavy, so only run together with a weight of 4.
+    assert weights['homol-import'] == weights['import-logs'] == 2
+    without_homol = runcommand._get_steps(context)
+    assert ({step.func.name for step in steps} -
+            {step.func.name for step in without_homol} ==
+            {'homol-import', 'backup-homol-db'})
+
+
+def _compress_dump(context, dump_dir):
+    result = CliRunner().invoke(runcommand.root_command,
+                                ['-b', context.base_path,
+                                 'run', 'acedb-compress-dump',
+                                 '-j', '1',
+                                 str(dump_dir)])
+    assert result.exception is None, result.output
+
+
+def test_acedb_compress_dump_skips_compressed_files(context, tmpdir):
+    dump_dir = tmpdir.mkdir('acedb-dump')
+    for name in ('Gene.ace', 'Paper.ace'):
+        dump_dir.join(name).write_binary(name.encode('utf-8') * 100)
+    stats = {name: os.stat(str(dump_dir.join(name)))
+             for name in ('Gene.ace', 'Paper.ace')}
+    _compress_dump(context, dump_dir)
+    assert sorted(p.basename for p in dump_dir.listdir()) == [
+        'Gene.ace.gz', 'Paper.ace.gz']
+    compressed = {name: os.stat(str(dump_dir.join(name + '.gz')))
+                  for name in ('Gene.ace', 'Paper.ace')}
+    # e.g a re-run before the dump files were removed: Gene.ace is
+    # unchanged, but Paper.ace was dumped again.
+    gene = dump_dir.join('Gene.ace')
+    gene.write_binary(b'Gene.ace' * 100)
+    st = stats['Gene.ace']
+    os.utime(str(gene), ns=(st.st_atime_ns, st.st_mtime_ns))
+    dump_dir.join('Paper.ace').write_binary(b'Paper 2')
+    _compress_dump(context, dump_dir)
+    assert sorted(p.basename for p in dump_dir.listdir()) == [
+        'Gene.ace.gz', 'Paper.ace.gz']
+    gene_gz = os.stat(str(dump_dir.join('Gene.ace.gz')))
+    assert gene_gz.st_mtime_ns == compressed['Gene.ace'].st_mtime_ns
+    with gzip.open(str(dump_dir.join('Paper.ace.gz'))) as fp:
+        assert fp.read() == b'Paper 2'
@@ -0,0 +1,87 @@
+import hashlib
+import os
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from azanium import s3
+
+
+@pytest.fixture
+def client(monkeypatch):
+    for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+        monkeypatch.setenv(name, 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with mock_aws():
+        client = boto3.client('s3')
+        client.create_bucket(Bucket=s3.BUCKET)
+
+        def no_copies(*args, **kw):
+            raise AssertionError('object copied')
+
+        monkeypatch.setattr(client, 'copy', no_copies)
+        monkeypatch.setattr(client, 'copy_object', no_copies)
+        yield client
+
+
+def test_upload_file_records_sha256_in_metadata(client, tmpdir):
+    path = tmpdir.join('WS900-report.csv')
+    path.write_binary(b'report')
+    sha256 = s3.upload_file(client, str(path), 'db-migration/report.csv')
+    assert sha256 == hashlib.sha256(b'report').hexdigest()
+    response = s3.head(client, 'db-migration/report.csv')
+    assert response['Metadata']['sha256'] == sha256
+    assert s3.object_sha256(client, 'db-migration/report.csv') == sha256
+
+
+def test_multipart_writer_records_sha256(client):
+    data = b'x' * (s3.MIN_PART_SIZE + 10)
+    with s3.MultipartWriter('db-migration/a.tar.xz',
+                            client=client,
+                            part_size=s3.MIN_PART_SIZE) as writer:
+        writer.write(data)
+    assert (client.get_object(Bucket=s3.BUCKET,
+                              Key='db-migration/a.tar.xz')['Body'].read() ==
+            data)
+    assert (s3.object_sha256(client, 'db-migration/a.tar.xz') ==
+            hashlib.sha256(data).hexdigest())
+
+
+def test_multipart_writer_removes_previous_sha256(client):
+    with s3.MultipartWriter('db-migration/a.tar.xz', client=client) as w:
+        w.write(b'first')
+    try:
+        with s3.MultipartWriter('db-migration/a.tar.xz', client=client) as w:
+            raise RuntimeError('archive failed')
+    except RuntimeError:
+        pass
+    assert s3.object_sha256(client, 'db-migration/a.tar.xz') is None
+
+
+def test_object_sha256_of_missing_object(client):
+    assert s3.object_sha256(client, 'db-migration/missing') is None
+
+
+@pytest.mark.parametrize('read_size', [-1, 1, 777, 2500])
+def test_ranged_reader(client, read_size):
+    data = os.urandom(10007)
+    client.put_object(Bucket=s3.BUCKET, Key='db-migration/a.tar.xz',
+                      Body=data)
+    with s3.RangedReader('db-migration/a.tar.xz',
+                         client=client,
+                         part_size=1000,
+                         max_concurrency=3) as reader:
+        assert reader.size == len(data)
+        chunks = list(iter(lambda: reader.read(read_size), b''))
+        assert reader.finished is not None
+    assert b''.join(chunks) == data
+    if read_size > 0:
+        assert {len(chunk) for chunk in chunks[:-1]} == {read_size}
+    assert reader.n_bytes == len(data)
+    assert reader.digest.hexdigest() == hashlib.sha256(data).hexdigest()
+
+
+def test_ranged_reader_of_missing_object(client):
+    with pytest.raises(FileNotFoundError):
+        s3.RangedReader('db-migration/missing.tar.xz', client=client)
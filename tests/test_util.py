@@ -0,0 +1,104 @@
+import threading
+import time
+
+import pytest
+
+from azanium import util
+
+
+def test_kill_process_groups_kills_running_commands():
+    errors = []
+
+    def run():
+        try:
+            util.local('sleep 60 | cat', sample_interval=0)
+        except util.LocalCommandError as err:
+            errors.append(err)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    deadline = time.time() + 10
+    while not util._process_groups and time.time() < deadline:
+        time.sleep(0.05)
+    util.kill_process_groups()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert len(errors) == 1
+    assert not util._process_groups
+
+
+def test_local_raises_on_failure():
+    with pytest.raises(util.LocalCommandError):
+        util.local('exit 3', sample_interval=0)
+
+
+def test_synced_shelf_concurrent_updates(tmpdir):
+    shelf = util.SyncedShelf(str(tmpdir.join('state')))
+
+    def update(n):
+        with shelf.lock:
+            items = shelf.get('items', {})
+            time.sleep(0.001)
+            items[n] = n
+            shelf['items'] = items
+
+    threads = [threading.Thread(target=update, args=(n,)) for n in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert shelf['items'] == {n: n for n in range(20)}
+    shelf.close()
+
+
+def test_file_manifest(tmpdir):
+    manifest = util.FileManifest(util.SyncedShelf(str(tmpdir.join('state'))),
+                                 'compress')
+    path = tmpdir.join('a.ace')
+    path.write_binary(b'abc')
+    out_path = tmpdir.join('a.ace.gz')
+    out_path.write_binary(b'compressed')
+    assert not manifest.is_done(str(path), str(out_path))
+    manifest.record(str(path), str(out_path), util.file_stat(str(path)))
+    assert manifest.is_done(str(path), str(out_path))
+    assert manifest.entry(str(path))['output_sha256'] == util.sha256sum(
+        str(out_path))
+    # Without the input, e.g removed once compressed.
+    input_stat = util.file_stat(str(path))
+    path.remove()
+    assert manifest.is_done(str(path), str(out_path))
+    # A changed input invalidates the entry.
+    path.write_binary(b'abcd')
+    assert not manifest.is_done(str(path), str(out_path))
+    manifest.record(str(path), str(out_path), input_stat)
+    assert not manifest.is_done(str(path), str(out_path))
+    manifest.record(str(path), str(out_path), util.file_stat(str(path)))
+    assert manifest.is_done(str(path), str(out_path))
+    # As does a changed output.
+    out_path.write_binary(b'compressed again')
+    assert not manifest.is_done(str(path), str(out_path))
+    manifest.record(str(path), str(out_path), util.file_stat(str(path)))
+    out_path.remove()
+    assert not manifest.is_done(str(path), str(out_path))
+
+
+def test_file_manifest_in_place(tmpdir):
+    state = util.SyncedShelf(str(tmpdir.join('state')))
+    manifest = util.FileManifest(state, 'sort')
+    path = str(tmpdir.join('log.edn.gz'))
+    with open(path, 'wb') as fp:
+        fp.write(b'unsorted')
+    input_stat = util.file_stat(path)
+    with open(path, 'wb') as fp:
+        fp.write(b'sorted!!')
+    manifest.record(path, path, input_stat)
+    assert manifest.is_done(path, path)
+    # Recorded per step.
+    assert not util.FileManifest(state, 'other').is_done(path, path)
+    with open(path, 'ab') as fp:
+        fp.write(b'\n')
+    assert not manifest.is_done(path, path)
+    manifest.record(path, path, input_stat)
+    manifest.clear()
+    assert manifest.entry(path) is None
+    assert not manifest.is_done(path, path)